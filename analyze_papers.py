@@ -2,7 +2,9 @@
 import asyncio
 import json
 import random
-from typing import List, Dict, Any
+import re
+from contextlib import aclosing
+from typing import List, Dict, Any, Callable, Optional
 from pydantic import BaseModel, Field
 from models import (
     Paper,
@@ -15,12 +17,16 @@ from models import (
     RankingResponse,
     PaperRanking
 )
-from llm_api_handler import LLMAPIHandler
+from llm_api_handler import LLMAPIHandler, as_completed_bounded, get_handler
+from token_budget import chunk_text, count_tokens
 from logger_config import get_logger
 import traceback
 
 logger = get_logger(__name__)
 
+# Papers with less full text than this are not worth analyzing
+MIN_FULL_TEXT_WORDS = 200
+
 RANKING_PROMPT = """
 Analyze the relevance of the following papers to the query: "{claim}"
 
@@ -33,7 +39,7 @@ Rank these papers from most to least relevant based on the following criteria:
 3. Recency and impact of the findings
 4. Presence of relevant information. If methods or results section are not present in full detail, the paper cannot be considered evaluative of the claim and should be ranked lower.
 
-Focus primarily on the full text content of each paper. Other metadata (title, authors, etc.) may be missing or incomplete, but should not significantly affect your ranking if the full text is present.
+Focus primarily on the content given for each paper (its abstract, where available). Other metadata (title, authors, etc.) may be missing or incomplete, but should not significantly affect your ranking if the content is present.
 
 Your response should be in the following JSON format:
 {{
@@ -81,6 +87,77 @@ Extract exactly three relevant quotes from the paper that best support your anal
 Ensure your analysis is highly precise, technical, and grounded in the paper's content. Avoid general statements and focus on ultra specific details from the methods, results, and discussion sections.
 """
 
+CHUNK_ANALYSIS_PROMPT = """
+You are reading part {part} of {num_parts} of a long paper. Extract everything in this part that bears on the query: "{claim}"
+
+Paper Details:
+Title: {title}
+Authors: {authors}
+Publication Year: {year}
+doi: {doi}
+Text of part {part}: {chunk}
+
+Your response must be in the following JSON format:
+{{
+  "analysis": "string. Dense technical notes on methods, sample sizes, results, statistics and limitations in this part that support or refute the claim. Write 'No relevant content.' if there is none.",
+  "relevant_quotes": [
+    "string. Verbatim excerpt from this part that bears directly on the claim"
+  ]
+}}
+
+Only report what this part of the text says. Return at most three quotes and an empty list if none are relevant.
+"""
+
+REDUCE_ANALYSIS_PROMPT = """
+Provide a super detailed, ultra technical analysis of the following paper's relevance to the query: "{claim}"
+
+The paper was too long to read at once, so it was read in {num_parts} parts. Below are the notes and verbatim quotes extracted from each part, in order.
+
+Paper Details:
+Title: {title}
+Authors: {authors}
+Publication Year: {year}
+doi: {doi}
+
+Notes by part:
+{chunk_notes}
+
+Your response must be in the following JSON format:
+{{
+  "analysis": "string, 500 words minimum",
+  "relevant_quotes": [
+    "string, 100 words minimum. Really extract a big chunk of what you think is the crux of the paper",
+    "string, 100 words minimum. Really extract a big chunk of what you think is the crux of the paper",
+    "string, 100 words minimum. Really extract a big chunk of what you think is the crux of the paper"
+  ]
+}}
+
+In the analysis:
+1. Evaluate how directly the paper addresses the claim, either supporting or refuting it.
+2. Assess the methodology, sample size, and statistical significance of the findings if relevant.
+3. Consider any limitations or potential biases in the study.
+4. Discuss how the paper's findings contribute to the broader understanding of the claim. Devote most of your time to this.
+
+Choose exactly three quotes from the notes above that best support your analysis. Copy them verbatim; do not invent quotes.
+"""
+
+def is_consistent_ranking(group: List[Paper], response: Any) -> bool:
+    """Whether `response` ranks exactly the papers in `group`, each once, with ranks 1..len(group)."""
+    if not isinstance(response, RankingResponse):
+        return False
+    ids = [ranking.paper_id for ranking in response.rankings]
+    ranks = sorted(ranking.rank for ranking in response.rankings)
+    return sorted(ids) == sorted(paper.id for paper in group) and ranks == list(range(1, len(group) + 1))
+
+
+def is_complete_analysis(response: Any) -> bool:
+    return isinstance(response, PaperAnalysis) and bool(response.analysis.strip()) and bool(response.relevant_quotes)
+
+
+def has_usable_full_text(paper: Paper) -> bool:
+    return bool(paper.full_text) and len(paper.full_text.split()) >= MIN_FULL_TEXT_WORDS
+
+
 def create_balanced_groups(papers: List[Paper], min_group_size: int = 2, max_group_size: int = 5) -> List[List[Paper]]:
     num_papers = len(papers)
     logger.info(f"Creating balanced groups for {num_papers} papers")
@@ -121,10 +198,25 @@ def create_balanced_groups(papers: List[Paper], min_group_size: int = 2, max_gro
         return [papers]
 
 class PaperAnalyzer:
-    def __init__(self):
-        self.llm_api_handler = LLMAPIHandler()
+    def __init__(self,
+                 single_pass_tokens: int = 24_000,
+                 chunk_tokens: int = 6_000,
+                 chunk_overlap_tokens: int = 200,
+                 paper_token_budget: int = 48_000):
+        """
+        Papers whose full text fits in `single_pass_tokens` are analyzed with one call. Longer ones
+        are split into `chunk_tokens` chunks, analyzed concurrently (map) and combined (reduce).
+        At most `paper_token_budget` tokens of each paper are sent to the map step; beyond that,
+        the chunks sharing the most terms with the claim are kept.
+        """
+        self.llm_api_handler = get_handler()
+        self.single_pass_tokens = single_pass_tokens
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap_tokens = chunk_overlap_tokens
+        self.paper_token_budget = paper_token_budget
 
-    async def analyze_papers(self, search_results: SearchResults, claim: str) -> RankedPapers:
+    async def analyze_papers(self, search_results: SearchResults, claim: str,
+                             on_paper_analyzed: Optional[Callable[[int, RankedPaper], Any]] = None) -> RankedPapers:
         papers = []
         for i, result in enumerate(search_results.results):
             paper = Paper(
@@ -132,19 +224,32 @@ class PaperAnalyzer:
                 doi=result.doi,
                 title=result.title,
                 authors=result.authors,
-                year=result.publication_year,
-                full_text=result.full_text
+                publication_year=result.publication_year,
+                abstract=result.abstract,
+                full_text=result.full_text,
+                full_text_loader=result.full_text_loader
             )
             papers.append(paper)
 
         logger.info(f"Analyzing {len(papers)} papers for claim: {claim}")
-        ranked_papers = await self.rank_papers(papers, claim)
+        ranked_papers = await self.rank_papers(papers, claim, on_paper_analyzed=on_paper_analyzed)
         return RankedPapers(papers=ranked_papers)
 
-    async def rank_papers(self, papers: List[Paper], claim: str, num_rounds: int = 3, top_n: int = 5) -> List[RankedPaper]:
+    async def rank_papers(self, papers: List[Paper], claim: str, num_rounds: int = 3, top_n: int = 5,
+                          on_paper_analyzed: Optional[Callable[[int, RankedPaper], Any]] = None) -> List[RankedPaper]:
+        """
+        Rank papers over several shuffled rounds, then analyze the top_n.
+
+        Ranking only uses titles and abstracts, so papers from a metadata-only search (with a
+        `full_text_loader`) are ranked as they are; full texts are fetched for the finalists only.
+
+        `on_paper_analyzed` is called with each paper's 1-based rank and RankedPaper as soon as
+        its analysis completes, so callers can display results progressively. Analyses finish in
+        any order; the returned list is in score order.
+        """
         logger.info(f"Starting to rank {len(papers)} papers")
 
-        valid_papers = [paper for paper in papers if paper.full_text and len(paper.full_text.split()) >= 200]
+        valid_papers = [paper for paper in papers if has_usable_full_text(paper) or paper.full_text_loader is not None]
         logger.info(f"After filtering, {len(valid_papers)} valid papers remain")
         
         if not valid_papers:
@@ -165,6 +270,7 @@ class PaperAnalyzer:
                 paper_summaries = "\n".join([
                     f"Paper ID: {paper.id}\n"
                     f"Title: {paper.title}"
+                    + (f"\nAbstract: {paper.abstract}" if paper.abstract else "")
                     for paper in group
                 ])
                 prompt = RANKING_PROMPT.format(claim=claim, paper_summaries=paper_summaries, num_papers=len(group))
@@ -173,12 +279,16 @@ class PaperAnalyzer:
         prompts = [prompt for group, prompt in all_prompts]
         logger.debug(f"Sending {len(prompts)} prompts for batch ranking")
         try:
-            rankings_responses = await self.llm_api_handler.async_process(
+            # Cheapest tier first; groups with failed or inconsistent rankings are escalated
+            rankings_responses = await self.llm_api_handler.async_process_cascade(
                 prompts=prompts,
-                model="gpt-4o-mini",
+                task="ranking",
+                validate=lambda i, response: is_consistent_ranking(all_prompts[i][0], response),
                 system_message="You are a helpful assistant tasked with ranking research papers.",
                 temperature=0.6,
-                response_format=RankingResponse
+                response_format=RankingResponse,
+                return_exceptions=True,
+                stage="ranking"
             )
             logger.debug(f"Received {len(rankings_responses)} ranking responses")
         except Exception as e:
@@ -189,6 +299,10 @@ class PaperAnalyzer:
         for (group, prompt), ranking_response in zip(all_prompts, rankings_responses):
             logger.debug(f"Processing rankings for group of {len(group)} papers")
             logger.debug(f"Rankings received: {ranking_response}")
+
+            if isinstance(ranking_response, Exception):
+                logger.warning(f"Ranking failed for a group of {len(group)} papers: {ranking_response}")
+                continue
             
             if not isinstance(ranking_response, RankingResponse):
                 logger.warning(f"Unexpected ranking response format. Expected RankingResponse, got: {type(ranking_response)}")
@@ -218,28 +332,68 @@ class PaperAnalyzer:
         for paper in sorted_papers:
             logger.info(f"Paper ID: {paper.id}, Title: {paper.title}, Average Score: {average_scores[paper.id]:.2f}")
 
-        top_papers = sorted_papers[:top_n]
-        analysis_tasks = [self.analyze_paper(claim, paper) for paper in top_papers]
-        paper_analyses = await asyncio.gather(*analysis_tasks)
-        
-        ranked_papers = []
-        for paper, analysis in zip(top_papers, paper_analyses):
-            ranked_paper = RankedPaper(
-                id=paper.id,
-                doi=paper.doi,
-                title=paper.title,
-                authors=paper.authors,
-                year=paper.publication_year,
-                relevance_score=average_scores[paper.id],
-                analysis=analysis.analysis,
-                relevant_quotes=analysis.relevant_quotes
-            )
-            ranked_papers.append(ranked_paper)
+        top_papers = await self.load_finalists(sorted_papers, top_n)
+        if not top_papers:
+            logger.warning("None of the ranked papers has a usable full text. Returning empty list.")
+            return []
+        ranked_by_index: Dict[int, RankedPaper] = {}
+        analyses = as_completed_bounded(self.analyze_paper(claim, paper) for paper in top_papers)
+        async with aclosing(analyses):
+            async for index, analysis in analyses:
+                paper = top_papers[index]
+                if isinstance(analysis, Exception):
+                    logger.error(f"Analysis failed for paper {paper.id}: {analysis}")
+                    analysis = PaperAnalysis(analysis="", relevant_quotes=[])
+                ranked_paper = RankedPaper(
+                    id=paper.id,
+                    doi=paper.doi,
+                    title=paper.title,
+                    authors=paper.authors,
+                    publication_year=paper.publication_year,
+                    relevance_score=average_scores[paper.id],
+                    analysis=analysis.analysis,
+                    relevant_quotes=analysis.relevant_quotes
+                )
+                ranked_by_index[index] = ranked_paper
+                if on_paper_analyzed is not None:
+                    on_paper_analyzed(index + 1, ranked_paper)
+
+        ranked_papers = [ranked_by_index[i] for i in range(len(top_papers))]
         
         logger.info(f"Completed paper ranking. Top score: {ranked_papers[0].relevance_score:.2f}, Bottom score: {ranked_papers[-1].relevance_score:.2f}")
         return ranked_papers
 
+    async def load_finalists(self, candidates: List[Paper], top_n: int) -> List[Paper]:
+        """
+        The first `top_n` candidates, in ranking order, that have a usable full text. Deferred
+        full texts are fetched here, only as many at a time as finalists are still missing, and a
+        candidate whose text turns out unusable is replaced by the next one.
+        """
+        finalists: List[Paper] = []
+        remaining = list(candidates)
+        while remaining and len(finalists) < top_n:
+            batch, remaining = remaining[:top_n - len(finalists)], remaining[top_n - len(finalists):]
+            loaded = await asyncio.gather(*(self._load_full_text(paper) for paper in batch))
+            finalists.extend(paper for paper in loaded if paper is not None)
+        return finalists
+
+    async def _load_full_text(self, paper: Paper) -> Optional[Paper]:
+        if not paper.full_text and paper.full_text_loader is not None:
+            try:
+                full_text = await paper.full_text_loader()
+            except Exception as e:
+                logger.warning(f"Could not load the full text of paper {paper.id}: {e}")
+                return None
+            paper = paper.model_copy(update={"full_text": full_text, "full_text_loader": None})
+        if not has_usable_full_text(paper):
+            logger.info(f"Skipping paper {paper.id} without a usable full text: {paper.title}")
+            return None
+        return paper
+
     async def analyze_paper(self, claim: str, paper: Paper) -> PaperAnalysis:
+        if count_tokens(paper.full_text or "") > self.single_pass_tokens:
+            return await self.analyze_paper_map_reduce(claim, paper)
+
         prompt = ANALYSIS_PROMPT.format(
             claim=claim,
             full_text=paper.full_text,
@@ -253,12 +407,14 @@ class PaperAnalyzer:
         logger.debug(f"Analysis prompt: {prompt[:100]}...")
         
         try:
-            analysis_response = await self.llm_api_handler.async_process(
+            analysis_response = await self.llm_api_handler.async_process_cascade(
                 prompts=[prompt],
-                model="gpt-4o-mini",
+                task="analysis",
+                validate=lambda i, response: is_complete_analysis(response),
                 system_message="You are a helpful assistant tasked with analyzing research papers.",
                 temperature=0.6,
-                response_format=PaperAnalysis   
+                response_format=PaperAnalysis,
+                stage="analysis"
             )
             analysis = analysis_response[0]
             logger.debug(f"Paper Analysis: {analysis}")
@@ -275,6 +431,74 @@ class PaperAnalyzer:
             logger.error(traceback.format_exc())
             return PaperAnalysis(analysis="", relevant_quotes=[])
 
+    async def analyze_paper_map_reduce(self, claim: str, paper: Paper) -> PaperAnalysis:
+        """Analyze a long paper chunk by chunk, then reduce the chunk notes into one PaperAnalysis."""
+        chunks = self._select_chunks(claim, chunk_text(
+            paper.full_text, self.chunk_tokens, self.chunk_overlap_tokens))
+        logger.info(f"Analyzing '{paper.title}' in {len(chunks)} chunks")
+        details = dict(claim=claim, title=paper.title, authors=paper.authors,
+                       year=paper.publication_year, doi=paper.doi)
+
+        try:
+            # Chunk notes stay on the cheapest tier; only the combined analysis may escalate
+            chunk_analyses = await self.llm_api_handler.async_process(
+                prompts=[CHUNK_ANALYSIS_PROMPT.format(part=i + 1, num_parts=len(chunks), chunk=chunk, **details)
+                         for i, chunk in enumerate(chunks)],
+                model=self.llm_api_handler.model_registry.primary("analysis"),
+                system_message="You are a helpful assistant tasked with extracting evidence from research papers.",
+                temperature=0.3,
+                response_format=PaperAnalysis,
+                return_exceptions=True,
+                stage="analysis"
+            )
+            chunk_notes = []
+            for i, chunk_analysis in enumerate(chunk_analyses):
+                if not isinstance(chunk_analysis, PaperAnalysis):
+                    logger.warning(f"Skipping chunk {i + 1} of '{paper.title}': {chunk_analysis!r}")
+                    continue
+                quotes = "\n".join(f'- "{quote}"' for quote in chunk_analysis.relevant_quotes)
+                chunk_notes.append(f"Part {i + 1}:\n{chunk_analysis.analysis}\nQuotes:\n{quotes or '- none'}")
+            if not chunk_notes:
+                raise ValueError("No chunk of the paper could be analyzed")
+
+            reduced = await self.llm_api_handler.async_process_cascade(
+                prompts=[REDUCE_ANALYSIS_PROMPT.format(
+                    num_parts=len(chunks), chunk_notes="\n\n".join(chunk_notes), **details)],
+                task="analysis",
+                validate=lambda i, response: is_complete_analysis(response),
+                system_message="You are a helpful assistant tasked with analyzing research papers.",
+                temperature=0.6,
+                response_format=PaperAnalysis,
+                stage="analysis"
+            )
+            analysis = reduced[0]
+            if not isinstance(analysis, PaperAnalysis):
+                raise ValueError(f"Unexpected analysis type: {type(analysis)}")
+            return analysis
+        except Exception as e:
+            logger.error(f"Error during map-reduce analysis of '{paper.title}': {str(e)}")
+            logger.error(traceback.format_exc())
+            return PaperAnalysis(analysis="", relevant_quotes=[])
+
+    def _select_chunks(self, claim: str, chunks: List[str]) -> List[str]:
+        """Keep chunks within the per-paper token budget, preferring those that share the most terms with the claim."""
+        sizes = [count_tokens(chunk) for chunk in chunks]
+        if sum(sizes) <= self.paper_token_budget:
+            return chunks
+
+        terms = {word for word in re.findall(r"[a-z0-9]+", claim.lower()) if len(word) > 3}
+        def overlap(i: int) -> int:
+            words = re.findall(r"[a-z0-9]+", chunks[i].lower())
+            return sum(1 for word in words if word in terms)
+
+        kept, used = set(), 0
+        for i in sorted(range(len(chunks)), key=lambda i: (-overlap(i), i)):
+            if used + sizes[i] <= self.paper_token_budget:
+                kept.add(i)
+                used += sizes[i]
+        logger.info(f"Token budget keeps {len(kept)} of {len(chunks)} chunks ({used} tokens)")
+        return [chunks[i] for i in sorted(kept)]
+
 async def main(search_queries: SearchQueries, search_results: SearchResults, claim: str, top_n: int = 5):
     analyzer = PaperAnalyzer()
     analysis_results = await analyzer.analyze_papers(search_results, claim)
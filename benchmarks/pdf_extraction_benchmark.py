@@ -0,0 +1,90 @@
+"""
+PDF text extraction benchmark.
+
+Generates a sample corpus of PDFs: many short papers plus a few long ones, where long
+documents are what pin a worker. It then extracts the whole corpus concurrently with each
+PDFExtractor mode and reports the median wall time. Use this to choose PDF_EXTRACT_MODE and
+PDF_EXTRACT_WORKERS for a machine.
+
+Usage:
+    python benchmarks/pdf_extraction_benchmark.py [--short 20] [--long 2] [--long-pages 200] [--workers 4] [--repeat 3]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from searchers.pdf_extraction import EXTRACTION_MODES, PDFExtractor  # noqa: E402
+
+LINE = "Results indicate that irrigation scheduling reduced water use by 18 percent across sites. "
+
+
+def make_pdf(path: str, pages: int) -> None:
+    import fitz
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        text = "\n".join(f"{page_number}.{line} {LINE}" for line in range(45))
+        page.insert_textbox(fitz.Rect(36, 36, 576, 756), text, fontsize=7)
+    doc.save(path)
+    doc.close()
+
+
+def make_corpus(directory: str, short: int, long: int, short_pages: int, long_pages: int):
+    paths = []
+    for i in range(short + long):
+        path = os.path.join(directory, f"paper_{i}.pdf")
+        make_pdf(path, long_pages if i < long else short_pages)
+        paths.append(path)
+    return paths
+
+
+async def extract_all(extractor: PDFExtractor, paths) -> int:
+    texts = await asyncio.gather(*(extractor.extract(path) for path in paths))
+    return sum(len(text) for text in texts)
+
+
+def run_mode(mode: str, paths, workers: int, repeat: int, pages_per_task: int):
+    extractor = PDFExtractor(mode=mode, max_workers=workers, pages_per_task=pages_per_task)
+    try:
+        # Warm-up run starts the pool (and worker imports) outside the timings
+        characters = asyncio.run(extract_all(extractor, paths[:1]))
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            characters = asyncio.run(extract_all(extractor, paths))
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings), characters
+    finally:
+        extractor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--short", type=int, default=20, help="number of short documents")
+    parser.add_argument("--long", type=int, default=2, help="number of long documents")
+    parser.add_argument("--short-pages", type=int, default=12)
+    parser.add_argument("--long-pages", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1))
+    parser.add_argument("--pages-per-task", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_corpus(directory, args.short, args.long, args.short_pages, args.long_pages)
+        total_pages = args.short * args.short_pages + args.long * args.long_pages
+        print(f"{len(paths)} documents, {total_pages} pages, {args.workers} workers")
+        print(f"{'mode':<10} {'median':>9} {'pages/s':>9}")
+        for mode in EXTRACTION_MODES:
+            median, _ = run_mode(mode, paths, args.workers, args.repeat, args.pages_per_task)
+            print(f"{mode:<10} {median * 1000:>7.0f}ms {total_pages / median:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
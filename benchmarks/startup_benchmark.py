@@ -0,0 +1,82 @@
+"""
+Startup-time benchmark.
+
+Runs each scenario in a fresh interpreter and reports the median wall time, so
+module import costs are measured cold. The "all clients" scenario builds every
+SDK client up front, which is what each LLMAPIHandler() used to do eagerly;
+the difference from "pipeline components" is the startup work now deferred to
+first use.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--repeat 5]
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "import llm_api_handler": "import llm_api_handler",
+    "import searchers": "import searchers",
+    "pipeline components": (
+        "from get_search_queries import QueryGenerator\n"
+        "from analyze_papers import PaperAnalyzer\n"
+        "from synthesize_results import ResultSynthesizer\n"
+        "import searchers\n"
+        "QueryGenerator(); PaperAnalyzer(); ResultSynthesizer()\n"
+    ),
+    "pipeline components + all clients": (
+        "from get_search_queries import QueryGenerator\n"
+        "from analyze_papers import PaperAnalyzer\n"
+        "from synthesize_results import ResultSynthesizer\n"
+        "import searchers\n"
+        "handlers = {id(c.llm_api_handler): c.llm_api_handler\n"
+        "            for c in (QueryGenerator(), PaperAnalyzer(), ResultSynthesizer())}\n"
+        "for h in handlers.values():\n"
+        "    h.openai_client, h.anthropic_client, h.async_openai_client, h.async_anthropic_client\n"
+        "import fitz\n"
+    ),
+}
+
+TIMER = """
+import sys, time
+start = time.perf_counter()
+exec(compile({code!r}, "<scenario>", "exec"))
+elapsed = time.perf_counter() - start
+heavy = [m for m in ("openai", "anthropic", "fitz") if m in sys.modules]
+print(elapsed, ",".join(heavy) or "-")
+"""
+
+
+def run_scenario(code: str, repeat: int):
+    env = {**os.environ, "PYTHONPATH": REPO_ROOT}
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+    env.setdefault("ANTHROPIC_API_KEY", "benchmark")
+    timings = []
+    heavy = "-"
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", TIMER.format(code=code)],
+            cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        elapsed, heavy = output.split()
+        timings.append(float(elapsed))
+    return statistics.median(timings), heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per scenario")
+    args = parser.parse_args()
+
+    print(f"{'scenario':<40} {'median':>9}  heavy modules loaded")
+    for name, code in SCENARIOS.items():
+        median, heavy = run_scenario(code, args.repeat)
+        print(f"{name:<40} {median * 1000:>7.0f}ms  {heavy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Header names that carry request-level rate limit state, per provider
+REMAINING_REQUEST_HEADERS = ("x-ratelimit-remaining-requests", "anthropic-ratelimit-requests-remaining")
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse Retry-After style durations ("2", "1.5s", "6m0s", "250ms") into seconds."""
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    total = 0.0
+    number = ""
+    i = 0
+    while i < len(value):
+        char = value[i]
+        if char.isdigit() or char == ".":
+            number += char
+        elif value.startswith("ms", i):
+            total += float(number or 0) / 1000
+            number = ""
+            i += 1
+        elif char in "hms":
+            total += float(number or 0) * {"h": 3600, "m": 60, "s": 1}[char]
+            number = ""
+        else:
+            return None
+        i += 1
+    return total if not number else None
+
+
+def error_status(exc: BaseException) -> Optional[int]:
+    """HTTP status carried by an SDK error, if any."""
+    status = getattr(exc, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def error_headers(exc: BaseException) -> Mapping[str, str]:
+    """Response headers carried by an SDK error, if any."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    return headers if headers is not None else {}
+
+
+class SlotReport:
+    """Filled in by the holder of an `AIMDController.slot` with what the provider's response said."""
+
+    def __init__(self):
+        self.headers: Optional[Mapping[str, str]] = None
+
+
+class AIMDController:
+    """
+    Adaptive concurrency limit using additive-increase / multiplicative-decrease.
+
+    The limit grows by roughly `increase_step` per round trip while the controller is
+    saturated and latency stays near its baseline. It is cut by `decrease_factor` on a 429
+    and by `latency_decrease_factor` when smoothed latency exceeds `latency_tolerance`
+    times the baseline. A Retry-After value pauses new dispatches until it elapses.
+
+    Latency is tracked separately per `key` (the pipeline stage), so a mix of short and long
+    requests through one model does not read as a slowdown.
+    """
+
+    def __init__(self,
+                 name: str = "default",
+                 initial_limit: int = 16,
+                 min_limit: int = 1,
+                 max_limit: int = 512,
+                 increase_step: float = 1.0,
+                 decrease_factor: float = 0.5,
+                 latency_decrease_factor: float = 0.9,
+                 latency_tolerance: float = 2.5,
+                 cooldown: float = 1.0):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.latency_decrease_factor = latency_decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        # key -> [smoothed latency, baseline latency]
+        self._latency: Dict[Optional[str], List[float]] = {}
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self._in_flight,
+            "queue_depth": self.queue_depth,
+            "latency": {key or "default": {"ewma": ewma, "baseline": baseline}
+                        for key, (ewma, baseline) in self._latency.items()},
+            "paused_for": max(0.0, self._paused_until - time.monotonic()),
+        }
+
+    async def acquire(self) -> None:
+        """Wait for a free slot, then honour any active Retry-After pause."""
+        if self._in_flight < self.limit and not self._waiters:
+            self._in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed to us just as we were cancelled; pass it on.
+                    self.release()
+                else:
+                    try:
+                        self._waiters.remove(waiter)
+                    except ValueError:
+                        pass
+                raise
+
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.release()
+                raise
+
+    def release(self) -> None:
+        self._in_flight = max(0, self._in_flight - 1)
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, key: Optional[str] = None):
+        """
+        Hold a slot for one request and feed its outcome back into the controller. The yielded
+        SlotReport takes the response headers of a successful request; `key` groups latencies.
+        """
+        await self.acquire()
+        start = time.monotonic()
+        report = SlotReport()
+        try:
+            yield report
+        except BaseException as exc:
+            if error_status(exc) == 429:
+                self.on_rate_limited(error_headers(exc))
+            raise
+        else:
+            self.on_success(time.monotonic() - start, report.headers, key=key)
+        finally:
+            self.release()
+
+    def on_success(self, latency: float, headers: Optional[Mapping[str, str]] = None,
+                   key: Optional[str] = None) -> None:
+        stats = self._latency.get(key)
+        if stats is None:
+            stats = self._latency[key] = [latency, latency]
+        else:
+            stats[0] = 0.8 * stats[0] + 0.2 * latency
+            # The baseline tracks the fastest recent latency, drifting up slowly so it can recover.
+            stats[1] = min(latency, stats[1] + 0.01 * (latency - stats[1]))
+        ewma, baseline = stats
+
+        if headers:
+            self.observe_headers(headers)
+
+        if ewma > self.latency_tolerance * baseline:
+            self._decrease(self.latency_decrease_factor, "latency")
+        elif self._in_flight >= self.limit - 1 or self._waiters:
+            self._limit = min(self.max_limit, self._limit + self.increase_step / max(self._limit, 1.0))
+            self._wake()
+
+    def on_rate_limited(self, headers: Optional[Mapping[str, str]] = None) -> None:
+        self._decrease(self.decrease_factor, "429")
+        if headers:
+            self.observe_headers(headers)
+
+    def observe_headers(self, headers: Mapping[str, str]) -> None:
+        """React to Retry-After and remaining-request headers from the provider."""
+        lowered = {str(k).lower(): v for k, v in dict(headers).items()}
+        retry_after = parse_duration(lowered.get("retry-after-ms"))
+        if retry_after is not None:
+            retry_after /= 1000
+        else:
+            retry_after = parse_duration(lowered.get("retry-after"))
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+        for header in REMAINING_REQUEST_HEADERS:
+            remaining = lowered.get(header)
+            if remaining is not None and str(remaining).isdigit():
+                remaining = int(remaining)
+                if remaining < self._in_flight:
+                    self._decrease(self.decrease_factor, f"{header}={remaining}")
+                break
+
+    def _decrease(self, factor: float, reason: str) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self._limit = max(float(self.min_limit), self._limit * factor)
+        logger.info(f"Concurrency for {self.name} reduced from {previous} to {self.limit} ({reason})")
+
+    def _wake(self) -> None:
+        while self._waiters and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._in_flight += 1
+                waiter.set_result(None)
+
+
+class ConcurrencyRegistry:
+    """Hands out one AIMDController per (provider, model), created on first use."""
+
+    def __init__(self, overrides: Optional[Dict[str, Dict[str, Any]]] = None, **defaults):
+        # `overrides` maps "provider" or "provider:model" to controller keyword arguments
+        self.overrides = overrides or {}
+        self.defaults = defaults
+        self._controllers: Dict[Tuple[str, str], AIMDController] = {}
+
+    def get(self, provider: str, model: str) -> AIMDController:
+        key = (provider, model)
+        controller = self._controllers.get(key)
+        if controller is None:
+            settings = {**self.defaults,
+                        **self.overrides.get(provider, {}),
+                        **self.overrides.get(f"{provider}:{model}", {})}
+            controller = AIMDController(name=f"{provider}:{model}", **settings)
+            self._controllers[key] = controller
+        return controller
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {controller.name: controller.stats() for controller in self._controllers.values()}
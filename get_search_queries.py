@@ -1,7 +1,8 @@
 import asyncio
 from typing import List
 
-from llm_api_handler import LLMAPIHandler
+from http_pools import get_pools
+from llm_api_handler import LLMAPIHandler, get_handler
 from logger_config import get_logger
 from models import SearchQueries
 
@@ -54,7 +55,7 @@ Search Guidance:
 
 class QueryGenerator:
     def __init__(self):
-        self.llm_api_handler = LLMAPIHandler()
+        self.llm_api_handler = get_handler()
 
     async def generate_queries(self, user_query: str, num_queries: int = 5) -> SearchQueries:
         prompt = GENERATE_QUERIES_PROMPT.format(
@@ -64,10 +65,11 @@ class QueryGenerator:
         )
         
         try:
-            responses = await self.llm_api_handler.async_process(
+            responses = await self.llm_api_handler.async_process_cascade(
                 prompts=[prompt],
-                model="gpt-4o-mini",
-                response_format=SearchQueries
+                task="query_generation",
+                response_format=SearchQueries,
+                stage="query_generation"
             )
 
             if responses and isinstance(responses[0], SearchQueries):
@@ -80,9 +82,10 @@ class QueryGenerator:
             return SearchQueries(queries=[])
 
 async def main():
-    processor = QueryGenerator()
-    user_query = "Impact of climate change on global water resources"
-    queries = await processor.generate_queries(user_query)
+    async with get_pools():
+        processor = QueryGenerator()
+        user_query = "Impact of climate change on global water resources"
+        queries = await processor.generate_queries(user_query)
     print(queries.model_dump_json(indent=2))
 
 if __name__ == "__main__":
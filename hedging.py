@@ -0,0 +1,133 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """Sliding window of recent latencies for one model."""
+
+    def __init__(self, window: int = 500):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def observe(self, latency: float) -> None:
+        self._samples.append(latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class Hedger:
+    """
+    Hedged requests. A call that has not finished within the `percentile`-th latency of recent
+    calls with the same key (LLMAPIHandler uses the model and pipeline stage) gets a duplicate
+    (the backup). Whichever finishes first successfully
+    wins, and the other is cancelled.
+
+    Hedges are paid for from a credit balance that grows by `max_hedge_ratio` per request, up
+    to `burst`. So no more than that fraction of traffic is ever duplicated. Nothing is hedged
+    until a key has `min_samples` latencies.
+    """
+
+    def __init__(self,
+                 percentile: float = 95.0,
+                 max_hedge_ratio: float = 0.05,
+                 min_samples: int = 20,
+                 min_delay: float = 0.5,
+                 burst: float = 5.0,
+                 window: int = 500,
+                 fallback_models: Optional[Dict[str, str]] = None):
+        self.percentile = percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.burst = burst
+        self.window = window
+        # Optional model to send the backup to, e.g. {"gpt-4o-mini": "claude-3-5-sonnet-20240620"}
+        self.fallback_models = fallback_models or {}
+        self._trackers: Dict[Hashable, LatencyTracker] = {}
+        self._credit = 0.0
+        self.requests = 0
+        self.hedges = 0
+        self.backup_wins = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "backup_wins": self.backup_wins,
+            "hedge_ratio": self.hedges / self.requests if self.requests else 0.0,
+            "delays": {str(key): self.delay_for(key) for key in self._trackers},
+        }
+
+    def backup_model(self, model: str) -> str:
+        return self.fallback_models.get(model, model)
+
+    def observe(self, key: Hashable, latency: float) -> None:
+        tracker = self._trackers.get(key)
+        if tracker is None:
+            tracker = self._trackers[key] = LatencyTracker(self.window)
+        tracker.observe(latency)
+
+    def delay_for(self, key: Hashable) -> Optional[float]:
+        """Seconds to wait before hedging a call for `key`, or None while there is too little history."""
+        tracker = self._trackers.get(key)
+        if tracker is None or len(tracker) < self.min_samples:
+            return None
+        return max(self.min_delay, tracker.percentile(self.percentile))
+
+    def _spend(self) -> bool:
+        if self._credit >= 1.0:
+            self._credit -= 1.0
+            return True
+        return False
+
+    async def run(self,
+                  key: Hashable,
+                  primary: Callable[[], Awaitable[Any]],
+                  backup: Callable[[], Awaitable[Any]],
+                  can_hedge: Callable[[], bool] = lambda: True) -> Any:
+        """
+        Await `primary()`, hedging it with `backup()` if it runs past the hedge delay for `key`
+        and `can_hedge()` still holds. Errors are only raised once neither call can succeed.
+        """
+        self.requests += 1
+        self._credit = min(self.burst, self._credit + self.max_hedge_ratio)
+        start = time.monotonic()
+        primary_task = asyncio.ensure_future(primary())
+        tasks = {primary_task}
+        try:
+            delay = self.delay_for(key)
+            if delay is not None:
+                await asyncio.wait(tasks, timeout=delay)
+                if not primary_task.done() and can_hedge() and self._spend():
+                    self.hedges += 1
+                    logger.debug(f"Hedging {key} after {delay:.2f}s")
+                    tasks.add(asyncio.ensure_future(backup()))
+
+            first_error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary_task:
+                            self.backup_wins += 1
+                        self.observe(key, time.monotonic() - start)
+                        return task.result()
+                    if first_error is None or task is primary_task:
+                        first_error = task.exception()
+            raise first_error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,243 @@
+import os
+import asyncio
+import logging
+import threading
+import importlib
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# Origins contacted by `warm_up` by default: (origin, pool) pairs
+DEFAULT_WARM_UP_ORIGINS = (
+    ("https://api.openai.com", "openai"),
+    ("https://api.anthropic.com", "anthropic"),
+    ("https://api.core.ac.uk", "aiohttp"),
+    ("http://export.arxiv.org", "aiohttp"),
+)
+
+
+class TransportConfig(BaseModel):
+    """Connection pool settings shared by every HTTP client in the process."""
+    max_connections: int = 100
+    max_keepalive_connections: int = 50
+    keepalive_expiry: float = 60.0
+    max_connections_per_host: int = 0  # aiohttp only; 0 means no per-host limit
+    dns_cache_ttl: int = 300  # aiohttp only
+    http2: bool = False  # SDK clients only; needs the optional `h2` package
+    connect_timeout: float = 10.0
+    warm_up_timeout: float = 5.0
+
+    @classmethod
+    def from_env(cls) -> "TransportConfig":
+        """Override defaults with HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY,
+        HTTP_DNS_CACHE_TTL and LLM_HTTP2."""
+        overrides: Dict[str, Any] = {}
+        for env, field in (("HTTP_MAX_CONNECTIONS", "max_connections"),
+                           ("HTTP_MAX_KEEPALIVE", "max_keepalive_connections"),
+                           ("HTTP_KEEPALIVE_EXPIRY", "keepalive_expiry"),
+                           ("HTTP_DNS_CACHE_TTL", "dns_cache_ttl"),
+                           ("LLM_HTTP2", "http2")):
+            value = os.getenv(env)
+            if value:
+                overrides[field] = value
+        return cls(**overrides)
+
+
+# Set by `capture_response_headers`; the SDK transports append each response's headers to it
+_header_sink: ContextVar[Optional[List[Mapping[str, str]]]] = ContextVar("response_header_sink", default=None)
+
+
+@contextmanager
+def capture_response_headers() -> Iterator[List[Mapping[str, str]]]:
+    """
+    Collect the headers of every response the pooled SDK clients receive in this context
+    (including the SDK's own retries), e.g. to read rate-limit headers from successful calls.
+    """
+    sink: List[Mapping[str, str]] = []
+    token = _header_sink.set(sink)
+    try:
+        yield sink
+    finally:
+        _header_sink.reset(token)
+
+
+@lru_cache(maxsize=None)
+def _httpx_module(sdk_name: str):
+    """The httpx package an SDK is built on (SDK releases differ in which one they use)."""
+    sdk = importlib.import_module(sdk_name)
+    return importlib.import_module(sdk.DefaultAsyncHttpxClient.__mro__[1].__module__.partition(".")[0])
+
+
+@lru_cache(maxsize=None)
+def _loop_aware_transport_class(httpx):
+    class LoopAwareTransport(httpx.AsyncBaseTransport):
+        """
+        Async transport that keeps one connection pool per event loop. Connections are bound
+        to the loop that opened them, so this lets one SDK client be used safely from several
+        loops (e.g. successive asyncio.run calls or Streamlit script threads).
+        """
+
+        def __init__(self, factory):
+            self._factory = factory
+            self._transports = weakref.WeakKeyDictionary()
+
+        def _for_loop(self):
+            loop = asyncio.get_running_loop()
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = self._transports[loop] = self._factory()
+            return transport
+
+        async def handle_async_request(self, request):
+            response = await self._for_loop().handle_async_request(request)
+            sink = _header_sink.get()
+            if sink is not None:
+                sink.append(response.headers)
+            return response
+
+        async def aclose(self) -> None:
+            transport = self._transports.pop(asyncio.get_running_loop(), None)
+            if transport is not None:
+                await transport.aclose()
+
+    return LoopAwareTransport
+
+
+class HTTPPools:
+    """
+    Process-wide HTTP transport layer. It provides pooled httpx clients for the OpenAI and
+    Anthropic SDKs, and an aiohttp session with a DNS cache for the search APIs. Both use
+    explicit pool sizes and keep-alive.
+
+    Async pools are scoped to the running event loop. Use the instance as an async context
+    manager, or call `aclose()`, to close the current loop's connections when its work ends.
+    """
+
+    def __init__(self, config: Optional[TransportConfig] = None):
+        self.config = config or TransportConfig.from_env()
+        self._sdk_clients: Dict[Any, Any] = {}
+        self._async_transports = []
+        self._sessions = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _http2_enabled(self) -> bool:
+        if not self.config.http2:
+            return False
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("HTTP/2 requested but the `h2` package is not installed; using HTTP/1.1")
+            return False
+        return True
+
+    def sdk_http_client(self, sdk_name: str, is_async: bool = True):
+        """Shared httpx client for the `openai` or `anthropic` SDK (pass it as `http_client`)."""
+        key = (sdk_name, is_async)
+        client = self._sdk_clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            if key not in self._sdk_clients:
+                self._sdk_clients[key] = self._build_sdk_client(sdk_name, is_async)
+            return self._sdk_clients[key]
+
+    def _build_sdk_client(self, sdk_name: str, is_async: bool):
+        sdk = importlib.import_module(sdk_name)
+        httpx = _httpx_module(sdk_name)
+        limits = httpx.Limits(max_connections=self.config.max_connections,
+                              max_keepalive_connections=self.config.max_keepalive_connections,
+                              keepalive_expiry=self.config.keepalive_expiry)
+        http2 = self._http2_enabled()
+        logger.debug(f"Creating pooled {'async ' if is_async else ''}HTTP client for {sdk_name} (http2={http2})")
+        if not is_async:
+            return sdk.DefaultHttpxClient(transport=httpx.HTTPTransport(limits=limits, http2=http2))
+        transport = _loop_aware_transport_class(httpx)(lambda: httpx.AsyncHTTPTransport(limits=limits, http2=http2))
+        self._async_transports.append(transport)
+        return sdk.DefaultAsyncHttpxClient(transport=transport)
+
+    def aiohttp_session(self):
+        """Shared aiohttp session for the running event loop, created on first use."""
+        import aiohttp
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.config.max_connections,
+                limit_per_host=self.config.max_connections_per_host,
+                ttl_dns_cache=self.config.dns_cache_ttl,
+                keepalive_timeout=self.config.keepalive_expiry,
+            )
+            session = self._sessions[loop] = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(sock_connect=self.config.connect_timeout),
+            )
+        return session
+
+    async def warm_up(self, origins: Iterable = DEFAULT_WARM_UP_ORIGINS) -> Dict[str, bool]:
+        """
+        Pre-open connections (DNS, TCP and TLS) to `origins` on the running loop so the first
+        real requests skip the handshakes. Any HTTP response counts as success; failures are
+        logged and never raised.
+        """
+        async def touch(origin: str, pool: str) -> bool:
+            try:
+                if pool == "aiohttp":
+                    async with self.aiohttp_session().head(origin, allow_redirects=False):
+                        pass
+                else:
+                    await self.sdk_http_client(pool).head(origin)
+                return True
+            except Exception as e:
+                logger.info(f"Could not warm up connection to {origin}: {e!r}")
+                return False
+
+        origins = list(origins)
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(*(touch(origin, pool) for origin, pool in origins)),
+                timeout=self.config.warm_up_timeout)
+        except asyncio.TimeoutError:
+            logger.info(f"Connection warm-up timed out after {self.config.warm_up_timeout}s")
+            return {origin: False for origin, _ in origins}
+        return {origin: ok for (origin, _), ok in zip(origins, results)}
+
+    async def aclose(self) -> None:
+        """Close the running loop's aiohttp session and SDK connection pools."""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+        # Only this loop's pools are closed; the SDK clients stay usable from other loops.
+        for transport in list(self._async_transports):
+            await transport.aclose()
+
+    def close(self) -> None:
+        """Close the synchronous SDK clients."""
+        with self._lock:
+            for key in [key for key in self._sdk_clients if not key[1]]:
+                self._sdk_clients.pop(key).close()
+
+    async def __aenter__(self) -> "HTTPPools":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+
+_pools: Optional[HTTPPools] = None
+_pools_lock = threading.Lock()
+
+
+def get_pools() -> HTTPPools:
+    """Return the process-wide HTTPPools, configured from the environment on first use."""
+    global _pools
+    if _pools is None:
+        with _pools_lock:
+            if _pools is None:
+                _pools = HTTPPools()
+    return _pools
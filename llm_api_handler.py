@@ -1,32 +1,97 @@
 import os
 import json
 import time
+import uuid
 import logging
 import asyncio
-from typing import List, Dict, Any, Union, Type, Generic, TypeVar
+import threading
+from contextlib import aclosing
+from functools import lru_cache
+from typing import (List, Dict, Any, Optional, Union, Type, Generic, TypeVar, Iterable,
+                    AsyncIterable, AsyncIterator, Awaitable, Callable, Tuple)
 
 from datetime import datetime
 from pydantic import BaseModel
-from dotenv import load_dotenv
 
-# Import synchronous and asynchronous OpenAI clients
-from openai import AsyncOpenAI, OpenAI  # Corrected import statement
-import anthropic
-
-# Import AsyncLimiter for rate limiting
-from aiolimiter import AsyncLimiter
+from concurrency_control import ConcurrencyRegistry
+from token_budget import TokenBudgets, estimate_prompt_tokens, usage_tokens
+from retry_policy import CircuitBreaker, retrying
+from request_templates import CompiledRequest, compile_request
+from response_cache import ResponseCache, MISS, make_cache_key
+from single_flight import SingleFlight
+from http_pools import HTTPPools, capture_response_headers, get_pools
+from hedging import Hedger
+from request_scheduler import SchedulerRegistry, DEFAULT_TENANT, current_tenant, resolve_priority
+from model_registry import ModelRegistry, registry as default_model_registry
+import llm_metrics
+from llm_metrics import CallRecord, MetricsRegistry, usage_breakdown
 
 logger = logging.getLogger(__name__)
 
-# Load environment variables from .env file
-load_dotenv(override=True)
 
-# Retrieve API keys from environment variables
-openai_api_key = os.getenv("OPENAI_API_KEY")
-anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
+@lru_cache(maxsize=None)
+def _load_env() -> None:
+    """Load environment variables from the .env file, once per process."""
+    from dotenv import load_dotenv
+    load_dotenv(override=True)
 
 T = TypeVar('T', bound=BaseModel)
 
+# Tokens-per-minute budgets keyed by "provider:model" or "provider". Adjust to your account tier.
+DEFAULT_TPM_LIMITS = {
+    "openai:gpt-4o-mini": 2_000_000,
+    "openai:gpt-4o-2024-08-06": 800_000,
+    "anthropic:claude-3-5-sonnet-20240620": 80_000,
+}
+
+DEFAULT_MAX_IN_FLIGHT = 256
+
+# Per-file limits of the OpenAI Batch API
+BATCH_MAX_REQUESTS = 50_000
+BATCH_MAX_BYTES = 200 * 1024 * 1024
+
+
+async def as_completed_bounded(awaitables: Union[Iterable[Awaitable], AsyncIterable[Awaitable]],
+                               max_in_flight: int = DEFAULT_MAX_IN_FLIGHT) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    Run awaitables with at most `max_in_flight` pending at once, pulling them lazily from a
+    (sync or async) iterable, and yield `(index, result_or_exception)` as each completes.
+    Closing the iterator early cancels whatever is still running.
+    """
+    if isinstance(awaitables, AsyncIterable):
+        source = awaitables.__aiter__()
+        is_async = True
+    else:
+        source = iter(awaitables)
+        is_async = False
+
+    pending: Dict[asyncio.Future, int] = {}
+    next_index = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    awaitable = await source.__anext__() if is_async else next(source)
+                except (StopIteration, StopAsyncIteration):
+                    exhausted = True
+                    break
+                pending[asyncio.ensure_future(awaitable)] = next_index
+                next_index += 1
+
+            if not pending:
+                return
+
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=pending.get):
+                index = pending.pop(task)
+                error = task.exception()
+                yield index, (error if error is not None else task.result())
+    finally:
+        for task in pending:
+            task.cancel()
+
+
 class BatchResult(BaseModel, Generic[T]):
     metadata: Dict[str, Any]
     results: List[Dict[str, Union[str, T]]]
@@ -36,21 +101,144 @@ class LLMAPIHandler:
     Handles interactions with OpenAI and Anthropic models for processing prompts in both regular and batch modes.
     Supports deduplication of prompts, structured outputs via Pydantic models, 
     and batch processing with custom configurations like temperature and system messages.
+
+    Regular-mode responses are served from an optional persistent ResponseCache. Pass one
+    explicitly, or set LLM_CACHE_PATH to enable it for every handler.
+
+    Async requests are admitted by an adaptive (AIMD) concurrency controller per provider
+    and model; `concurrency_limits` overrides its settings, keyed by "provider" or
+    "provider:model", e.g. {"openai:gpt-4o-mini": {"initial_limit": 64}}.
+
+    Each async request also reserves its estimated prompt tokens plus `expected_completion_tokens`
+    from a tokens-per-minute bucket (`tpm_limits`, defaulting to DEFAULT_TPM_LIMITS) and settles
+    the reservation against the reported usage once the response arrives.
+
+    Transient failures (429, 5xx, connection errors) are retried up to `max_retries` times
+    with jittered exponential backoff that honours Retry-After. A circuit breaker per
+    provider fails fast with CircuitOpenError while that provider is down.
+
+    Before its token reservation and concurrency slot, each async request is admitted by a
+    per-model RequestScheduler: by priority class first (`priority`, defaulting to the class of
+    its `stage`), then by weighted fair queuing across `tenant`s (weights from `tenant_weights`).
+
+    Pass a `hedging` Hedger to duplicate async calls that run past a tracked latency percentile,
+    optionally to a fallback model, keeping whichever answers first within a capped hedge budget.
+
+    SDKs and clients are created on first use. Prefer `get_handler()` over constructing
+    handlers directly so that all components share one set of clients and limits.
+
+    Concurrent identical regular-mode requests (same model, system message, temperature,
+    prompt and response_format) share one upstream call unless `coalesce_requests` is False,
+    and `async_process` collapses duplicate prompts before dispatching them.
+
+    Models are resolved through `model_registry` (the process-wide model_registry.registry by
+    default). `async_process_cascade` runs a task on its registered cascade of models, cheapest
+    first, escalating only the prompts whose responses fail validation.
+
+    Every regular-mode call is recorded in `metrics` (the process-wide llm_metrics.registry by
+    default) with its tokens, wall time, queue wait, retries and estimated cost, tagged with the
+    `stage` passed by the caller or set through `llm_metrics.stage(...)`.
     """
 
-    def __init__(self):
-        # Initialize synchronous clients
-        self.openai_client = OpenAI(api_key=openai_api_key)
-        self.anthropic_client = anthropic.Anthropic(api_key=anthropic_api_key)
-        
-        # Initialize asynchronous clients
-        self.async_openai_client = AsyncOpenAI(api_key=openai_api_key)
-        # Assuming Anthropic also provides an asynchronous client
-        self.async_anthropic_client = anthropic.AsyncAnthropic(api_key=anthropic_api_key)
-        
-        # Initialize rate limiter: 2000 requests per minute
-        self.limiter = AsyncLimiter(max_rate=2000, time_period=60)
+    def __init__(self,
+                 cache: Optional[ResponseCache] = None,
+                 concurrency_limits: Optional[Dict[str, Dict[str, Any]]] = None,
+                 tpm_limits: Optional[Dict[str, int]] = None,
+                 expected_completion_tokens: int = 1024,
+                 max_retries: int = 4,
+                 coalesce_requests: bool = True,
+                 metrics: Optional[MetricsRegistry] = None,
+                 pools: Optional[HTTPPools] = None,
+                 tenant_weights: Optional[Dict[str, float]] = None,
+                 hedging: Optional[Hedger] = None,
+                 model_registry: Optional[ModelRegistry] = None):
+        _load_env()
+
+        # Known models (provider, pricing, context length, throughput) and per-task cascades
+        self.model_registry = model_registry if model_registry is not None else default_model_registry
+
+        # Provider SDK clients are imported and built on first use; see the client properties.
+        # They send requests through the process-wide connection pools unless `pools` is given.
+        self._pools = pools
+        self._clients: Dict[str, Any] = {}
+        self._clients_lock = threading.Lock()
+
+        # Retries with jittered backoff, and a circuit breaker per provider
+        self.max_retries = max_retries
+        self.circuit_breakers = {
+            "openai": CircuitBreaker("openai"),
+            "anthropic": CircuitBreaker("anthropic"),
+        }
         
+        # Adaptive concurrency limits per (provider, model), tuned from 429s, headers and latency
+        self.concurrency = ConcurrencyRegistry(overrides=concurrency_limits)
+
+        # Priority classes and per-tenant fair queuing in front of the concurrency controllers
+        self.schedulers = SchedulerRegistry(tenant_weights)
+
+        # Optional hedged requests for tail latency
+        self.hedger = hedging
+
+        # Tokens-per-minute budgets, reconciled against real usage after each call
+        self.token_budgets = TokenBudgets(DEFAULT_TPM_LIMITS if tpm_limits is None else tpm_limits)
+        self.expected_completion_tokens = expected_completion_tokens
+
+        # Persistent response cache shared by the sync and async regular paths
+        self.cache = cache if cache is not None else ResponseCache.from_env()
+
+        # Single-flight coalescing of identical in-flight requests, across threads and event loops
+        self.single_flight = SingleFlight() if coalesce_requests else None
+
+        # Per-call usage, latency and cost records
+        self.metrics = metrics if metrics is not None else llm_metrics.registry
+
+    @property
+    def openai_client(self):
+        return self._client("openai")
+
+    @property
+    def anthropic_client(self):
+        return self._client("anthropic")
+
+    @property
+    def async_openai_client(self):
+        return self._client("async_openai")
+
+    @property
+    def async_anthropic_client(self):
+        return self._client("async_anthropic")
+
+    def _client(self, name: str):
+        """Return the named SDK client, importing its SDK and creating it on first use."""
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+        with self._clients_lock:
+            if name not in self._clients:
+                pools = self._pools or get_pools()
+                # SDK retries are disabled; see retry_policy.
+                if name == "openai":
+                    from openai import OpenAI
+                    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0,
+                                    http_client=pools.sdk_http_client("openai", is_async=False))
+                elif name == "async_openai":
+                    from openai import AsyncOpenAI
+                    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0,
+                                         http_client=pools.sdk_http_client("openai"))
+                elif name == "anthropic":
+                    import anthropic
+                    client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0,
+                                                 http_client=pools.sdk_http_client("anthropic", is_async=False))
+                elif name == "async_anthropic":
+                    import anthropic
+                    client = anthropic.AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), max_retries=0,
+                                                      http_client=pools.sdk_http_client("anthropic"))
+                else:
+                    raise ValueError(f"Unknown client: {name}")
+                logger.debug(f"Created {name} client")
+                self._clients[name] = client
+            return self._clients[name]
+
     def process(self, 
                 prompts: Union[str, List[str]],
                 model: str = "gpt-4o-mini",
@@ -60,9 +248,19 @@ class LLMAPIHandler:
                 response_format: Union[None, Type[T]] = None,
                 output_dir: str = None,
                 update_interval: int = 60,
-                deduplicate_prompts: bool = False) -> Union[Any, T, BatchResult[T]]:
+                deduplicate_prompts: bool = False,
+                use_cache: bool = True,
+                refresh_cache: bool = False,
+                stage: Optional[str] = None) -> Union[Any, T, BatchResult[T]]:
         """
         Process a prompt or list of prompts using the specified model.
+
+        In regular mode, `use_cache=False` bypasses the response cache entirely and
+        `refresh_cache=True` skips the cached entry but stores the fresh response.
+        `stage` tags the call in the metrics registry.
+
+        Batch mode blocks until the batch completes, so it cannot be called from a running event
+        loop; await `submit_batch` and `wait_for_batch` there instead.
         """
         if isinstance(prompts, str):
             # Single prompt: Regular mode
@@ -70,16 +268,24 @@ class LLMAPIHandler:
                 "model": model,
                 "prompt": prompts,
                 "system_message": system_message,
-                "temperature": temperature
+                "temperature": temperature,
+                "stage": stage or llm_metrics.current_stage()
             }
-            return self._process_regular(request, response_format)
+            return self._process_regular(request, response_format, use_cache=use_cache, refresh_cache=refresh_cache)
         
         elif isinstance(prompts, list) and mode == "batch":
             # Multiple prompts: Batch mode
-            if deduplicate_prompts:
-                prompts = list(dict.fromkeys(prompts))  # Remove duplicates, but keep order
-            batch_requests = self._construct_batch_requests(prompts, model, temperature)
-            return self._process_batch(batch_requests, response_format, output_dir, update_interval, prompts)
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+            else:
+                raise RuntimeError("process(mode='batch') cannot run inside a running event loop; "
+                                   "await submit_batch() and wait_for_batch() instead.")
+            return asyncio.run(self._async_process_batch(
+                prompts, model, system_message, temperature, response_format,
+                output_dir or "batch_output", update_interval, deduplicate_prompts
+            ))
         else:
             raise ValueError("Invalid input: 'prompts' should be a string for regular mode or a list for batch mode.")
 
@@ -88,7 +294,13 @@ class LLMAPIHandler:
                             model: str = "gpt-4o-mini",
                             system_message: str = None,
                             temperature: float = 0.7,
-                            response_format: Union[None, Type[T]] = None) -> List[Union[str, T]]:
+                            response_format: Union[None, Type[T]] = None,
+                            use_cache: bool = True,
+                            refresh_cache: bool = False,
+                            return_exceptions: bool = False,
+                            stage: Optional[str] = None,
+                            priority: Union[None, int, str] = None,
+                            tenant: Optional[str] = None) -> List[Union[str, T, Exception]]:
         """
         Asynchronously process a list of prompts in regular mode and return Pydantic model instances.
         
@@ -98,22 +310,172 @@ class LLMAPIHandler:
             system_message: Optional system message to guide model behavior.
             temperature: Sampling temperature for responses.
             response_format: Pydantic model to structure the response.
+            use_cache: Whether to read from and write to the response cache.
+            refresh_cache: Ignore cached entries but store the fresh responses.
+            return_exceptions: Return the exception for prompts that still fail after retries
+                instead of raising, so the other responses are kept.
+            stage: Pipeline stage the calls are tagged with in the metrics registry.
+            priority: Priority class name (see request_scheduler.PRIORITY_CLASSES) or number, lower
+                first. Defaults to the class of `stage`.
+            tenant: User or session the requests are fairly queued under. Defaults to the tenant set
+                with `request_scheduler.tenant(...)`.
         
         Returns:
             List of responses (either strings or Pydantic model instances) corresponding to each prompt.
+            Duplicate prompts are sent once and their response is repeated at each position.
         """
-        tasks = [
-            self._async_process_regular({
+        positions: Dict[str, List[int]] = {}
+        for i, prompt in enumerate(prompts):
+            positions.setdefault(prompt, []).append(i)
+        unique_prompts = list(positions)
+        if len(unique_prompts) < len(prompts):
+            logger.info(f"Collapsed {len(prompts)} prompts into {len(unique_prompts)} unique requests")
+
+        results: List[Any] = [None] * len(prompts)
+        stream = self.async_process_stream(
+            unique_prompts, model=model, system_message=system_message, temperature=temperature,
+            response_format=response_format, use_cache=use_cache, refresh_cache=refresh_cache, stage=stage,
+            priority=priority, tenant=tenant)
+        async with aclosing(stream):
+            async for index, result in stream:
+                if isinstance(result, Exception) and not return_exceptions:
+                    raise result
+                for position in positions[unique_prompts[index]]:
+                    results[position] = result
+        return results
+
+    async def async_process_cascade(self,
+                                    prompts: List[str],
+                                    task: Union[str, List[str]],
+                                    validate: Optional[Callable[[int, Any], bool]] = None,
+                                    system_message: str = None,
+                                    return_exceptions: bool = False,
+                                    **kwargs) -> List[Union[str, T, Exception]]:
+        """
+        Process prompts on a cascade of models, cheapest tier first, escalating a prompt to the
+        next tier only when its response fails or `validate(index, response)` returns False.
+
+        Args:
+            prompts: List of prompt strings to process.
+            task: Task name whose cascade is registered in the model registry (e.g. "ranking"),
+                or an explicit list of model names to try in order.
+            validate: Optional check of a response for the prompt at `index`. Responses that fail
+                it (or make it raise) are retried on the next tier. The last tier's response is
+                kept either way.
+            system_message: Optional system message, shared by every tier.
+            return_exceptions: Return the exception for prompts that fail on every tier instead
+                of raising.
+            **kwargs: Passed to `async_process` (temperature, response_format, stage, ...).
+
+        Prompts too long for a tier's context window skip straight to a tier that fits them.
+        """
+        if isinstance(task, str):
+            tiers = self.model_registry.cascade(task)
+        else:
+            tiers = [self.model_registry.get(model) for model in task]
+        if not tiers:
+            raise ValueError(f"No models registered for task: {task}")
+
+        results: List[Any] = [None] * len(prompts)
+        pending = list(range(len(prompts)))
+        prompt_tokens: Dict[int, int] = {}
+        for depth, spec in enumerate(tiers):
+            if not pending:
+                break
+            last_tier = depth == len(tiers) - 1
+            if last_tier:
+                batch = pending
+            else:
+                for i in pending:
+                    if i not in prompt_tokens:
+                        messages = [{"role": "system", "content": system_message or ""},
+                                    {"role": "user", "content": prompts[i]}]
+                        prompt_tokens[i] = estimate_prompt_tokens(messages, spec.name)
+                batch = [i for i in pending if spec.fits(prompt_tokens[i])]
+            if not batch:
+                continue
+
+            responses = await self.async_process(
+                [prompts[i] for i in batch], model=spec.name, system_message=system_message,
+                return_exceptions=True, **kwargs)
+            escalated = []
+            for position, i in enumerate(batch):
+                response = responses[position] if position < len(responses) else None
+                results[i] = response
+                if not last_tier and not self._cascade_accepts(validate, i, response):
+                    escalated.append(i)
+            sent = set(batch)
+            pending = [i for i in pending if i not in sent] + escalated
+            if escalated:
+                logger.info(f"Escalating {len(escalated)} of {len(batch)} prompts from {spec.name} "
+                            f"to {tiers[depth + 1].name}")
+
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        return results
+
+    @staticmethod
+    def _cascade_accepts(validate: Optional[Callable[[int, Any], bool]], index: int, response: Any) -> bool:
+        if isinstance(response, Exception):
+            return False
+        if validate is None:
+            return True
+        try:
+            return bool(validate(index, response))
+        except Exception as e:
+            logger.debug(f"Cascade validation of response {index} raised {e!r}")
+            return False
+
+    async def async_process_stream(self,
+                                   prompts: Union[Iterable[str], AsyncIterable[str]],
+                                   model: str = "gpt-4o-mini",
+                                   system_message: str = None,
+                                   temperature: float = 0.7,
+                                   response_format: Union[None, Type[T]] = None,
+                                   max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                                   use_cache: bool = True,
+                                   refresh_cache: bool = False,
+                                   stage: Optional[str] = None,
+                                   priority: Union[None, int, str] = None,
+                                   tenant: Optional[str] = None) -> AsyncIterator[Tuple[int, Union[str, T, Exception]]]:
+        """
+        Process prompts from any (async) iterable with at most `max_in_flight` requests
+        outstanding, yielding `(index, result_or_error)` in completion order.
+
+        Prompts are consumed lazily, so arbitrarily long inputs do not create one coroutine
+        per prompt up front. Failed prompts yield their exception instead of stopping the stream.
+        """
+        stage = stage or llm_metrics.current_stage()
+        priority = resolve_priority(priority, stage)
+        tenant = tenant or current_tenant()
+
+        def make_request(prompt: str):
+            return self._async_process_regular({
                 "model": model,
                 "prompt": prompt,
                 "system_message": system_message,
-                "temperature": temperature
-            }, response_format)
-            for prompt in prompts
-        ]
-        return await asyncio.gather(*tasks)
+                "temperature": temperature,
+                "stage": stage,
+                "priority": priority,
+                "tenant": tenant
+            }, response_format, use_cache=use_cache, refresh_cache=refresh_cache)
+
+        if isinstance(prompts, AsyncIterable):
+            async def requests():
+                async for prompt in prompts:
+                    yield make_request(prompt)
+            source = requests()
+        else:
+            source = (make_request(prompt) for prompt in prompts)
 
-    def _construct_batch_requests(self, prompts: List[str], model: str, temperature: float) -> List[Dict[str, Any]]:
+        async with aclosing(as_completed_bounded(source, max_in_flight)) as completed:
+            async for index, result in completed:
+                yield index, result
+
+    def _construct_batch_requests(self, prompts: List[str], model: str, temperature: float,
+                                  system_message: str = None) -> List[Dict[str, Any]]:
         """
         Construct a list of batch requests with the prompts, including unique custom IDs.
         """
@@ -123,250 +485,664 @@ class LLMAPIHandler:
                 "custom_id": f"request_{i+1}",  # Adding a unique custom_id for each request
                 "model": model,
                 "prompt": prompt,
+                "system_message": system_message,
                 "temperature": temperature
             })
         return batch_requests
 
-    def _get_system_message(self, user_system_message: str, response_format: Union[None, Type[T]]) -> str:
-        """Determine the system message, handling user input and format requirements."""
-        if response_format:
-            schema = response_format.model_json_schema()
-            return f"Answer exclusively in this JSON format: {schema}"
-        elif user_system_message:
-            return user_system_message
-        else:
-            return "You are a helpful assistant."
+    def _cache_lookup(self, request: Dict[str, Any], response_format: Union[None, Type[T]],
+                      use_cache: bool, refresh_cache: bool):
+        """Return (cache_key, cached_response). The key is None when caching is off for this call."""
+        if self.cache is None or not use_cache:
+            return None, MISS
+        key = make_cache_key(request, response_format)
+        if refresh_cache:
+            return key, MISS
+        cached = self.cache.get(key, response_format)
+        if cached is not MISS:
+            logger.debug(f"Cache hit for {request['model']} request {key[:12]}")
+        return key, cached
+
+    async def _async_cache_lookup(self, request: Dict[str, Any], response_format: Union[None, Type[T]],
+                                  use_cache: bool, refresh_cache: bool):
+        """Like `_cache_lookup`, but reads SQLite in a worker thread so the event loop keeps running."""
+        if self.cache is None or not use_cache:
+            return None, MISS
+        key = make_cache_key(request, response_format)
+        if refresh_cache:
+            return key, MISS
+        cached = await self.cache.aget(key, response_format)
+        if cached is not MISS:
+            logger.debug(f"Cache hit for {request['model']} request {key[:12]}")
+        return key, cached
+
+    @staticmethod
+    def _flight_key(request: Dict[str, Any], response_format: Union[None, Type[T]],
+                    use_cache: bool, refresh_cache: bool) -> str:
+        """
+        Single-flight key. The cache flags are part of it: a refresh_cache or use_cache=False call
+        must not share the outcome of a call that may be answered from the cache.
+        """
+        return f"{make_cache_key(request, response_format)}:{int(use_cache)}{int(refresh_cache)}"
+
+    def _provider_for(self, model: str) -> str:
+        return self.model_registry.get(model).provider
+
+    def _process_regular(self, request: Dict[str, Any], response_format: Union[None, Type[T]],
+                         use_cache: bool = True, refresh_cache: bool = False) -> Union[str, T]:
+        """Process a regular request, sharing the outcome of an identical request already in flight."""
+        def call():
+            return self._process_regular_uncoalesced(request, response_format, use_cache, refresh_cache)
+
+        if self.single_flight is None:
+            return call()
+        return self.single_flight.do_sync(self._flight_key(request, response_format, use_cache, refresh_cache), call)
+
+    def _process_regular_uncoalesced(self, request: Dict[str, Any], response_format: Union[None, Type[T]],
+                                     use_cache: bool, refresh_cache: bool) -> Union[str, T]:
+        """Process a regular request with a single prompt, consulting the response cache first."""
+        key, cached = self._cache_lookup(request, response_format, use_cache, refresh_cache)
+        if cached is not MISS:
+            self._record_cache_hit(request)
+            return cached
+        response = self._call_model(request, response_format)
+        if key is not None:
+            self.cache.set(key, response)
+        return response
+
+    def _call_model(self, request: Dict[str, Any], response_format: Union[None, Type[T]]) -> Union[str, T]:
+        """Send a single prompt to the provider, retrying transient failures behind its circuit breaker."""
+        provider = self._provider_for(request['model'])
+        breaker = self.circuit_breakers[provider]
+        start = time.monotonic()
+        attempts = 0
 
-    def _process_regular(self, request: Dict[str, Any], response_format: Union[None, Type[T]]) -> Union[str, T]:
-        """Process a regular request with a single prompt."""
+        @retrying(max_tries=self.max_retries + 1)
+        def call_provider():
+            nonlocal attempts
+            attempts += 1
+            breaker.before_call()
+            try:
+                outcome = self._call_model_once(request, response_format)
+            except Exception as e:
+                breaker.record_failure(e)
+                raise
+            except BaseException:
+                breaker.record_cancelled()
+                raise
+            breaker.record_success()
+            return outcome
+
+        raw = error = None
+        try:
+            result, raw = call_provider()
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._record_call(request, provider, raw, time.monotonic() - start, 0.0, attempts, error)
+
+    def _call_model_once(self, request: Dict[str, Any], response_format: Union[None, Type[T]]):
+        """Send a single prompt to the provider and return (result, raw response)."""
         model = request['model']
         temperature = request.get('temperature', 0.7)
-        prompt = request['prompt']
-        system_message = self._get_system_message(request.get('system_message'), response_format)
-
-        if model in ['gpt-4o-mini', 'gpt-4o-2024-08-06']:
-            messages = [{"role": "user", "content": prompt}]
-            if system_message:
-                messages.insert(0, {"role": "system", "content": system_message})
-
-            if response_format:
-                completion = self.openai_client.beta.chat.completions.parse(
-                    model=model,
-                    messages=messages,
-                    response_format=response_format
-                )
-                return completion.choices[0].message.parsed
-            else:
-                response = self.openai_client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=temperature
-                ).choices[0].message.content
-
-        elif model == 'claude-3-5-sonnet-20240620':
-            if response_format:
-                schema = response_format.model_json_schema()
-                prompt = f"Answer exclusively in this JSON format: {schema}\n\n{prompt}"
-
-            message = self.anthropic_client.messages.create(
-                model=model,
-                max_tokens=8192,
-                temperature=temperature,
-                messages=[{"role": "user", "content": prompt}]
+        provider = self._provider_for(model)
+        compiled = compile_request(provider, model, request.get('system_message'), response_format)
+        messages = compiled.messages(request['prompt'])
+
+        if provider == "openai":
+            completion = self.openai_client.chat.completions.create(
+                **self._openai_params(compiled, messages, temperature)
             )
-            content = message.content[0].text
+            return compiled.decode(completion.choices[0].message.content), completion
 
-            if response_format:
-                try:
-                    json_response = json.loads(content)
-                    return response_format(**json_response)
-                except json.JSONDecodeError:
-                    json_start = content.find('{')
-                    json_end = content.rfind('}') + 1
-                    if json_start != -1 and json_end != -1:
-                        json_str = content[json_start:json_end]
-                        json_response = json.loads(json_str)
-                        return response_format(**json_response)
-                    else:
-                        raise ValueError("Failed to extract JSON from Claude's response")
-            else:
-                return content
+        message = self.anthropic_client.messages.create(
+            model=model,
+            max_tokens=8192,
+            temperature=temperature,
+            messages=messages
+        )
+        return compiled.decode(message.content[0].text), message
 
-        else:
-            raise ValueError(f"Invalid model: {model}")
+    @staticmethod
+    def _openai_params(compiled: CompiledRequest, messages: List[Dict[str, str]], temperature: float) -> Dict[str, Any]:
+        params = {"model": compiled.model, "messages": messages, "temperature": temperature}
+        if compiled.openai_response_format:
+            params["response_format"] = compiled.openai_response_format
+        return params
+
+    async def _async_process_regular(self, request: Dict[str, Any], response_format: Union[None, Type[T]],
+                                     use_cache: bool = True, refresh_cache: bool = False) -> Union[str, T]:
+        """Asynchronously process a regular request, sharing the outcome of an identical request already in flight."""
+        def call():
+            return self._async_process_regular_uncoalesced(request, response_format, use_cache, refresh_cache)
+
+        if self.single_flight is None:
+            return await call()
+        return await self.single_flight.do(self._flight_key(request, response_format, use_cache, refresh_cache), call)
+
+    async def _async_process_regular_uncoalesced(self, request: Dict[str, Any], response_format: Union[None, Type[T]],
+                                                 use_cache: bool, refresh_cache: bool) -> Union[str, T]:
+        """Asynchronously process a regular request with a single prompt, consulting the response cache first."""
+        key, cached = await self._async_cache_lookup(request, response_format, use_cache, refresh_cache)
+        if cached is not MISS:
+            self._record_cache_hit(request)
+            return cached
+        response = await self._async_call_hedged(request, response_format)
+        if key is not None:
+            await self.cache.aset(key, response)
+        return response
 
-    async def _async_process_regular(self, request: Dict[str, Any], response_format: Union[None, Type[T]]) -> Union[str, T]:
-        """Asynchronously process a regular request with a single prompt."""
+    async def _async_call_hedged(self, request: Dict[str, Any], response_format: Union[None, Type[T]]) -> Union[str, T]:
+        """Send a single prompt, hedging it with a duplicate request when hedging is enabled."""
+        if self.hedger is None:
+            return await self._async_call_model(request, response_format)
+
+        backup_request = {**request, "model": self.hedger.backup_model(request['model'])}
+        backup_provider = self._provider_for(backup_request['model'])
+        # A duplicate that would only wait in the backup model's queue cannot cut latency.
+        backup_scheduler = self._scheduler_for(backup_provider, backup_request['model'])
+        # Stages differ in prompt and output size by orders of magnitude, so each gets its own delay
+        return await self.hedger.run(
+            (request['model'], request.get('stage') or llm_metrics.current_stage()),
+            lambda: self._async_call_model(request, response_format),
+            lambda: self._async_call_model(backup_request, response_format),
+            can_hedge=lambda: backup_scheduler.queue_depth == 0
+        )
+
+    def _scheduler_for(self, provider: str, model: str):
+        # Admit as many requests as the adaptive limit allows; the rest wait in priority/fair order.
+        controller = self.concurrency.get(provider, model)
+        return self.schedulers.get(provider, model, capacity=lambda: controller.limit)
+
+    async def _async_call_model(self, request: Dict[str, Any], response_format: Union[None, Type[T]]) -> Union[str, T]:
+        """Asynchronously send a single prompt once the request scheduler admits it."""
+        provider = self._provider_for(request['model'])
+        scheduler = self._scheduler_for(provider, request['model'])
+        start = time.monotonic()
+        async with scheduler.admit(resolve_priority(request.get('priority'), request.get('stage')),
+                                   request.get('tenant') or DEFAULT_TENANT) as schedule_wait:
+            return await self._async_dispatch(request, response_format, provider, start, schedule_wait)
+
+    async def _async_dispatch(self, request: Dict[str, Any], response_format: Union[None, Type[T]],
+                              provider: str, start: float, schedule_wait: float) -> Union[str, T]:
+        """Send an admitted prompt to the provider under its token budget, concurrency limit and retry policy."""
         model = request['model']
         temperature = request.get('temperature', 0.7)
-        prompt = request['prompt']
-        system_message = self._get_system_message(request.get('system_message'), response_format)
-
-        async with self.limiter:
-            if model in ['gpt-4o-mini', 'gpt-4o-2024-08-06']:
-                messages = [{"role": "user", "content": prompt}]
-                if system_message:
-                    messages.insert(0, {"role": "system", "content": system_message})
-
-                if response_format:
-                    completion = await self.async_openai_client.beta.chat.completions.parse(
-                        model=model,
-                        messages=messages,
-                        response_format=response_format
-                    )
-                    return completion.choices[0].message.parsed
-                else:
-                    response = (await self.async_openai_client.chat.completions.create(
-                        model=model,
-                        messages=messages,
-                        temperature=temperature
-                    )).choices[0].message.content
-                    return response
-
-            elif model == 'claude-3-5-sonnet-20240620':
-                if response_format:
-                    schema = response_format.model_json_schema()
-                    prompt = f"Answer exclusively in this JSON format: {schema}\n\n{prompt}"
-
-                message = await self.async_anthropic_client.messages.create(
-                    model=model,
-                    max_tokens=8192,
-                    temperature=temperature,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                content = message.content[0].text
-
-                if response_format:
-                    try:
-                        json_response = json.loads(content)
-                        return response_format(**json_response)
-                    except json.JSONDecodeError:
-                        json_start = content.find('{')
-                        json_end = content.rfind('}') + 1
-                        if json_start != -1 and json_end != -1:
-                            json_str = content[json_start:json_end]
-                            json_response = json.loads(json_str)
-                            return response_format(**json_response)
+        compiled = compile_request(provider, model, request.get('system_message'), response_format)
+        messages = compiled.messages(request['prompt'])
+
+        queue_wait = schedule_wait
+        attempts = 0
+
+        budget = self.token_budgets.get(provider, model)
+        reserved = 0
+        if budget is not None:
+            reserving_since = time.monotonic()
+            reserved = await budget.reserve(estimate_prompt_tokens(messages, model) + self.expected_completion_tokens)
+            queue_wait += time.monotonic() - reserving_since
+
+        breaker = self.circuit_breakers[provider]
+        controller = self.concurrency.get(provider, model)
+
+        # Each attempt takes its own concurrency slot, so backoff sleeps do not hold one.
+        @retrying(max_tries=self.max_retries + 1)
+        async def call_provider():
+            nonlocal attempts, queue_wait
+            attempts += 1
+            breaker.before_call()
+            try:
+                waiting_since = time.monotonic()
+                async with controller.slot(request.get('stage')) as slot:
+                    queue_wait += time.monotonic() - waiting_since
+                    with capture_response_headers() as responses:
+                        if provider == "openai":
+                            outcome = await self._async_call_openai(compiled, messages, temperature)
                         else:
-                            raise ValueError("Failed to extract JSON from Claude's response")
-                else:
-                    return content
+                            outcome = await self._async_call_anthropic(compiled, messages, temperature)
+                    # Rate-limit headers of successful calls also feed the controller
+                    slot.headers = responses[-1] if responses else None
+            except Exception as e:
+                breaker.record_failure(e)
+                raise
+            except BaseException:
+                breaker.record_cancelled()
+                raise
+            breaker.record_success()
+            return outcome
 
-            else:
-                raise ValueError(f"Invalid model: {model}")
+        # Failed calls refund their reservation; successful ones settle against reported usage.
+        used = 0
+        raw = error = None
+        try:
+            result, raw = await call_provider()
+            reported = usage_tokens(raw)
+            used = reported if reported is not None else reserved
+            return result
+        except BaseException as e:
+            # Includes cancellation, e.g. the losing side of a hedged request
+            error = e
+            raise
+        finally:
+            if budget is not None:
+                budget.reconcile(reserved, used)
+            self._record_call(request, provider, raw, time.monotonic() - start, queue_wait, attempts, error,
+                              schedule_wait=schedule_wait)
 
-    def _process_batch(self, requests: List[Dict[str, Any]], response_format: Union[None, Type[T]], output_dir: str, update_interval: int, original_prompts: List[str]) -> BatchResult[T]:
-        """Process a batch of requests and return a list of dictionaries matching prompt and response."""
+    def _record_call(self, request: Dict[str, Any], provider: str, raw: Any, wall_time: float,
+                     queue_wait: float, attempts: int, error: Optional[BaseException],
+                     schedule_wait: float = 0.0) -> None:
+        prompt_tokens, completion_tokens, cached_tokens = usage_breakdown(raw)
+        model = request['model']
+        record = CallRecord(
+            stage=request.get('stage') or llm_metrics.DEFAULT_STAGE,
+            provider=provider,
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached_tokens,
+            wall_time=wall_time,
+            queue_wait=queue_wait,
+            schedule_wait=schedule_wait,
+            tenant=request.get('tenant') or DEFAULT_TENANT,
+            retries=max(0, attempts - 1),
+            cost=self.model_registry.get(model).cost(prompt_tokens, completion_tokens, cached_tokens),
+            error=None if error is None else repr(error)
+        )
+        self.metrics.record(record)
+        logger.debug(
+            f"{record.stage} {model}: {wall_time:.2f}s (queued {queue_wait:.2f}s, {record.retries} retries), "
+            f"{prompt_tokens}+{completion_tokens} tokens, ${record.cost:.5f}"
+        )
+
+    def _record_cache_hit(self, request: Dict[str, Any]) -> None:
+        self.metrics.record(CallRecord(
+            stage=request.get('stage') or llm_metrics.DEFAULT_STAGE,
+            provider=self._provider_for(request['model']),
+            model=request['model'],
+            cache_hit=True
+        ))
+
+    async def _async_call_openai(self, compiled: CompiledRequest, messages: List[Dict[str, str]], temperature: float):
+        """Return (result, raw completion) from the OpenAI chat completions API."""
+        completion = await self.async_openai_client.chat.completions.create(
+            **self._openai_params(compiled, messages, temperature)
+        )
+        return compiled.decode(completion.choices[0].message.content), completion
+
+    async def _async_call_anthropic(self, compiled: CompiledRequest, messages: List[Dict[str, str]], temperature: float):
+        """Return (result, raw message) from the Anthropic messages API."""
+        message = await self.async_anthropic_client.messages.create(
+            model=compiled.model,
+            max_tokens=8192,
+            temperature=temperature,
+            messages=messages
+        )
+        return compiled.decode(message.content[0].text), message
+
+    async def submit_batch(self,
+                           prompts: List[str],
+                           model: str = "gpt-4o-mini",
+                           system_message: str = None,
+                           temperature: float = 0.7,
+                           response_format: Union[None, Type[T]] = None,
+                           output_dir: str = "batch_output",
+                           deduplicate_prompts: bool = False,
+                           max_requests_per_shard: int = BATCH_MAX_REQUESTS,
+                           max_bytes_per_shard: int = BATCH_MAX_BYTES) -> "BatchJob":
+        """
+        Upload prompts as OpenAI batch jobs and return a handle without waiting for them.
+
+        Requests are split into shards that respect the Batch API's per-file request and
+        byte limits. Shards are uploaded and created concurrently and tracked as one job.
+        The job's metadata (including the custom_id -> prompt mapping) is written to
+        `output_dir`, so `attach_batch` can pick the job up again after a restart. Each shard
+        is recorded there as soon as it is created; if any shard cannot be created, the ones
+        already running are cancelled and the error is raised.
+        """
+        if deduplicate_prompts:
+            prompts = list(dict.fromkeys(prompts))  # Remove duplicates, but keep order
+        requests = self._construct_batch_requests(prompts, model, temperature, system_message)
         os.makedirs(output_dir, exist_ok=True)
 
-        batch_file_path = os.path.join(output_dir, 'batch_input.jsonl')
-        with open(batch_file_path, 'w') as f:
-            for request in requests:
-                messages = [{"role": "user", "content": request['prompt']}]
-                if 'system_message' in request and request['system_message']:
-                    messages.insert(0, {"role": "system", "content": request['system_message']})
-
-                if response_format:
-                    schema = response_format.model_json_schema()
-                    messages.insert(0, {"role": "system", "content": f"Answer exclusively in this JSON format: {schema}"})
-
-                f.write(json.dumps({
-                    "custom_id": request['custom_id'],
-                    "method": "POST",
-                    "url": "/v1/chat/completions",
-                    "body": {
-                        "model": request['model'],
-                        "messages": messages,
-                        "temperature": request.get('temperature', 0.7),
-                        "response_format": {"type": "json_object"}
-                    }
-                }) + '\n')
-
-        with open(batch_file_path, 'rb') as f:
-            batch_file = self.openai_client.files.create(file=f, purpose="batch")
-
-        batch = self.openai_client.batches.create(
+        job_id = uuid.uuid4().hex[:12]
+        shard_paths = self._write_batch_shards(requests, response_format, output_dir, job_id,
+                                               max_requests_per_shard, max_bytes_per_shard)
+
+        prompts_file_path = os.path.join(output_dir, f"batch_{job_id}_prompts.json")
+        _write_json_atomic(prompts_file_path, {request['custom_id']: request['prompt'] for request in requests})
+
+        job_metadata = {
+            "job_id": job_id,
+            "shards": [],
+            "prompts_file_path": prompts_file_path,
+            "model": model,
+            "system_message": system_message,
+            "status": "submitting",
+            "created_at": datetime.now().isoformat(),
+            "last_updated": datetime.now().isoformat(),
+            "num_requests": len(requests)
+        }
+        metadata_file_path = os.path.join(output_dir, f"batch_{job_id}_metadata.json")
+        _write_json_atomic(metadata_file_path, job_metadata)
+
+        async def create_shard(path: str) -> Dict[str, Any]:
+            shard = await self._create_batch_shard(path)
+            # Record the shard before anything else can fail, so it can always be re-attached or cancelled
+            job_metadata["shards"].append(shard)
+            job_metadata["last_updated"] = datetime.now().isoformat()
+            _write_json_atomic(metadata_file_path, job_metadata)
+            return shard
+
+        outcomes = await asyncio.gather(*[create_shard(path) for path in shard_paths], return_exceptions=True)
+        errors = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+        if errors:
+            logger.error(f"Submitting batch job {job_id} failed; cancelling {len(job_metadata['shards'])} created shard(s)")
+            await self._cancel_batch_shards(job_metadata["shards"])
+            job_metadata.update({
+                "status": "failed",
+                "error": f"Submission failed: {errors[0]!r}",
+                "last_updated": datetime.now().isoformat()
+            })
+            _write_json_atomic(metadata_file_path, job_metadata)
+            raise errors[0]
+
+        shards = list(outcomes)  # submission order
+        job_metadata.update({
+            "shards": shards,
+            "status": "submitted",
+            "last_updated": datetime.now().isoformat()
+        })
+        _write_json_atomic(metadata_file_path, job_metadata)
+        logger.info(f"Submitted batch job {job_id} with {len(requests)} requests in {len(shards)} shard(s)")
+
+        return BatchJob(job_id=job_id, batch_ids=[shard["batch_id"] for shard in shards],
+                        output_dir=output_dir, metadata_path=metadata_file_path)
+
+    async def _create_batch_shard(self, input_file_path: str) -> Dict[str, Any]:
+        with open(input_file_path, 'rb') as f:
+            batch_file = await self.async_openai_client.files.create(file=f, purpose="batch")
+
+        batch = await self.async_openai_client.batches.create(
             input_file_id=batch_file.id,
             endpoint="/v1/chat/completions",
             completion_window="24h"
         )
-
-        job_metadata = {
+        return {
             "batch_id": batch.id,
             "input_file_id": batch.input_file_id,
+            "input_file_path": input_file_path,
             "status": batch.status,
-            "created_at": batch.created_at,
-            "last_updated": datetime.now().isoformat(),
-            "num_requests": len(requests)
+            "created_at": batch.created_at
         }
 
-        metadata_file_path = os.path.join(output_dir, f"batch_{batch.id}_metadata.json")
-        with open(metadata_file_path, 'w') as f:
-            json.dump(job_metadata, f, indent=2)
+    async def _cancel_batch_shards(self, shards: List[Dict[str, Any]]) -> None:
+        for shard in shards:
+            try:
+                batch = await self.async_openai_client.batches.cancel(shard["batch_id"])
+                shard["status"] = batch.status
+            except Exception as e:
+                logger.error(f"Could not cancel batch shard {shard['batch_id']}: {e}")
+
+    def attach_batch(self, metadata_path: str) -> "BatchJob":
+        """Re-attach to a previously submitted batch job from its metadata file."""
+        return BatchJob.from_metadata(metadata_path)
 
-        start_time = time.time()
+    async def wait_for_batch(self,
+                             job: "BatchJob",
+                             response_format: Union[None, Type[T]] = None,
+                             poll_interval: float = 60) -> BatchResult[T]:
+        """
+        Poll every shard of a batch job with asyncio until all finish, then download their
+        output and merge it back into prompt order. Requests in failed shards are reported
+        as errors; if every shard failed, the result is empty and the metadata carries the error.
+        """
+        job_metadata = job.load_metadata()
+        await asyncio.gather(*[
+            self._wait_for_shard(job, job_metadata, shard, poll_interval) for shard in job_metadata["shards"]
+        ])
+
+        shards = job_metadata["shards"]
+        failed = [shard for shard in shards if shard["status"] != "completed"]
+        if not failed:
+            status = "completed"
+        elif len(failed) < len(shards):
+            status = "partially_completed"
+        else:
+            status = shards[0]["status"] if len({shard["status"] for shard in shards}) == 1 else "failed"
+        job_metadata.update({
+            "status": status,
+            "last_updated": datetime.now().isoformat()
+        })
+        if len(failed) == len(shards):
+            job_metadata["error"] = f"Batch processing {job_metadata['status']}"
+            _write_json_atomic(job.metadata_path, job_metadata)
+            return BatchResult(metadata=job_metadata, results=[])
+        _write_json_atomic(job.metadata_path, job_metadata)
+
+        with open(job_metadata["prompts_file_path"], 'r') as f:
+            prompts_by_id = json.load(f)
+
+        result_files = [path for shard in shards
+                        for path in (shard.get("output_file_path"), shard.get("error_file_path"))]
+        compiled = compile_request("openai", job_metadata.get("model", "gpt-4o-mini"),
+                                   job_metadata.get("system_message"), response_format)
+        results = self._collect_batch_results(prompts_by_id, result_files, compiled)
+        for shard in failed:
+            logger.error(f"Batch shard {shard['batch_id']} {shard['status']}; its requests are reported as errors.")
+            failed_ids = set(_read_custom_ids(shard["input_file_path"]))
+            for result in results:
+                if result["custom_id"] in failed_ids:
+                    result.pop("response", None)
+                    result["error"] = f"Batch processing {shard['status']}"
+        return BatchResult(metadata=job_metadata, results=results)
+
+    async def _wait_for_shard(self, job: "BatchJob", job_metadata: Dict[str, Any], shard: Dict[str, Any],
+                              poll_interval: float) -> None:
+        """Poll one shard until it reaches a terminal state and download its result files."""
+        batch_id = shard["batch_id"]
         while True:
-            current_time = time.time()
-            if current_time - start_time >= update_interval:
-                batch = self.openai_client.batches.retrieve(batch.id)
-                job_metadata.update({
-                    "status": batch.status,
-                    "last_updated": datetime.now().isoformat()
-                })
-                with open(metadata_file_path, 'w') as f:
-                    json.dump(job_metadata, f, indent=2)
-                logger.info(f"Batch status: {batch.status}")
-                start_time = current_time
+            batch = await self.async_openai_client.batches.retrieve(batch_id)
+            shard["status"] = batch.status
+            job_metadata["last_updated"] = datetime.now().isoformat()
+            _write_json_atomic(job.metadata_path, job_metadata)
+            logger.info(f"Batch {batch_id} status: {batch.status}")
 
             if batch.status == "completed":
-                logger.info("Batch processing completed!")
+                logger.info(f"Batch {batch_id} processing completed!")
                 break
-            elif batch.status in ["failed", "canceled"]:
-                logger.error(f"Batch processing {batch.status}.")
-                job_metadata["error"] = f"Batch processing {batch.status}"
-                with open(metadata_file_path, 'w') as f:
-                    json.dump(job_metadata, f, indent=2)
-                return BatchResult(metadata=job_metadata, results=[])
+            elif batch.status in ["failed", "canceled", "expired"]:
+                logger.error(f"Batch {batch_id} processing {batch.status}.")
+                return
 
-            time.sleep(10)
+            await asyncio.sleep(poll_interval)
 
-        output_file_path = os.path.join(output_dir, f"batch_{batch.id}_output.jsonl")
-        file_response = self.openai_client.files.content(batch.output_file_id)
-        with open(output_file_path, "w") as output_file:
-            output_file.write(file_response.text)
+        for key, file_id, suffix in (("output_file_path", batch.output_file_id, "output"),
+                                     ("error_file_path", getattr(batch, "error_file_id", None), "errors")):
+            path = shard.get(key)
+            if path and os.path.exists(path):
+                continue
+            shard[key] = None
+            if file_id:
+                path = os.path.join(job.output_dir, f"batch_{batch_id}_{suffix}.jsonl")
+                await self._download_file(file_id, path)
+                shard[key] = path
+        _write_json_atomic(job.metadata_path, job_metadata)
 
-        job_metadata.update({
-            "status": "completed",
-            "last_updated": datetime.now().isoformat(),
-            "output_file_path": output_file_path
-        })
-        with open(metadata_file_path, 'w') as f:
-            json.dump(job_metadata, f, indent=2)
+    async def _download_file(self, file_id: str, path: str, chunk_size: int = 1024 * 1024) -> None:
+        """Stream an OpenAI file to disk in chunks, renaming into place once complete."""
+        tmp_path = f"{path}.part"
+        async with self.async_openai_client.files.with_streaming_response.content(file_id) as response:
+            with open(tmp_path, 'wb') as f:
+                async for chunk in response.iter_bytes(chunk_size):
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+
+    def _collect_batch_results(self, prompts_by_id: Dict[str, str], result_file_paths: List[Optional[str]],
+                               compiled: CompiledRequest) -> List[Dict[str, Any]]:
+        """
+        Join batch output lines back to their prompts by custom_id, in the original prompt order.
+        Errored or unparseable lines become entries with an "error" key instead of being dropped.
+        """
+        by_id: Dict[str, Dict[str, Any]] = {}
+        for path in result_file_paths:
+            if not path:
+                continue
+            for custom_id, outcome in self._iter_batch_output(path, compiled):
+                if custom_id not in prompts_by_id:
+                    logger.warning(f"Ignoring batch output for unknown custom_id: {custom_id}")
+                    continue
+                by_id.setdefault(custom_id, outcome)
 
         results = []
-        with open(output_file_path, 'r') as f:
-            for line, original_prompt in zip(f, original_prompts):
-                response = json.loads(line)
-                body = response['response']['body']
-                choices = body['choices']
-
-                if 'choices' in body and len(choices) > 0:
-                    content = choices[0]['message']['content']
-
-                    if response_format:
-                        results.append({
-                            "prompt": original_prompt,
-                            "response": response_format(**json.loads(content))
-                        })
-                    else:
-                        results.append({
-                            "prompt": original_prompt,
-                            "response": content
-                        })
-                else:
-                    logger.error(f"Unexpected response format: {response}")
+        for custom_id, prompt in prompts_by_id.items():
+            outcome = by_id.get(custom_id, {"error": "No result returned for this request"})
+            if "error" in outcome:
+                logger.error(f"Batch request {custom_id} failed: {outcome['error']}")
+            results.append({"custom_id": custom_id, "prompt": prompt, **outcome})
+        return results
 
-        return BatchResult(metadata=job_metadata, results=results)
+    def _iter_batch_output(self, path: str, compiled: CompiledRequest):
+        """Parse a batch output/error file line by line, yielding (custom_id, outcome)."""
+        with open(path, 'r') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    logger.error(f"Skipping malformed line {line_number} in {path}: {e}")
+                    continue
+
+                custom_id = record.get("custom_id")
+                response = record.get("response") or {}
+                body = response.get("body") or {}
+                if record.get("error") or response.get("status_code", 200) != 200:
+                    error = record.get("error") or body.get("error") or f"HTTP {response.get('status_code')}"
+                    yield custom_id, {"error": error.get("message", str(error)) if isinstance(error, dict) else str(error)}
+                    continue
+
+                choices = body.get("choices") or []
+                if not choices:
+                    yield custom_id, {"error": f"Unexpected response format: {body}"}
+                    continue
+
+                try:
+                    yield custom_id, {"response": compiled.decode(choices[0]['message']['content'])}
+                except Exception as e:
+                    yield custom_id, {"error": f"Could not parse response: {e}"}
+
+    async def wait_for_batches(self,
+                               jobs: List["BatchJob"],
+                               response_format: Union[None, Type[T]] = None,
+                               poll_interval: float = 60) -> List[BatchResult[T]]:
+        """Track several batch jobs concurrently from one event loop."""
+        return await asyncio.gather(*[
+            self.wait_for_batch(job, response_format, poll_interval) for job in jobs
+        ])
+
+    def _write_batch_shards(self, requests: List[Dict[str, Any]], response_format: Union[None, Type[T]],
+                            output_dir: str, job_id: str, max_requests: int, max_bytes: int) -> List[str]:
+        """Write batch request lines into input files bounded by request count and byte size."""
+        shard_paths: List[str] = []
+        shard_file = None
+        shard_requests = 0
+        shard_bytes = 0
+        try:
+            for request in requests:
+                compiled = compile_request("openai", request['model'], request.get('system_message'), response_format)
+                line = compiled.batch_line(request['custom_id'], request['prompt'], request.get('temperature', 0.7))
+                if len(line) > max_bytes:
+                    raise ValueError(f"Batch request {request['custom_id']} is larger than the {max_bytes} byte shard limit")
+
+                if shard_file is None or shard_requests >= max_requests or shard_bytes + len(line) > max_bytes:
+                    if shard_file is not None:
+                        shard_file.close()
+                    shard_paths.append(os.path.join(output_dir, f"batch_{job_id}_input_{len(shard_paths) + 1}.jsonl"))
+                    shard_file = open(shard_paths[-1], 'wb')
+                    shard_requests = 0
+                    shard_bytes = 0
+
+                shard_file.write(line)
+                shard_requests += 1
+                shard_bytes += len(line)
+        finally:
+            if shard_file is not None:
+                shard_file.close()
+        return shard_paths
+
+    async def _async_process_batch(self, prompts: List[str], model: str, system_message: str, temperature: float,
+                                   response_format: Union[None, Type[T]], output_dir: str, update_interval: int,
+                                   deduplicate_prompts: bool) -> BatchResult[T]:
+        # Runs on its own event loop (see `process`), whose connections are closed at the end
+        async with self._pools or get_pools():
+            job = await self.submit_batch(prompts, model, system_message, temperature, response_format,
+                                          output_dir, deduplicate_prompts)
+            return await self.wait_for_batch(job, response_format, poll_interval=update_interval)
+
+
+def _read_custom_ids(input_file_path: str) -> List[str]:
+    with open(input_file_path, 'r') as f:
+        return [json.loads(line)["custom_id"] for line in f if line.strip()]
+
+
+def _write_json_atomic(path: str, data: Any) -> None:
+    """Write JSON via a temp file and rename, so a crash never leaves a truncated file behind."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class BatchJob(BaseModel):
+    """Handle to a submitted (possibly sharded) batch job, persisted through its metadata file."""
+    job_id: str
+    batch_ids: List[str]
+    output_dir: str
+    metadata_path: str
+
+    @classmethod
+    def from_metadata(cls, metadata_path: str) -> "BatchJob":
+        with open(metadata_path, 'r') as f:
+            metadata = json.load(f)
+        return cls(
+            job_id=metadata["job_id"],
+            batch_ids=[shard["batch_id"] for shard in metadata["shards"]],
+            output_dir=os.path.dirname(os.path.abspath(metadata_path)),
+            metadata_path=metadata_path
+        )
+
+    def load_metadata(self) -> Dict[str, Any]:
+        with open(self.metadata_path, 'r') as f:
+            return json.load(f)
+
+
+_handlers: Dict[str, LLMAPIHandler] = {}
+_handlers_lock = threading.Lock()
+
+
+def get_handler(name: str = "default", **kwargs) -> LLMAPIHandler:
+    """
+    Return the process-wide LLMAPIHandler registered under `name`, creating it with `kwargs`
+    on first use. Sharing one handler shares its SDK clients, caches, concurrency limits,
+    token budgets and circuit breakers across every component of the pipeline.
+    """
+    handler = _handlers.get(name)
+    if handler is None:
+        with _handlers_lock:
+            handler = _handlers.get(name)
+            if handler is None:
+                handler = _handlers[name] = LLMAPIHandler(**kwargs)
+    elif kwargs:
+        logger.warning(f"Handler '{name}' already exists; ignoring {sorted(kwargs)}")
+    return handler
+
+
+def reset_handlers() -> None:
+    """Forget all registered handlers, e.g. between tests."""
+    with _handlers_lock:
+        _handlers.clear()
 
 # Example usage and test code
 if __name__ == "__main__":
@@ -414,13 +1190,14 @@ if __name__ == "__main__":
 
     # Test asynchronous processing
     async def test_async_processing():
-        async_batch_result = await handler.async_process(
-            prompts=["What's the capital of Portugal?", "What's the capital of Netherlands?", "What's the capital of Belgium?"],
-            model="gpt-4o-mini",
-            system_message="You are a helpful assistant.",
-            temperature=0.6,
-            response_format=ResponseModel
-        )
+        async with get_pools():
+            async_batch_result = await handler.async_process(
+                prompts=["What's the capital of Portugal?", "What's the capital of Netherlands?", "What's the capital of Belgium?"],
+                model="gpt-4o-mini",
+                system_message="You are a helpful assistant.",
+                temperature=0.6,
+                response_format=ResponseModel
+            )
         print("Asynchronous processing results:")
         for res in async_batch_result:
             print(res)
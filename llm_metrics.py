@@ -0,0 +1,269 @@
+import json
+import time
+import bisect
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+import model_registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STAGE = "unspecified"
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_current_stage: ContextVar[str] = ContextVar("llm_stage", default=DEFAULT_STAGE)
+
+
+@contextmanager
+def stage(name: str):
+    """Tag every LLM call made inside the block (including tasks it spawns) with `name`."""
+    token = _current_stage.set(name)
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+
+
+def current_stage() -> str:
+    return _current_stage.get()
+
+
+def usage_breakdown(response: Any) -> Tuple[int, int, int]:
+    """(prompt, completion, cached prompt) tokens reported by an OpenAI or Anthropic response."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return 0, 0, 0
+
+    def tokens(obj, name):
+        value = getattr(obj, name, None)
+        return value if isinstance(value, int) else 0
+
+    if isinstance(getattr(usage, "prompt_tokens", None), int):
+        cached = tokens(getattr(usage, "prompt_tokens_details", None), "cached_tokens")
+        return tokens(usage, "prompt_tokens"), tokens(usage, "completion_tokens"), cached
+    # Anthropic reports cache reads separately from (and in addition to) input_tokens
+    cached = tokens(usage, "cache_read_input_tokens")
+    prompt = tokens(usage, "input_tokens") + cached + tokens(usage, "cache_creation_input_tokens")
+    return prompt, tokens(usage, "output_tokens"), cached
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """Estimated USD cost of a call, priced from the model registry; 0.0 for unregistered models."""
+    spec = model_registry.registry.find(model)
+    if spec is None:
+        return 0.0
+    return spec.cost(prompt_tokens, completion_tokens, cached_tokens)
+
+
+class CallRecord(BaseModel):
+    """One LLM call as seen by LLMAPIHandler."""
+    stage: str = DEFAULT_STAGE
+    provider: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    wall_time: float = 0.0
+    queue_wait: float = 0.0
+    schedule_wait: float = 0.0
+    tenant: str = "default"
+    retries: int = 0
+    cost: float = 0.0
+    cache_hit: bool = False
+    error: Optional[str] = None
+
+
+class Histogram:
+    """Cumulative bucket counts (for Prometheus) plus a window of recent samples for percentiles."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window: int = 2048):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._recent: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self._recent.append(value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._recent:
+            return None
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+class _Series:
+    """Aggregates for one (stage, provider, model)."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.cost = 0.0
+        self.wall_time = Histogram()
+        self.queue_wait = Histogram()
+        self.schedule_wait = Histogram()
+
+
+class MetricsRegistry:
+    """Thread-safe in-process aggregation of CallRecords, exportable as JSON or Prometheus text."""
+
+    def __init__(self, recent_records: int = 1000):
+        self._series: Dict[Tuple[str, str, str], _Series] = {}
+        self._recent: Deque[CallRecord] = deque(maxlen=recent_records)
+        self._lock = threading.Lock()
+
+    def record(self, record: CallRecord) -> None:
+        with self._lock:
+            series = self._series.setdefault((record.stage, record.provider, record.model), _Series())
+            series.calls += 1
+            series.errors += record.error is not None
+            series.cache_hits += record.cache_hit
+            series.retries += record.retries
+            series.prompt_tokens += record.prompt_tokens
+            series.completion_tokens += record.completion_tokens
+            series.cached_tokens += record.cached_tokens
+            series.cost += record.cost
+            if not record.cache_hit:
+                series.wall_time.observe(record.wall_time)
+                series.queue_wait.observe(record.queue_wait)
+                series.schedule_wait.observe(record.schedule_wait)
+            self._recent.append(record)
+
+    def recent(self) -> List[CallRecord]:
+        with self._lock:
+            return list(self._recent)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+            self._recent.clear()
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{
+                "stage": stage_name,
+                "provider": provider,
+                "model": model,
+                "calls": series.calls,
+                "errors": series.errors,
+                "cache_hits": series.cache_hits,
+                "retries": series.retries,
+                "prompt_tokens": series.prompt_tokens,
+                "completion_tokens": series.completion_tokens,
+                "cached_tokens": series.cached_tokens,
+                "cost_usd": round(series.cost, 6),
+                "wall_time_seconds": series.wall_time.summary(),
+                "queue_wait_seconds": series.queue_wait.summary(),
+                "schedule_wait_seconds": series.schedule_wait.summary(),
+            } for (stage_name, provider, model), series in sorted(self._series.items())]
+
+    def to_json(self) -> str:
+        return json.dumps({"generated_at": time.time(), "series": self.snapshot()}, indent=2)
+
+    def to_prometheus(self) -> str:
+        """Render the registry in the Prometheus text exposition format."""
+        counters = [
+            ("llm_calls_total", "LLM calls, including cache hits and failures", "calls"),
+            ("llm_errors_total", "LLM calls that failed after retries", "errors"),
+            ("llm_cache_hits_total", "LLM calls served from the response cache", "cache_hits"),
+            ("llm_retries_total", "Retried LLM attempts", "retries"),
+            ("llm_prompt_tokens_total", "Prompt tokens", "prompt_tokens"),
+            ("llm_completion_tokens_total", "Completion tokens", "completion_tokens"),
+            ("llm_cached_tokens_total", "Prompt tokens served from the provider's prompt cache", "cached_tokens"),
+            ("llm_cost_usd_total", "Estimated cost in USD", "cost"),
+        ]
+        histograms = [
+            ("llm_call_duration_seconds", "Wall time per call, including retries and queueing", "wall_time"),
+            ("llm_queue_wait_seconds", "Time spent waiting for admission, token budget and concurrency slots", "queue_wait"),
+            ("llm_schedule_wait_seconds", "Time spent waiting for admission by the request scheduler", "schedule_wait"),
+        ]
+        with self._lock:
+            items = sorted(self._series.items())
+            lines = []
+            for name, help_text, attr in counters:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for key, series in items:
+                    lines.append(f"{name}{{{_labels(*key)}}} {getattr(series, attr)}")
+            for name, help_text, attr in histograms:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for key, series in items:
+                    histogram = getattr(series, attr)
+                    labels = _labels(*key)
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(stage_name: str, provider: str, model: str) -> str:
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'stage="{escape(stage_name)}",provider="{escape(provider)}",model="{escape(model)}"'
+
+
+# Process-wide registry used by LLMAPIHandler unless it is given its own
+registry = MetricsRegistry()
+
+
+def start_metrics_server(port: int = 9464, host: str = "127.0.0.1",
+                         metrics: Optional[MetricsRegistry] = None):
+    """
+    Serve `/metrics` (Prometheus text) and `/metrics.json` from a daemon thread.
+    Call `shutdown()` on the returned server to stop it.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    metrics = metrics or registry
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = metrics.to_json(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            payload = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logger.debug(f"Metrics request: {format % args}")
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="llm-metrics", daemon=True).start()
+    logger.info(f"Serving LLM metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,95 @@
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+class ModelSpec(BaseModel):
+    """What the router needs to know about a model. Costs are USD per million tokens."""
+    name: str
+    provider: str
+    input_cost: float
+    cached_input_cost: float
+    output_cost: float
+    context_tokens: int
+    max_output_tokens: int
+    tokens_per_second: float  # typical output throughput
+
+    def cost(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+        uncached = max(0, prompt_tokens - cached_tokens)
+        return (uncached * self.input_cost + cached_tokens * self.cached_input_cost
+                + completion_tokens * self.output_cost) / 1_000_000
+
+    def fits(self, prompt_tokens: int) -> bool:
+        """Whether a prompt of `prompt_tokens` leaves room for a full-length completion."""
+        return prompt_tokens + self.max_output_tokens <= self.context_tokens
+
+
+DEFAULT_MODELS = [
+    ModelSpec(name="gpt-4o-mini", provider="openai", input_cost=0.15, cached_input_cost=0.075, output_cost=0.60,
+              context_tokens=128_000, max_output_tokens=16_384, tokens_per_second=85),
+    ModelSpec(name="gpt-4o-2024-08-06", provider="openai", input_cost=2.50, cached_input_cost=1.25, output_cost=10.00,
+              context_tokens=128_000, max_output_tokens=16_384, tokens_per_second=60),
+    ModelSpec(name="claude-3-5-sonnet-20240620", provider="anthropic", input_cost=3.00, cached_input_cost=0.30,
+              output_cost=15.00, context_tokens=200_000, max_output_tokens=8_192, tokens_per_second=55),
+]
+
+# Cascades per task, cheapest/fastest tier first. Later tiers only see escalated prompts.
+DEFAULT_ROUTES: Dict[str, List[str]] = {
+    "query_generation": ["gpt-4o-mini"],
+    "ranking": ["gpt-4o-mini", "gpt-4o-2024-08-06"],
+    "analysis": ["gpt-4o-mini", "gpt-4o-2024-08-06"],
+    "synthesis": ["gpt-4o-2024-08-06"],
+}
+
+
+class ModelRegistry:
+    """Known models and the cascade of models used for each task."""
+
+    def __init__(self, models: Iterable[ModelSpec] = DEFAULT_MODELS,
+                 routes: Optional[Dict[str, List[str]]] = None):
+        self._models: Dict[str, ModelSpec] = {}
+        for spec in models:
+            self.register(spec)
+        self.routes: Dict[str, List[str]] = {}
+        for task, models in (DEFAULT_ROUTES if routes is None else routes).items():
+            self.set_route(task, models)
+
+    def register(self, spec: ModelSpec) -> None:
+        self._models[spec.name] = spec
+
+    def set_route(self, task: str, models: List[str]) -> None:
+        for model in models:
+            self.get(model)
+        self.routes[task] = list(models)
+
+    def get(self, model: str) -> ModelSpec:
+        spec = self._models.get(model)
+        if spec is None:
+            raise ValueError(f"Invalid model: {model}")
+        return spec
+
+    def find(self, model: str) -> Optional[ModelSpec]:
+        return self._models.get(model)
+
+    def names(self, provider: Optional[str] = None) -> List[str]:
+        return [name for name, spec in self._models.items() if provider is None or spec.provider == provider]
+
+    def cascade(self, task: str) -> List[ModelSpec]:
+        """
+        Models to try for `task`, in order. Tasks without a route use every model, cheapest
+        first and, at equal cost, fastest first.
+        """
+        if task in self.routes:
+            return [self.get(model) for model in self.routes[task]]
+        return sorted(self._models.values(), key=lambda spec: (spec.cost(1_000, 1_000), -spec.tokens_per_second))
+
+    def primary(self, task: str) -> str:
+        """First (cheapest) model of the cascade for `task`."""
+        return self.cascade(task)[0].name
+
+
+# Process-wide registry used by LLMAPIHandler, llm_metrics and the pipeline stages
+registry = ModelRegistry()
@@ -1,4 +1,4 @@
-from typing import List, Optional, Dict 
+from typing import Awaitable, Callable, List, Optional, Dict 
 from pydantic import BaseModel, Field
 
 class Paper(BaseModel):
@@ -9,6 +9,8 @@ class Paper(BaseModel):
     publication_year: Optional[int] = None
     abstract: Optional[str] = None
     full_text: Optional[str] = None
+    # Fetches the full text on demand when the search only returned metadata
+    full_text_loader: Optional[Callable[[], Awaitable[str]]] = Field(default=None, exclude=True, repr=False)
 
 class RankedPaper(Paper):
     relevance_score: float = 0.0
@@ -37,6 +39,10 @@ class SearchResult(BaseModel):
     full_text: str = ""
     search_query: str = ""
     query_rationale: str = ""
+    source_id: str = ""  # identifier in the source database, e.g. the CORE work id
+    abstract: str = ""
+    # Set on metadata-only results: fetches the full text on demand (see Paper.full_text_loader)
+    full_text_loader: Optional[Callable[[], Awaitable[str]]] = Field(default=None, exclude=True, repr=False)
 class SearchResults(BaseModel):
     results: List[SearchResult] = []
 
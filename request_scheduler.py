@@ -0,0 +1,175 @@
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Lower numbers are served first. Interactive stages outrank fan-out work.
+PRIORITY_CLASSES = {
+    "synthesis": 0,
+    "query_generation": 0,
+    "analysis": 1,
+    "ranking": 2,
+    "batch": 3,
+}
+DEFAULT_PRIORITY = 1
+DEFAULT_TENANT = "default"
+
+_current_tenant: ContextVar[str] = ContextVar("llm_tenant", default=DEFAULT_TENANT)
+
+
+@contextmanager
+def tenant(name: str):
+    """Queue every LLM call made inside the block (including tasks it spawns) under tenant `name`."""
+    token = _current_tenant.set(name)
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+
+def current_tenant() -> str:
+    return _current_tenant.get()
+
+
+def resolve_priority(priority: Union[None, int, str], stage: Optional[str] = None) -> int:
+    """Map a priority class name or number to a number, defaulting to the class of `stage`."""
+    if priority is None:
+        return PRIORITY_CLASSES.get(stage, DEFAULT_PRIORITY)
+    if isinstance(priority, int):
+        return priority
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class: {priority}. Expected one of {sorted(PRIORITY_CLASSES)}")
+    return PRIORITY_CLASSES[priority]
+
+
+class RequestScheduler:
+    """
+    Admission queue in front of one provider/model. At most `capacity()` requests are admitted
+    at once. Waiting requests are served strictly by priority class. Within a class, tenants
+    share admissions by weighted fair queuing (start-time fair queuing over virtual time), so
+    one tenant's large fan-out cannot starve another tenant's single request.
+    """
+
+    def __init__(self, name: str = "default", capacity: Union[int, Callable[[], int]] = 16,
+                 tenant_weights: Optional[Dict[str, float]] = None):
+        self.name = name
+        self._capacity = capacity if callable(capacity) else (lambda: capacity)
+        self.tenant_weights = tenant_weights or {}
+        self._in_flight = 0
+        # priority -> heap of (finish tag, sequence, start tag, tenant, future)
+        self._queues: Dict[int, List[Tuple[float, int, float, str, asyncio.Future]]] = {}
+        self._queued = 0
+        self._virtual_time: Dict[int, float] = {}
+        self._last_finish: Dict[Tuple[int, str], float] = {}
+        self._sequence = itertools.count()
+        self._waits: Dict[int, Dict[str, float]] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self._capacity(),
+            "in_flight": self._in_flight,
+            "queued": {priority: sum(1 for entry in queue if not entry[4].done())
+                       for priority, queue in sorted(self._queues.items()) if queue},
+            "wait": {priority: {"admitted": int(w["count"]), "mean": w["total"] / w["count"], "max": w["max"]}
+                     for priority, w in sorted(self._waits.items())},
+        }
+
+    @asynccontextmanager
+    async def admit(self, priority: int = DEFAULT_PRIORITY, tenant: str = DEFAULT_TENANT, cost: float = 1.0):
+        """Hold an admission for the duration of the block. Yields the seconds spent queued."""
+        waited = await self.acquire(priority, tenant, cost)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    async def acquire(self, priority: int = DEFAULT_PRIORITY, tenant: str = DEFAULT_TENANT,
+                      cost: float = 1.0) -> float:
+        start = time.monotonic()
+        if self._queued == 0 and self._in_flight < self._capacity():
+            self._in_flight += 1
+            self._record_wait(priority, 0.0)
+            return 0.0
+
+        virtual_time = self._virtual_time.get(priority, 0.0)
+        start_tag = max(virtual_time, self._last_finish.get((priority, tenant), 0.0))
+        finish_tag = start_tag + cost / self.tenant_weights.get(tenant, 1.0)
+        self._last_finish[(priority, tenant)] = finish_tag
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queues.setdefault(priority, []),
+                       (finish_tag, next(self._sequence), start_tag, tenant, waiter))
+        self._queued += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Admitted just as we were cancelled; pass the admission on.
+                self.release()
+            else:
+                waiter.cancel()
+                self._queued -= 1
+            raise
+
+        waited = time.monotonic() - start
+        self._record_wait(priority, waited)
+        return waited
+
+    def release(self) -> None:
+        self._in_flight = max(0, self._in_flight - 1)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        capacity = self._capacity()
+        while self._queued and self._in_flight < capacity:
+            priority = min(p for p, queue in self._queues.items() if queue)
+            queue = self._queues[priority]
+            _, _, start_tag, tenant, waiter = heapq.heappop(queue)
+            if waiter.done():
+                # Cancelled while queued; already uncounted
+                continue
+            self._queued -= 1
+            self._virtual_time[priority] = max(self._virtual_time.get(priority, 0.0), start_tag)
+            self._in_flight += 1
+            waiter.set_result(None)
+        for priority in [p for p, queue in self._queues.items() if not queue]:
+            del self._queues[priority]
+
+    def _record_wait(self, priority: int, waited: float) -> None:
+        stats = self._waits.setdefault(priority, {"count": 0, "total": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["total"] += waited
+        stats["max"] = max(stats["max"], waited)
+
+
+class SchedulerRegistry:
+    """One RequestScheduler per (provider, model), created on first use."""
+
+    def __init__(self, tenant_weights: Optional[Dict[str, float]] = None):
+        self.tenant_weights = tenant_weights or {}
+        self._schedulers: Dict[Tuple[str, str], RequestScheduler] = {}
+
+    def get(self, provider: str, model: str, capacity: Union[int, Callable[[], int]]) -> RequestScheduler:
+        key = (provider, model)
+        scheduler = self._schedulers.get(key)
+        if scheduler is None:
+            scheduler = RequestScheduler(f"{provider}:{model}", capacity, self.tenant_weights)
+            self._schedulers[key] = scheduler
+        return scheduler
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {scheduler.name: scheduler.stats() for scheduler in self._schedulers.values()}
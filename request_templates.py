@@ -0,0 +1,133 @@
+import json
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYSTEM_MESSAGE = "You are a helpful assistant."
+
+# Placeholders substituted into pre-serialized batch lines
+_ID_PLACEHOLDER = "\x00custom_id\x00"
+_PROMPT_PLACEHOLDER = "\x00prompt\x00"
+
+
+class CompiledRequest:
+    """
+    Everything about a request that depends only on (provider, model, system message,
+    response_format): schema text, resolved system messages, message skeletons, the
+    OpenAI structured-output parameter, pre-serialized batch line templates and a fast
+    JSON decoder. Build instances through `compile_request` so they are cached.
+    """
+
+    def __init__(self, provider: str, model: str, system_message: Optional[str],
+                 response_format: Optional[Type[BaseModel]]):
+        self.provider = provider
+        self.model = model
+        self.response_format = response_format
+        self.user_system_message = system_message
+
+        self.schema_text = json.dumps(response_format.model_json_schema()) if response_format else None
+        self.format_instruction = f"Answer exclusively in this JSON format: {self.schema_text}" if response_format else None
+
+        # Regular mode: the format instruction replaces the caller's system message
+        self.system_message = self.format_instruction or system_message or DEFAULT_SYSTEM_MESSAGE
+        if provider == "openai":
+            self._skeleton = ({"role": "system", "content": self.system_message},)
+            self._prompt_prefix = ""
+        else:
+            self._skeleton = ()
+            self._prompt_prefix = f"{self.format_instruction}\n\n" if response_format else ""
+
+        # Batch mode keeps the caller's system message after the format instruction
+        batch_skeleton = []
+        if self.format_instruction:
+            batch_skeleton.append({"role": "system", "content": self.format_instruction})
+        if system_message:
+            batch_skeleton.append({"role": "system", "content": system_message})
+        self._batch_skeleton = tuple(batch_skeleton)
+        self._batch_templates: Dict[float, Tuple[str, str, str]] = {}
+
+        self.openai_response_format = _openai_response_format(response_format) if provider == "openai" and response_format else None
+
+    def messages(self, prompt: str) -> List[Dict[str, str]]:
+        """Chat messages for a regular-mode request."""
+        return [*self._skeleton, {"role": "user", "content": self._prompt_prefix + prompt}]
+
+    def batch_line(self, custom_id: str, prompt: str, temperature: float) -> bytes:
+        """One JSONL line of a Batch API input file, serializing only the per-request parts."""
+        template = self._batch_templates.get(temperature)
+        if template is None:
+            line = json.dumps({
+                "custom_id": _ID_PLACEHOLDER,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": [*self._batch_skeleton, {"role": "user", "content": _PROMPT_PLACEHOLDER}],
+                    "temperature": temperature,
+                    "response_format": {"type": "json_object"}
+                }
+            })
+            head, rest = line.split(json.dumps(_ID_PLACEHOLDER))
+            middle, tail = rest.split(json.dumps(_PROMPT_PLACEHOLDER))
+            template = self._batch_templates[temperature] = (head, middle, tail + "\n")
+        head, middle, tail = template
+        return (head + json.dumps(custom_id) + middle + json.dumps(prompt) + tail).encode("utf-8")
+
+    def decode(self, content: Optional[str]) -> Any:
+        """Validate a JSON reply straight into the response model, tolerating text around the object."""
+        if self.response_format is None:
+            return content
+        if not content:
+            raise ValueError(f"Empty response from {self.model}")
+        try:
+            return self.response_format.model_validate_json(content)
+        except ValidationError as e:
+            json_start = content.find('{')
+            json_end = content.rfind('}') + 1
+            if json_start == -1 or json_end <= json_start or (json_start == 0 and json_end == len(content)):
+                raise ValueError(f"Failed to extract JSON from {self.model} response: {e}") from e
+            return self.response_format.model_validate_json(content[json_start:json_end])
+
+
+def _strict_json_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Apply OpenAI's strict structured-output rules to a JSON schema: every object is closed and
+    lists all of its properties as required, and `null` defaults are dropped.
+    """
+    schema = dict(schema)
+    for key in ("$defs", "definitions", "properties"):
+        if isinstance(schema.get(key), dict):
+            schema[key] = {name: _strict_json_schema(sub) for name, sub in schema[key].items()}
+    for key in ("anyOf", "allOf", "oneOf"):
+        if isinstance(schema.get(key), list):
+            schema[key] = [_strict_json_schema(sub) for sub in schema[key]]
+    if isinstance(schema.get("items"), dict):
+        schema["items"] = _strict_json_schema(schema["items"])
+    if schema.get("type") == "object":
+        schema["additionalProperties"] = False
+        schema["required"] = list(schema.get("properties", {}))
+    if "default" in schema and schema["default"] is None:
+        del schema["default"]
+    return schema
+
+
+def _openai_response_format(response_format: Type[BaseModel]) -> Dict[str, Any]:
+    """Strict json_schema parameter for OpenAI structured outputs."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "schema": _strict_json_schema(response_format.model_json_schema()),
+            "name": response_format.__name__,
+            "strict": True,
+        },
+    }
+
+
+@lru_cache(maxsize=512)
+def compile_request(provider: str, model: str, system_message: Optional[str],
+                    response_format: Optional[Type[BaseModel]]) -> CompiledRequest:
+    return CompiledRequest(provider, model, system_message, response_format)
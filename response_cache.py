@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple, Type, Union
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(os.getcwd(), 'data', 'llm_cache.sqlite3')
+
+# Sentinel returned by ResponseCache.get when there is no usable entry, so that
+# an empty-string response can still be cached and returned.
+MISS = object()
+
+
+@lru_cache(maxsize=None)
+def schema_fingerprint(response_format: Union[None, Type[BaseModel]]) -> Optional[Dict[str, Any]]:
+    """
+    Describe a response format so that schema changes invalidate cached entries. Memoized per
+    model class, since every request's single-flight key needs it; treat the result as read-only.
+    """
+    if response_format is None:
+        return None
+    return {
+        "name": f"{response_format.__module__}.{response_format.__qualname__}",
+        "schema": response_format.model_json_schema(),
+    }
+
+
+def make_cache_key(request: Dict[str, Any], response_format: Union[None, Type[BaseModel]]) -> str:
+    """Hash the full request (model, system message, temperature, prompt) plus the response schema."""
+    payload = {
+        "model": request.get("model"),
+        "system_message": request.get("system_message"),
+        "temperature": request.get("temperature", 0.7),
+        "prompt": request.get("prompt"),
+        "response_format": schema_fingerprint(response_format),
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache of LLM responses backed by SQLite.
+
+    Entries expire after `ttl_seconds` (if set) and the least recently used entries are
+    evicted once the cache grows past `max_entries` or `max_bytes`. Structured responses
+    are stored as JSON and rehydrated into the caller's Pydantic model on read. Entry and
+    byte totals are kept in memory so writes only scan the table when over a bound, and
+    expired rows are swept every `sweep_every` writes. The async methods run in a worker
+    thread so cache lookups never block the event loop.
+    """
+
+    def __init__(self,
+                 path: str = DEFAULT_CACHE_PATH,
+                 ttl_seconds: Optional[float] = 7 * 24 * 3600,
+                 max_entries: Optional[int] = 100_000,
+                 max_bytes: Optional[int] = 512 * 1024 * 1024,
+                 sweep_every: int = 256):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_every = sweep_every
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        self._entries, self._bytes = self._count()
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """Build a cache from LLM_CACHE_PATH / LLM_CACHE_TTL, or return None if caching is not configured."""
+        path = os.getenv("LLM_CACHE_PATH")
+        if not path:
+            return None
+        ttl = os.getenv("LLM_CACHE_TTL")
+        return cls(path=path, ttl_seconds=float(ttl) if ttl else 7 * 24 * 3600)
+
+    def get(self, key: str, response_format: Union[None, Type[BaseModel]] = None) -> Any:
+        """Return the cached response for `key`, rehydrated into `response_format`, or MISS."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT kind, value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return MISS
+            kind, value, created_at = row
+            if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                self._delete(key)
+                return MISS
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+
+        try:
+            return self._decode(kind, value, response_format)
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cache entry {key[:12]}: {e}")
+            self.delete(key)
+            return MISS
+
+    def set(self, key: str, response: Any) -> None:
+        """Store a response (string or Pydantic model) under `key` and enforce the size bounds."""
+        kind, value = self._encode(response)
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._delete(key)
+            self._conn.execute(
+                "INSERT INTO responses (key, kind, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, value, size, now, now),
+            )
+            self._entries += 1
+            self._bytes += size
+            self._writes += 1
+            self._evict()
+
+    async def aget(self, key: str, response_format: Union[None, Type[BaseModel]] = None) -> Any:
+        return await asyncio.to_thread(self.get, key, response_format)
+
+    async def aset(self, key: str, response: Any) -> None:
+        await asyncio.to_thread(self.set, key, response)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._delete(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._entries = self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, total = self._count()
+        return {"entries": entries, "bytes": total}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _count(self) -> Tuple[int, int]:
+        return self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+    def _delete(self, key: str) -> None:
+        """Delete one entry and keep the running totals in step. Caller holds the lock."""
+        row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._entries -= 1
+            self._bytes -= row[0]
+
+    def _evict(self) -> None:
+        """
+        Periodically drop expired entries, then least recently used ones until within bounds.
+        Caller holds the lock.
+        """
+        excess_entries = self._entries - self.max_entries if self.max_entries is not None else 0
+        excess_bytes = self._bytes - self.max_bytes if self.max_bytes is not None else 0
+        if self._writes % self.sweep_every == 0 or excess_entries > 0 or excess_bytes > 0:
+            if self.ttl_seconds is not None:
+                self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            # Resync with the table, which other processes sharing the file may also have written
+            self._entries, self._bytes = self._count()
+            excess_entries = self._entries - self.max_entries if self.max_entries is not None else 0
+            excess_bytes = self._bytes - self.max_bytes if self.max_bytes is not None else 0
+        if excess_entries <= 0 and excess_bytes <= 0:
+            return
+
+        doomed = []
+        freed = 0
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC"):
+            if len(doomed) >= excess_entries and freed >= excess_bytes:
+                break
+            doomed.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self._entries -= len(doomed)
+        self._bytes -= freed
+        logger.debug(f"Evicted {len(doomed)} cached responses ({freed} bytes)")
+
+    @staticmethod
+    def _encode(response: Any) -> Tuple[str, str]:
+        if isinstance(response, BaseModel):
+            return "model", response.model_dump_json()
+        if isinstance(response, str):
+            return "text", response
+        return "json", json.dumps(response)
+
+    @staticmethod
+    def _decode(kind: str, value: str, response_format: Union[None, Type[BaseModel]]) -> Any:
+        if kind == "text":
+            return value
+        if kind == "model":
+            if response_format is None:
+                return json.loads(value)
+            return response_format.model_validate_json(value)
+        data = json.loads(value)
+        if response_format is not None:
+            return response_format.model_validate(data)
+        return data
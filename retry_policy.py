@@ -0,0 +1,158 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Optional
+
+import backoff
+
+from concurrency_control import error_headers, error_status, parse_duration
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying: timeouts, conflicts, rate limits, server errors and Anthropic's 529 "overloaded"
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+# SDK connection/timeout errors carry no status, so they are recognised by name
+RETRYABLE_ERROR_NAMES = {"APIConnectionError", "APITimeoutError"}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without contacting the provider while its circuit breaker is open."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, CircuitOpenError):
+        return False
+    status = error_status(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    if any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(exc).__mro__):
+        return True
+    return isinstance(exc, (asyncio.TimeoutError, ConnectionError))
+
+
+def is_provider_failure(exc: BaseException) -> bool:
+    """Errors that suggest the provider itself is unhealthy (as opposed to throttling or bad input)."""
+    status = error_status(exc)
+    if status is not None:
+        return status >= 500
+    return is_retryable(exc)
+
+
+def retry_after_seconds(exc: Optional[BaseException]) -> Optional[float]:
+    if exc is None:
+        return None
+    headers = {str(k).lower(): v for k, v in dict(error_headers(exc)).items()}
+    retry_after_ms = parse_duration(headers.get("retry-after-ms"))
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    return parse_duration(headers.get("retry-after"))
+
+
+def jittered_backoff(base: float = 1.0, factor: float = 2.0, max_value: float = 60.0):
+    """
+    backoff wait generator: full-jitter exponential delays that never undercut the
+    Retry-After (or retry-after-ms) header of the error being retried.
+    """
+    exc = yield
+    attempt = 0
+    while True:
+        wait = random.uniform(0, min(max_value, base * factor ** attempt))
+        retry_after = retry_after_seconds(exc)
+        if retry_after is not None:
+            wait = max(wait, min(retry_after, max_value))
+        exc = yield wait
+        attempt += 1
+
+
+def _log_backoff(details):
+    exc = details.get("exception")
+    logger.warning(
+        f"Retrying {details['target'].__name__} in {details['wait']:.1f}s "
+        f"after attempt {details['tries']} failed: {exc!r}"
+    )
+
+
+def retrying(max_tries: int = 5, max_time: Optional[float] = 300, base: float = 1.0, max_value: float = 60.0,
+             on_backoff=None):
+    """Decorator retrying sync or async callables on transient provider errors."""
+    handlers = [_log_backoff] + ([on_backoff] if on_backoff else [])
+    return backoff.on_exception(
+        jittered_backoff,
+        Exception,
+        max_tries=max_tries,
+        max_time=max_time,
+        giveup=lambda e: not is_retryable(e),
+        jitter=None,
+        on_backoff=handlers,
+        base=base,
+        max_value=max_value,
+    )
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker. After `failure_threshold` consecutive provider failures
+    the circuit opens and calls fail fast with CircuitOpenError. After `reset_timeout`
+    seconds a single probe is let through; its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            remaining = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+            raise CircuitOpenError(f"Circuit for {self.name} is open; retry in {remaining:.0f}s")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit for {self.name} closed")
+            self.state = self.CLOSED
+
+    def record_cancelled(self) -> None:
+        """
+        Release a call that ended without an outcome (e.g. cancelled). A cancelled half-open
+        probe returns the circuit to OPEN without restarting the timeout, so the next call probes.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probe_in_flight:
+                self.state = self.OPEN
+            self._probe_in_flight = False
+
+    def record_failure(self, exc: BaseException) -> None:
+        with self._lock:
+            if not is_provider_failure(exc):
+                # The provider answered; only release a half-open probe.
+                self._probe_in_flight = False
+                return
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.error(f"Circuit for {self.name} opened after {self._failures} failures: {exc!r}")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
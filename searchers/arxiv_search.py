@@ -1,68 +1,151 @@
 # searchers/arxiv_search.py
-import os
 import asyncio
 import aiohttp
-import aiofiles
 import xml.etree.ElementTree as ET
-from typing import List, Dict
-import fitz  # PyMuPDF
-import re
+from typing import List, Dict, Optional, Tuple, Union
+from functools import partial
 from aiolimiter import AsyncLimiter
-import tempfile
-from concurrent.futures import ThreadPoolExecutor
 from asyncio import Semaphore
-import time
 import logging
 from .searcher import Searcher
+from .fulltext_store import FullTextStore, arxiv_key, doi_key
+from .pdf_extraction import DEFAULT_SPOOL_BYTES, PDFBuffer, PDFExtractor, PDFTooLargeError, get_extractor
+from http_pools import get_pools
 from models import SearchQueries, SearchResults, SearchResult, SearchQuery
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
-# Define the data directory
-DATA_DIR = os.path.join(os.getcwd(), 'data')
-PDF_DIR = os.path.join(DATA_DIR, 'pdfs')
-os.makedirs(PDF_DIR, exist_ok=True)
+DEFAULT_MAX_PDF_BYTES = 50 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
 class ArXivSearch(Searcher):
-    def __init__(self, max_results: int = 10):
+    def __init__(self, max_results: int = 10, metadata_concurrency: int = 5,
+                 download_concurrency: int = 8, extract_concurrency: int = 5,
+                 extractor: Optional[PDFExtractor] = None,
+                 max_pdf_bytes: Optional[int] = DEFAULT_MAX_PDF_BYTES, spool_bytes: int = DEFAULT_SPOOL_BYTES,
+                 store: Optional[FullTextStore] = None, metadata_only: bool = False):
         self.max_results = max_results
         self.rate_limiter = AsyncLimiter(5, 1)  # 5 requests per second
-        self.semaphore = Semaphore(5)  # Maximum 5 concurrent queries
-        self.executor = ThreadPoolExecutor(max_workers=5)  # For parallel PDF processing
+        self.semaphore = Semaphore(metadata_concurrency)  # Maximum concurrent metadata queries
+        self.download_concurrency = download_concurrency
+        self.extract_concurrency = extract_concurrency
+        # Text extraction engine (process pool by default), shared process-wide unless given
+        self.extractor = extractor or get_extractor()
+        # Downloads are buffered in memory up to `spool_bytes` and abandoned past `max_pdf_bytes`
+        self.max_pdf_bytes = max_pdf_bytes
+        self.spool_bytes = spool_bytes
+        # Optional persistent store of extracted texts, checked before downloading a PDF
+        self.store = store
+        # Return abstracts only, with the full text fetched on demand through `full_text_loader`
+        self.metadata_only = metadata_only
 
     async def search_and_parse_queries(self, search_queries: SearchQueries) -> SearchResults:
-        results = SearchResults(results=[])
-        async with aiohttp.ClientSession() as session:
-            for query in search_queries.queries:
-                query_results = await self.process_query(session, query)
-                results.results.extend(query_results)
-                if len(results.results) >= self.max_results:
-                    break
-        
-        return SearchResults(results=results.results[:self.max_results])
-
-    async def process_query(self, session: aiohttp.ClientSession, query: SearchQuery) -> List[SearchResult]:
-        async with self.semaphore:
-            arxiv_results = await self.search(session, query.search_query)
-            results = []
-            for paper in arxiv_results:
-                full_text = await self.get_full_text(session, paper['pdf_url'], paper['id'])
-                result = SearchResult(
-                    doi=paper.get('doi', ''),
-                    authors=paper['authors'],
-                    citation_count=0,  # arXiv doesn't provide citation count
-                    journal=paper.get('journal_ref', '') or '',
-                    pdf_link=paper['pdf_url'],
-                    publication_year=int(paper['published'][:4]),
-                    title=paper['title'],
-                    full_text=full_text,
-                    search_query=query.search_query,
-                    query_rationale=query.query_rationale
-                )
-                results.append(result)
-            return results
+        """
+        Run the queries through a three-stage pipeline: metadata searches, PDF downloads and text
+        extraction. Each stage has its own concurrency limit. The queues between stages are
+        bounded, so downloads pause while extraction lags behind.
+
+        Results keep the serial order (query by query, in rank order), capped at max_results.
+        Papers past the cap are never downloaded. With `metadata_only`, nothing is downloaded:
+        results carry their abstract and a `full_text_loader` instead.
+        """
+        session = get_pools().aiohttp_session()
+        queries = search_queries.queries
+        download_queue: asyncio.Queue = asyncio.Queue(maxsize=self.download_concurrency * 2)
+        extract_queue: asyncio.Queue = asyncio.Queue(maxsize=self.extract_concurrency * 2)
+        results: Dict[Tuple[int, int], SearchResult] = {}
+
+        async def fetch_metadata(query: SearchQuery) -> List[Dict]:
+            async with self.semaphore:
+                try:
+                    return await self.search(session, query.search_query)
+                except Exception as e:
+                    logger.error(f"arXiv search failed for query '{query.search_query}': {e}")
+                    return []
+
+        async def produce() -> None:
+            # All searches run at once. A query's papers are released in rank order once the
+            # earlier queries are in, because only those decide which papers fit under the cap.
+            searches = [asyncio.create_task(fetch_metadata(query)) for query in queries]
+            try:
+                released = 0
+                for query_index, search in enumerate(searches):
+                    for rank, paper in enumerate(await search):
+                        if released >= self.max_results:
+                            return
+                        if self.metadata_only:
+                            results[(query_index, rank)] = self.build_result(paper, queries[query_index])
+                        else:
+                            await download_queue.put(((query_index, rank), queries[query_index], paper))
+                        released += 1
+            finally:
+                for search in searches:
+                    search.cancel()
+                await asyncio.gather(*searches, return_exceptions=True)
+                for _ in range(self.download_concurrency):
+                    await download_queue.put(None)
+
+        async def download_worker() -> None:
+            while (item := await download_queue.get()) is not None:
+                key, query, paper = item
+                stored = await self.lookup_full_text(paper)
+                if stored is not None:
+                    results[key] = self.build_result(paper, query, stored)
+                    continue
+                pdf = await self.fetch_pdf(session, paper['pdf_url'])
+                await extract_queue.put((key, query, paper, pdf))
+
+        async def extract_worker() -> None:
+            while (item := await extract_queue.get()) is not None:
+                key, query, paper, pdf = item
+                try:
+                    full_text = await self.extract_text_from_pdf(pdf.source) if pdf else ""
+                finally:
+                    if pdf:
+                        await pdf.aclose()
+                await self.save_full_text(paper, full_text)
+                results[key] = self.build_result(paper, query, full_text)
+
+        async def downloads() -> None:
+            await asyncio.gather(*(download_worker() for _ in range(self.download_concurrency)))
+            for _ in range(self.extract_concurrency):
+                await extract_queue.put(None)
+
+        stages = [asyncio.create_task(produce()), asyncio.create_task(downloads()),
+                  *(asyncio.create_task(extract_worker()) for _ in range(self.extract_concurrency))]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            # Release downloads that were never extracted (e.g. after cancellation)
+            while not extract_queue.empty():
+                item = extract_queue.get_nowait()
+                if item is not None and item[3]:
+                    await item[3].aclose()
+
+        return SearchResults(results=[results[key] for key in sorted(results)])
+
+    def build_result(self, paper: Dict, query: SearchQuery, full_text: Optional[str] = None) -> SearchResult:
+        """Result for `paper`. Without `full_text`, the result gets a loader that fetches it on demand."""
+        return SearchResult(
+            doi=paper.get('doi', ''),
+            authors=paper['authors'],
+            citation_count=0,  # arXiv doesn't provide citation count
+            journal=paper.get('journal_ref', '') or '',
+            pdf_link=paper['pdf_url'],
+            publication_year=int(paper['published'][:4]),
+            title=paper['title'],
+            full_text=full_text or "",
+            search_query=query.search_query,
+            query_rationale=query.query_rationale,
+            source_id=paper['id'],
+            abstract=paper.get('summary') or '',
+            full_text_loader=partial(self.load_full_text, paper) if full_text is None else None,
+        )
 
     async def search(self, session: aiohttp.ClientSession, search_query: str) -> List[Dict]:
         base_url = 'http://export.arxiv.org/api/query?'
@@ -105,40 +188,89 @@ class ArXivSearch(Searcher):
             papers.append(paper)
         return papers
 
-    async def get_full_text(self, session: aiohttp.ClientSession, pdf_url: str, arxiv_id: str) -> str:
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_file:
-            pdf_path = temp_file.name
+    async def load_full_text(self, paper: Dict) -> str:
+        """Full text of a metadata-only result, from the store or by downloading its PDF."""
+        return await self.fetch_full_text(get_pools().aiohttp_session(), paper)
+
+    async def fetch_full_text(self, session: aiohttp.ClientSession, paper: Dict) -> str:
+        stored = await self.lookup_full_text(paper)
+        if stored is not None:
+            return stored
+        pdf = await self.fetch_pdf(session, paper['pdf_url'])
+        if pdf is None:
+            return ""
+        async with pdf:
+            full_text = await self.extract_text_from_pdf(pdf.source)
+        await self.save_full_text(paper, full_text)
+        return full_text
+
+    @staticmethod
+    def store_keys(paper: Dict) -> List[Optional[str]]:
+        return [arxiv_key(paper.get('id')), doi_key(paper.get('doi'))]
 
+    async def lookup_full_text(self, paper: Dict) -> Optional[str]:
+        """Previously extracted text for `paper` (by arXiv id and version, then DOI), if stored."""
+        if self.store is None:
+            return None
         try:
-            await self.download_pdf(session, pdf_url, pdf_path)
-            return await self.extract_text_from_pdf(pdf_path)
+            stored = await self.store.aget(self.store_keys(paper))
+        except Exception as e:
+            logger.warning(f"Full-text store lookup failed for {paper.get('id')}: {e}")
+            return None
+        if stored is not None:
+            logger.debug(f"Using stored full text for {paper.get('id')}")
+            return stored.text
+        return None
+
+    async def save_full_text(self, paper: Dict, full_text: str) -> None:
+        if self.store is None or not full_text:
+            return
+        try:
+            await self.store.aput(self.store_keys(paper), full_text, {
+                'source': 'arxiv', 'id': paper.get('id'), 'title': paper.get('title'), 'pdf_url': paper.get('pdf_url'),
+            })
+        except Exception as e:
+            logger.warning(f"Could not store full text for {paper.get('id')}: {e}")
+
+    async def fetch_pdf(self, session: aiohttp.ClientSession, pdf_url: str) -> Optional[PDFBuffer]:
+        """Download a PDF into a PDFBuffer (the caller closes it), or return None on failure."""
+        pdf = PDFBuffer(spool_bytes=self.spool_bytes, max_bytes=self.max_pdf_bytes)
+        downloaded = False
+        try:
+            downloaded = await self.download_pdf(session, pdf_url, pdf)
+            await pdf.finish()
         finally:
-            os.unlink(pdf_path)  # Delete the temporary file
+            if not downloaded:
+                await pdf.aclose()
+        return pdf if downloaded else None
 
-    async def download_pdf(self, session: aiohttp.ClientSession, pdf_url: str, pdf_path: str) -> None:
+    async def download_pdf(self, session: aiohttp.ClientSession, pdf_url: str, pdf: PDFBuffer) -> bool:
+        """Stream the PDF into `pdf`, giving up as soon as it is known to exceed max_pdf_bytes."""
         async with self.rate_limiter:
             try:
                 async with session.get(pdf_url) as response:
-                    if response.status == 200:
-                        content = await response.read()
-                        async with aiofiles.open(pdf_path, mode='wb') as f:
-                            await f.write(content)
-                    else:
+                    if response.status != 200:
                         logger.warning(f"Failed to download PDF: Status {response.status}")
+                        return False
+                    if self.max_pdf_bytes and (response.content_length or 0) > self.max_pdf_bytes:
+                        logger.warning(f"Skipping PDF of {response.content_length} bytes (limit {self.max_pdf_bytes}): {pdf_url}")
+                        return False
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        await pdf.write(chunk)
+                    return True
+            except PDFTooLargeError:
+                logger.warning(f"Aborted PDF download over {self.max_pdf_bytes} bytes: {pdf_url}")
             except Exception as e:
                 logger.error(f"Exception while downloading PDF: {e}")
+        return False
 
-    async def extract_text_from_pdf(self, pdf_path: str) -> str:
-        loop = asyncio.get_running_loop()
+    async def extract_text_from_pdf(self, source: Union[str, bytes, bytearray]) -> str:
+        """Extract text from a PDF given as a path or as its bytes."""
         try:
-            return await loop.run_in_executor(self.executor, self._extract_text, pdf_path)
+            return await self.extractor.extract(source)
         except Exception as e:
             logger.error(f"Error extracting text from PDF: {e}")
             return ""
 
-    def _extract_text(self, pdf_path: str) -> str:
-        with fitz.open(pdf_path) as doc:
-            return "".join(page.get_text() for page in doc)
-
 # Ensure the ArXivSearch class is exported
 __all__ = ['ArXivSearch']
\ No newline at end of file
@@ -1,46 +1,137 @@
 # searchers/core_search.py
 import aiohttp
 import asyncio
-from typing import Dict, List
-from misc_utils import get_api_keys
+from contextlib import aclosing, asynccontextmanager
+from functools import partial
+from typing import AsyncIterator, Dict, List, Optional
 from models import SearchQueries, SearchResult, SearchResults, SearchQuery
 from logger_config import get_logger
+from http_pools import get_pools
 import os
 from dotenv import load_dotenv
-from time import time
+from time import monotonic, time
 from .searcher import Searcher
-import random  # Added for random key selection
+from .json_stream import JSONArrayStreamDecoder, JSONStreamError
+from .fulltext_store import FullTextStore, doi_key
 
 load_dotenv(override=True)
 
 logger = get_logger(__name__)
 
-class RateLimiter:
-    def __init__(self, max_requests: int, period: int):
+# Bytes read from a streamed search response at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
+class KeyRateLimiter:
+    """
+    Request budget for one CORE API key: at most `max_requests` per `period` seconds locally,
+    further capped by the `X-RateLimitRemaining` / `X-RateLimitReset` headers the API returns.
+    """
+
+    def __init__(self, key: str, max_requests: int, period: int):
+        self.key = key
         self.max_requests = max_requests
         self.period = period
-        self.requests = []
-        self.lock = asyncio.Lock()
-
-    async def acquire(self):
-        async with self.lock:
-            current = time()
-            self.requests = [req for req in self.requests if req > current - self.period]
-            if len(self.requests) >= self.max_requests:
-                earliest = self.requests[0]
-                wait_time = self.period - (current - earliest)
-                logger.info(f"Rate limit reached. Waiting for {wait_time:.2f} seconds.")
-                await asyncio.sleep(wait_time)
-            self.requests.append(time())
+        self.requests: List[float] = []
+        self.server_remaining: Optional[int] = None
+        self.server_reset: float = 0.0  # monotonic time at which server_remaining stops applying
+
+    def available(self, now: float) -> int:
+        self.requests = [req for req in self.requests if req > now - self.period]
+        capacity = self.max_requests - len(self.requests)
+        if self.server_remaining is not None and now < self.server_reset:
+            capacity = min(capacity, self.server_remaining)
+        return capacity
+
+    def next_available(self, now: float) -> float:
+        """Earliest time at which this key may have capacity again."""
+        times = []
+        if len(self.requests) >= self.max_requests:
+            times.append(self.requests[0] + self.period)
+        if self.server_remaining is not None and self.server_remaining <= 0 and now < self.server_reset:
+            times.append(self.server_reset)
+        return max(times) if times else now
+
+    def record(self, now: float) -> None:
+        self.requests.append(now)
+        if self.server_remaining is not None and now < self.server_reset:
+            self.server_remaining -= 1
+
+    def update(self, headers, now: float) -> None:
+        """Adopt the server's view of this key's remaining requests."""
+        try:
+            remaining = int(float(headers.get("X-RateLimitRemaining")))
+        except (TypeError, ValueError):
+            return
+        self.server_remaining = remaining
+        self.server_reset = now + _seconds_until(headers.get("X-RateLimitReset"), self.period)
+
+    def exhaust(self, retry_after: float, now: float) -> None:
+        """Stop using this key for `retry_after` seconds (after a 429)."""
+        self.server_remaining = 0
+        self.server_reset = max(self.server_reset, now + retry_after)
+
+
+def _seconds_until(reset, default: float) -> float:
+    """Parse a reset header given either as seconds from now or as a Unix timestamp."""
+    try:
+        value = float(reset)
+    except (TypeError, ValueError):
+        return default
+    if value > 1_000_000_000:
+        value -= time()
+    return max(0.0, value)
+
+
+def result_identity(result: SearchResult) -> str:
+    """Key under which results from different queries or pages count as the same work."""
+    if result.doi:
+        return f"doi:{result.doi.strip().lower()}"
+    return "title:" + " ".join((result.title or "").lower().split())
+
+
+class APIKeyPool:
+    """Hands out the API key with the most remaining capacity, waiting when every key is spent."""
+
+    def __init__(self, keys: List[str], max_requests_per_key: int, period: int = 60):
+        self.limiters = [KeyRateLimiter(key, max_requests_per_key, period) for key in keys]
+
+    async def acquire(self) -> KeyRateLimiter:
+        # No awaits between choosing a key and recording the request, so no lock is needed
+        while True:
+            now = monotonic()
+            limiter = max(self.limiters, key=lambda limiter: limiter.available(now))
+            if limiter.available(now) > 0:
+                limiter.record(now)
+                logger.debug(f"Selected CORE API key {limiter.key[:4]}**** ({limiter.available(now)} requests left)")
+                return limiter
+            wait_time = max(0.05, min(limiter.next_available(now) for limiter in self.limiters) - now)
+            logger.info(f"All CORE API keys are rate limited. Waiting for {wait_time:.2f} seconds.")
+            await asyncio.sleep(wait_time)
+
 
 class CORESearch(Searcher):
-    def __init__(self, max_results: int = 10, max_requests_per_minute: int = 5):
+    def __init__(self, max_results: int = 10, max_requests_per_minute: int = 5, max_attempts: int = 4,
+                 page_size: int = 25, max_results_per_query: int = 100, metadata_only: bool = False,
+                 store: Optional[FullTextStore] = None):
         self.base_url = "https://api.core.ac.uk/v3"
         self.max_results = max_results
+        # Streaming mode (`search_stream` / `stream_queries`) pages through up to this many works per query
+        self.page_size = page_size
+        self.max_results_per_query = max_results_per_query
+        # Stream metadata-only pages; full texts are then fetched with `hydrate`
+        self.metadata_only = metadata_only
+        # Optional persistent store of full texts. Texts from full-text pages are saved to it, and
+        # metadata-only results check it before fetching a work's full text.
+        self.store = store
+        self.max_attempts = max_attempts
         self.api_keys = self.load_api_keys()
-        # Removed current_key_index as rotation is now random
-        self.rate_limiter = RateLimiter(max_requests_per_minute, 60)
-        self.session = aiohttp.ClientSession()
+        # One limiter per key; `max_requests_per_minute` applies to each key separately
+        self.key_pool = APIKeyPool(self.api_keys, max_requests_per_minute, 60)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Shared, pooled session for the running event loop; see http_pools
+        return get_pools().aiohttp_session()
     
     def load_api_keys(self) -> List[str]:
         keys = []
@@ -58,74 +149,155 @@ class CORESearch(Searcher):
         logger.info(f"Loaded {len(keys)} API key(s).")
         return keys
 
-    async def get_random_api_key(self) -> str:
-        key = random.choice(self.api_keys)
-        logger.debug(f"Selected random CORE API key: {key[:4]}****")  # Logging partially for security
-        return key
-
-    async def search(self, search_query: str) -> Dict:
-        await self.rate_limiter.acquire()
-
-        headers = {
-            "Authorization": f"Bearer {await self.get_random_api_key()}",
-            "Accept": "application/json",
-        }
-
-        params = {
-            "q": search_query,
-            "limit": self.max_results,
-            "fulltext": "true",
-        }
-
-        try:
-            async with self.session.post(
-                f"{self.base_url}/search/works", headers=headers, json=params
-            ) as response:
-                remaining = response.headers.get("X-RateLimitRemaining", "Unknown")
-                reset = response.headers.get("X-RateLimitReset", "Unknown")
-                logger.info(f"Rate Limit Remaining: {remaining}, Reset Time: {reset}")
+    @asynccontextmanager
+    async def _request(self, method: str, path: str, **kwargs):
+        """
+        Send a CORE API request with the least loaded key, moving on to another key after a 429.
+        Yields the successful response with its body unread, or None if the request failed.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            limiter = await self.key_pool.acquire()
+            headers = {
+                "Authorization": f"Bearer {limiter.key}",
+                "Accept": "application/json",
+            }
+            try:
+                response = await self.session.request(method, f"{self.base_url}{path}", headers=headers, **kwargs)
+            except aiohttp.ClientError as e:
+                logger.error(f"HTTP Client error: {e}")
+                break
+            async with response:
+                limiter.update(response.headers, monotonic())
+                logger.info(f"Rate Limit Remaining: {response.headers.get('X-RateLimitRemaining', 'Unknown')}, "
+                            f"Reset Time: {response.headers.get('X-RateLimitReset', 'Unknown')}")
 
                 if response.status == 200:
                     logger.info("CORE API request successful.")
-                    return await response.json()
+                    yield response
+                    return
                 elif response.status == 429:
-                    logger.warning("Received 429 Too Many Requests. Attempting with a different API key.")
-                    # Recursive call with a different API key
-                    return await self.search(search_query)
+                    retry_after = _seconds_until(
+                        response.headers.get("Retry-After") or response.headers.get("X-RateLimitReset"),
+                        limiter.period)
+                    limiter.exhaust(retry_after, monotonic())
+                    logger.warning(f"Received 429 Too Many Requests (attempt {attempt} of {self.max_attempts}). "
+                                   f"Resting key {limiter.key[:4]}**** for {retry_after:.0f} seconds.")
                 else:
                     logger.warning(
                         f"CORE API request failed with status code: {response.status}"
                     )
+                    break
+        else:
+            logger.error(f"CORE API request still rate limited after {self.max_attempts} attempts: {path}")
+        yield None
+
+    def _search_params(self, search_query: str, limit: Optional[int], offset: int, full_text: bool) -> Dict:
+        params = {
+            "q": search_query,
+            "limit": limit or self.max_results,
+        }
+        if full_text:
+            params["fulltext"] = "true"
+        else:
+            params["exclude"] = ["fullText"]
+        if offset:
+            params["offset"] = offset
+        return params
+
+    async def search(self, search_query: str, limit: Optional[int] = None, offset: int = 0,
+                     full_text: bool = True) -> Dict:
+        try:
+            async with self._request("POST", "/search/works",
+                                     json=self._search_params(search_query, limit, offset, full_text)) as response:
+                if response is None:
                     return {}
+                return await response.json()
         except aiohttp.ClientError as e:
             logger.error(f"HTTP Client error: {e}")
             return {}
 
+    async def iter_works(self, search_query: str, limit: Optional[int] = None, offset: int = 0,
+                         full_text: bool = True, page_info: Optional[Dict] = None) -> AsyncIterator[Dict]:
+        """
+        Yield the raw works of one result page as they are decoded from the response body, so a
+        page of full texts is never held in memory at once. The page's other fields (e.g.
+        `totalHits`) are stored in `page_info` once the body has been read.
+        """
+        async with self._request("POST", "/search/works",
+                                 json=self._search_params(search_query, limit, offset, full_text)) as response:
+            if response is None:
+                return
+            decoder = JSONArrayStreamDecoder("results")
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                for entry in decoder.feed(chunk):
+                    yield entry
+            decoder.close()
+            if page_info is not None:
+                page_info.update(decoder.fields)
+
+    async def fetch_full_text(self, result: SearchResult) -> SearchResult:
+        """
+        Return `result` with the full text of its CORE work, e.g. after a metadata-only search.
+        The full-text store, if any, is checked (by CORE id, then DOI) before the API.
+        """
+        if result.full_text or not result.source_id:
+            return result
+        if self.store is not None:
+            try:
+                stored = await self.store.aget(self.store_keys(result))
+            except Exception as e:
+                logger.warning(f"Full-text store lookup failed for CORE work {result.source_id}: {e}")
+                stored = None
+            if stored is not None:
+                return result.model_copy(update={"full_text": stored.text, "full_text_loader": None})
+        try:
+            async with self._request("GET", f"/works/{result.source_id}") as response:
+                if response is None:
+                    return result
+                work = await response.json()
+        except aiohttp.ClientError as e:
+            logger.error(f"HTTP Client error while fetching full text of CORE work {result.source_id}: {e}")
+            return result
+        result = result.model_copy(update={
+            "full_text": work.get("fullText") or "",
+            "full_text_loader": None,
+            "pdf_link": result.pdf_link or work.get("downloadUrl") or "",
+        })
+        await self.save_full_text(result)
+        return result
+
+    @staticmethod
+    def store_keys(result: SearchResult) -> List[Optional[str]]:
+        return [f"core:{result.source_id}" if result.source_id else None, doi_key(result.doi)]
+
+    async def save_full_text(self, result: SearchResult) -> None:
+        """Keep a full text that came with a search page or work, so later lookups skip the API."""
+        if self.store is None or not result.full_text:
+            return
+        try:
+            await self.store.aput(self.store_keys(result), result.full_text,
+                                  {"source": "core", "id": result.source_id, "title": result.title})
+        except Exception as e:
+            logger.warning(f"Could not store full text for CORE work {result.source_id}: {e}")
+
+    async def load_full_text(self, result: SearchResult) -> str:
+        return (await self.fetch_full_text(result)).full_text
+
+    async def hydrate(self, results: List[SearchResult]) -> List[SearchResult]:
+        """Fetch full texts for metadata-only results concurrently, paced by the key pool."""
+        return list(await asyncio.gather(*(self.fetch_full_text(result) for result in results)))
+
     async def search_and_parse(self, query_id: str, search_query: SearchQuery) -> SearchResult:
+        """Top result for one query. Only one work is requested, decoded as the response streams in."""
         try:
-            response = await self.search(search_query.search_query)
-
-            if not response:
-                logger.warning(f"Empty API response for query: {search_query.search_query}")
-                return SearchResult(query_rationale=search_query.query_rationale)
-
-            results = response.get("results", [])
-
-            if results:
-                entry = results[0]
-                return SearchResult(
-                    doi=entry.get("doi") or "",
-                    authors=[author["name"] for author in entry.get("authors", [])],
-                    citation_count=entry.get("citationCount", 0),
-                    journal=entry.get("publisher", ""),
-                    pdf_link=entry.get("downloadUrl", ""),
-                    publication_year=int(entry.get("publicationYear")) if entry.get("publicationYear") else None,
-                    title=entry.get("title", ""),
-                    full_text=entry.get("fullText", ""),
-                    search_query=search_query.search_query,
-                    query_rationale=search_query.query_rationale
-                )
+            async with aclosing(self.iter_works(search_query.search_query, limit=1,
+                                                full_text=not self.metadata_only)) as works:
+                async for entry in works:
+                    result = self.parse_entry(entry, search_query)
+                    await self.save_full_text(result)
+                    return result
 
+            logger.warning(f"No results for query: {search_query.search_query}")
             return SearchResult(query_rationale=search_query.query_rationale)
         except Exception as e:
             logger.error(
@@ -133,15 +305,115 @@ class CORESearch(Searcher):
             )
             return SearchResult(query_rationale=search_query.query_rationale)
 
+    def parse_entry(self, entry: Dict, search_query: SearchQuery) -> SearchResult:
+        result = SearchResult(
+            doi=entry.get("doi") or "",
+            authors=[author["name"] for author in entry.get("authors", [])],
+            citation_count=entry.get("citationCount", 0),
+            journal=entry.get("publisher", ""),
+            pdf_link=entry.get("downloadUrl", ""),
+            publication_year=int(entry.get("publicationYear")) if entry.get("publicationYear") else None,
+            title=entry.get("title", ""),
+            full_text=entry.get("fullText") or "",
+            source_id=str(entry.get("id") or ""),
+            abstract=entry.get("abstract") or "",
+            search_query=search_query.search_query,
+            query_rationale=search_query.query_rationale
+        )
+        if not result.full_text and result.source_id:
+            # Metadata-only page: the full text is fetched only if the result is used
+            result.full_text_loader = partial(self.load_full_text, result)
+        return result
+
+    async def search_stream(self, search_query: SearchQuery, max_results: Optional[int] = None,
+                            page_size: Optional[int] = None,
+                            full_text: Optional[bool] = None) -> AsyncIterator[SearchResult]:
+        """
+        Yield every parsed result for one query, following offset pagination until the API runs
+        out of hits or `max_results` (default `max_results_per_query`) have been yielded. Pages
+        are only fetched as the caller consumes results, so stopping early saves requests, and
+        works are decoded one at a time as each page streams in.
+
+        With `full_text=False` (default: not `metadata_only`) pages omit full texts; fetch them
+        later with `hydrate` for the results worth keeping.
+        """
+        max_results = max_results or self.max_results_per_query
+        page_size = page_size or self.page_size
+        full_text = not self.metadata_only if full_text is None else full_text
+        offset = yielded = 0
+        while yielded < max_results:
+            limit = min(page_size, max_results - yielded)
+            page_info: Dict = {}
+            received = 0
+            try:
+                async with aclosing(self.iter_works(search_query.search_query, limit=limit, offset=offset,
+                                                    full_text=full_text, page_info=page_info)) as works:
+                    async for entry in works:
+                        received += 1
+                        try:
+                            result = self.parse_entry(entry, search_query)
+                        except Exception as e:
+                            logger.warning(f"Skipping unparseable CORE entry for query: {search_query.search_query}. Error: {e}")
+                            continue
+                        await self.save_full_text(result)
+                        yield result
+                        yielded += 1
+                        if yielded >= max_results:
+                            return
+            except (aiohttp.ClientError, JSONStreamError) as e:
+                logger.error(f"CORE page at offset {offset} failed for query: {search_query.search_query}. Error: {e}")
+                return
+            offset += received
+            total_hits = page_info.get("totalHits")
+            if received < limit or (isinstance(total_hits, int) and offset >= total_hits):
+                return
+
+    async def stream_queries(self, search_queries: SearchQueries,
+                             max_results: Optional[int] = None) -> AsyncIterator[SearchResult]:
+        """
+        Stream unique results (by DOI, else title) from all queries concurrently, in arrival
+        order, until `max_results` (default `self.max_results`) have been yielded. Outstanding
+        pages are cancelled once enough results arrive or the caller stops iterating.
+        """
+        max_results = max_results or self.max_results
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.page_size)
+        finished = object()
+
+        async def produce(query: SearchQuery):
+            # The bounded queue holds back further pages until the consumer catches up
+            try:
+                async with aclosing(self.search_stream(query)) as stream:
+                    async for result in stream:
+                        await queue.put(result)
+            except Exception as e:
+                logger.error(f"Streaming CORE results failed for query: {query.search_query}. Error: {e}")
+            await queue.put(finished)
+
+        tasks = [asyncio.create_task(produce(query)) for query in search_queries.queries]
+        running, seen, yielded = len(tasks), set(), 0
+        try:
+            while running and yielded < max_results:
+                result = await queue.get()
+                if result is finished:
+                    running -= 1
+                    continue
+                key = result_identity(result)
+                if key in seen:
+                    continue
+                seen.add(key)
+                yielded += 1
+                yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
     async def search_and_parse_queries(self, search_queries: SearchQueries) -> SearchResults:
         try:
-            results = SearchResults(results=[])
-            for query in search_queries.queries:
-                result = await self.search_and_parse(query.search_query, query)
-                results.results.append(result)
-                if len(results.results) >= self.max_results:
-                    break
-            return results
+            # Each query yields at most one result. Queries run concurrently, paced by the key pool.
+            queries = search_queries.queries[:self.max_results]
+            results = await asyncio.gather(*(self.search_and_parse(query.search_query, query) for query in queries))
+            return SearchResults(results=list(results))
         except Exception as e:
             logger.error(
                 f"An error occurred while processing the search queries. Error: {e}"
@@ -149,7 +421,9 @@ class CORESearch(Searcher):
             return SearchResults(results=[])
 
     async def close(self):
-        await self.session.close()
+        # The session is shared by every searcher on this event loop. Entry points close it with
+        # `async with get_pools():` (see streamlit_app.handle_submit) once the loop's work is done.
+        pass
 
 # Ensure the CORESearch class is exported
 __all__ = ['CORESearch']
@@ -0,0 +1,195 @@
+# searchers/fulltext_store.py
+import os
+import re
+import gzip
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_PATH = os.path.join(os.getcwd(), 'data', 'fulltext.sqlite3')
+
+_ARXIV_ID = re.compile(r"(?:arxiv\.org/(?:abs|pdf)/|arxiv:)?([a-z\-]+(?:\.[A-Z]{2})?/\d{7}|\d{4}\.\d{4,5})(v\d+)?", re.I)
+_DOI_PREFIX = re.compile(r"^(?:https?://(?:dx\.)?doi\.org/|doi:)", re.I)
+
+
+def arxiv_key(arxiv_id: Optional[str]) -> Optional[str]:
+    """Store key for an arXiv id or abs/pdf URL, including its version when present."""
+    match = _ARXIV_ID.search(arxiv_id or "")
+    if match is None:
+        return None
+    return f"arxiv:{match.group(1)}{(match.group(2) or '').lower()}"
+
+
+def doi_key(doi: Optional[str]) -> Optional[str]:
+    doi = _DOI_PREFIX.sub("", (doi or "").strip()).lower()
+    return f"doi:{doi}" if doi else None
+
+
+class StoredText(BaseModel):
+    text: str
+    metadata: Dict[str, Any] = Field(default_factory=dict)
+
+
+class FullTextStore:
+    """
+    Persistent, content-addressed store of extracted paper texts backed by SQLite.
+
+    Texts are gzip-compressed and stored once per content hash. Any number of lookup keys
+    (`arxiv_key`, `doi_key`, or source-specific ids such as "core:<id>") point at them, so the
+    same paper found through arXiv and through its DOI is stored once. Each write is one
+    transaction. Once the compressed texts grow past `max_bytes`, the least recently used are
+    evicted. The async methods run in a worker thread so lookups never block the event loop.
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH, max_bytes: Optional[int] = 1024 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS texts (
+                content_hash TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                metadata TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS text_keys (key TEXT PRIMARY KEY, content_hash TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_texts_accessed ON texts (accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_text_keys_hash ON text_keys (content_hash)")
+
+    @classmethod
+    def from_env(cls) -> Optional["FullTextStore"]:
+        """Build a store at FULLTEXT_STORE_PATH (default data/fulltext.sqlite3), or None if it is set to "off"."""
+        path = os.getenv("FULLTEXT_STORE_PATH", DEFAULT_STORE_PATH)
+        if path.lower() in ("", "off", "none"):
+            return None
+        max_bytes = os.getenv("FULLTEXT_STORE_MAX_BYTES")
+        return cls(path=path, max_bytes=int(max_bytes) if max_bytes else 1024 * 1024 * 1024)
+
+    def get(self, keys: Iterable[Optional[str]]) -> Optional[StoredText]:
+        """Return the text stored under the first of `keys` that is present, or None."""
+        keys = [key for key in keys if key]
+        if not keys:
+            return None
+        with self._lock:
+            row = None
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT t.content_hash, t.data, t.metadata FROM text_keys k "
+                    "JOIN texts t ON t.content_hash = k.content_hash WHERE k.key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    break
+            if row is None:
+                return None
+            content_hash, data, metadata = row
+            self._conn.execute("UPDATE texts SET accessed_at = ? WHERE content_hash = ?", (time.time(), content_hash))
+
+        try:
+            return StoredText(text=gzip.decompress(data).decode("utf-8"), metadata=json.loads(metadata))
+        except Exception as e:
+            logger.warning(f"Discarding unreadable stored text {content_hash[:12]}: {e}")
+            self.delete(content_hash)
+            return None
+
+    def put(self, keys: Iterable[Optional[str]], text: str, metadata: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Store `text` under every key in `keys` and return its content hash. Empty texts are not stored."""
+        keys = [key for key in keys if key]
+        if not keys or not text:
+            return None
+        encoded = text.encode("utf-8")
+        content_hash = hashlib.sha256(encoded).hexdigest()
+        data = gzip.compress(encoded, compresslevel=6)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO texts (content_hash, data, metadata, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(content_hash) DO UPDATE SET accessed_at = excluded.accessed_at",
+                    (content_hash, data, json.dumps(metadata or {}, default=str), len(data), now, now),
+                )
+                self._conn.executemany("INSERT OR REPLACE INTO text_keys (key, content_hash) VALUES (?, ?)",
+                                       [(key, content_hash) for key in keys])
+                self._evict()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return content_hash
+
+    async def aget(self, keys: Iterable[Optional[str]]) -> Optional[StoredText]:
+        return await asyncio.to_thread(self.get, list(keys))
+
+    async def aput(self, keys: Iterable[Optional[str]], text: str,
+                   metadata: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        return await asyncio.to_thread(self.put, list(keys), text, metadata)
+
+    def delete(self, content_hash: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM text_keys WHERE content_hash = ?", (content_hash,))
+            self._conn.execute("DELETE FROM texts WHERE content_hash = ?", (content_hash,))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM texts").fetchone()
+            keys = self._conn.execute("SELECT COUNT(*) FROM text_keys").fetchone()[0]
+        return {"texts": entries, "keys": keys, "bytes": total}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self) -> None:
+        """Drop least recently used texts until within `max_bytes`. Caller holds the lock."""
+        if self.max_bytes is None:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM texts").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        doomed: List[tuple] = []
+        freed = 0
+        for content_hash, size in self._conn.execute("SELECT content_hash, size FROM texts ORDER BY accessed_at ASC"):
+            if freed >= excess:
+                break
+            doomed.append((content_hash,))
+            freed += size
+        self._conn.executemany("DELETE FROM text_keys WHERE content_hash = ?", doomed)
+        self._conn.executemany("DELETE FROM texts WHERE content_hash = ?", doomed)
+        logger.debug(f"Evicted {len(doomed)} stored texts ({freed} bytes)")
+
+
+_store: Optional[FullTextStore] = None
+_store_lock = threading.Lock()
+
+
+def get_fulltext_store() -> Optional[FullTextStore]:
+    """Return the process-wide FullTextStore configured from the environment, or None if disabled."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = FullTextStore.from_env()
+    return _store
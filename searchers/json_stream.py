@@ -0,0 +1,170 @@
+# searchers/json_stream.py
+import re
+import json
+import codecs
+from typing import Any, Dict, List, Optional
+
+# Characters that matter when looking for the end of a value, outside and inside strings
+_STRUCTURAL = re.compile(r'[\[\]{}"]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[\s,\]}]')
+_WHITESPACE = " \t\r\n"
+
+
+class JSONStreamError(ValueError):
+    pass
+
+
+class JSONArrayStreamDecoder:
+    """
+    Incremental decoder for a JSON object with one large array member, such as a CORE search
+    page `{"totalHits": ..., "results": [work, work, ...]}`. Feed it bytes as they arrive. Each
+    element of `array_key` is returned as soon as it is complete, so only one element is held
+    in memory at a time. The other top-level members are collected in `fields`.
+    """
+
+    def __init__(self, array_key: str = "results"):
+        self.array_key = array_key
+        self.fields: Dict[str, Any] = {}
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._state = "start"  # start, key, colon, value, array, after, done
+        self._key: Optional[str] = None
+        # Progress through a partially received value: (start, scan position, depth, in string)
+        self._scan: Optional[tuple] = None
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, data: bytes) -> List[Any]:
+        """Consume `data` and return the array elements it completed."""
+        self._buffer += self._decoder.decode(data)
+        items = self._parse()
+        # Drop consumed input, keeping the value currently being scanned
+        keep = self._scan[0] if self._scan else self._pos
+        if keep:
+            self._buffer = self._buffer[keep:]
+            self._pos -= keep
+            if self._scan:
+                start, scan, depth, in_string = self._scan
+                self._scan = (0, scan - keep, depth, in_string)
+        return items
+
+    def close(self) -> None:
+        """Raise JSONStreamError if the input ended before the top-level object did."""
+        self._buffer += self._decoder.decode(b"", final=True)
+        self._parse(final=True)
+        if self._state != "done":
+            raise JSONStreamError("Truncated JSON document")
+
+    def _skip_whitespace(self) -> bool:
+        while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+            self._pos += 1
+        return self._pos < len(self._buffer)
+
+    def _parse(self, final: bool = False) -> List[Any]:
+        items = []
+        buffer = self._buffer
+        while self._state != "done" and self._skip_whitespace():
+            char = buffer[self._pos]
+            if self._state == "start":
+                if char != "{":
+                    raise JSONStreamError(f"Expected a JSON object, got {char!r}")
+                self._pos += 1
+                self._state = "key"
+            elif self._state in ("key", "after"):
+                if char == "}":
+                    self._pos += 1
+                    self._state = "done"
+                elif char == "," and self._state == "after":
+                    self._pos += 1
+                    self._state = "key"
+                elif char == '"':
+                    end = self._value_end(final)
+                    if end is None:
+                        break
+                    self._key = json.loads(buffer[self._pos:end])
+                    self._pos = end
+                    self._state = "colon"
+                else:
+                    raise JSONStreamError(f"Unexpected {char!r} in object")
+            elif self._state == "colon":
+                if char != ":":
+                    raise JSONStreamError(f"Expected ':', got {char!r}")
+                self._pos += 1
+                self._state = "value"
+            elif self._state == "value":
+                if self._key == self.array_key and char == "[":
+                    self._pos += 1
+                    self._state = "array"
+                    continue
+                end = self._value_end(final)
+                if end is None:
+                    break
+                self.fields[self._key] = json.loads(buffer[self._pos:end])
+                self._pos = end
+                self._state = "after"
+            elif self._state == "array":
+                if char == "]":
+                    self._pos += 1
+                    self._state = "after"
+                elif char == ",":
+                    self._pos += 1
+                else:
+                    end = self._value_end(final)
+                    if end is None:
+                        break
+                    items.append(json.loads(buffer[self._pos:end]))
+                    self._pos = end
+        return items
+
+    def _value_end(self, final: bool) -> Optional[int]:
+        """End index of the value starting at the current position, or None if it is incomplete."""
+        buffer = self._buffer
+        start = self._pos
+        if self._scan and self._scan[0] == start:
+            _, pos, depth, in_string = self._scan
+        else:
+            pos, depth, in_string = start, 0, False
+            if buffer[start] not in '[{"':
+                match = _SCALAR_END.search(buffer, start)
+                if match is None:
+                    return len(buffer) if final else None
+                return match.start()
+
+        while True:
+            if in_string:
+                match = _STRING_SPECIAL.search(buffer, pos)
+                if match is None:
+                    break
+                if match.group() == "\\":
+                    if match.end() >= len(buffer):
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                pos = match.end()
+                in_string = False
+                if depth == 0:
+                    self._scan = None
+                    return pos
+            else:
+                match = _STRUCTURAL.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                char = match.group()
+                pos = match.end()
+                if char == '"':
+                    in_string = True
+                elif char in "[{":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        self._scan = None
+                        return pos
+        self._scan = (start, pos, depth, in_string)
+        return None
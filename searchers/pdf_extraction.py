@@ -0,0 +1,218 @@
+# searchers/pdf_extraction.py
+import os
+import asyncio
+import logging
+import threading
+import tempfile
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Tuple, Union
+
+import aiofiles
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_MODES = ("thread", "process", "pages")
+
+# PDFs up to this size are kept in memory while downloading; larger ones spill to a temporary file
+DEFAULT_SPOOL_BYTES = 16 * 1024 * 1024
+
+# PyMuPDF module for this process, imported once by `_init_worker` or on first use
+_fitz = None
+
+
+def _init_worker() -> None:
+    """Process pool initializer: pay the PyMuPDF import once per worker, not per document."""
+    _load_fitz()
+
+
+def _load_fitz():
+    global _fitz
+    if _fitz is None:
+        import fitz  # PyMuPDF, imported on first use because it is slow to load
+        _fitz = fitz
+    return _fitz
+
+
+def _extract_range(source: Union[str, bytes, bytearray], start: int, stop: Optional[int],
+                   flags: Optional[int], dehyphenate: bool) -> Tuple[int, str]:
+    """
+    Extract the text of pages [start, stop) (all remaining pages if `stop` is None).
+    Returns the document's page count along with the text.
+    """
+    fitz = _load_fitz()
+    if flags is None:
+        flags = fitz.TEXTFLAGS_TEXT
+    if dehyphenate:
+        flags |= fitz.TEXT_DEHYPHENATE
+    doc = fitz.open(source) if isinstance(source, str) else fitz.open(stream=source, filetype="pdf")
+    with doc:
+        page_count = doc.page_count
+        stop = page_count if stop is None else min(stop, page_count)
+        return page_count, "".join(doc[i].get_text("text", flags=flags) for i in range(start, stop))
+
+
+class PDFTooLargeError(ValueError):
+    pass
+
+
+class PDFBuffer:
+    """
+    Download target for one PDF. Bytes stay in memory up to `spool_bytes` and spill to a
+    temporary file beyond that. Writing past `max_bytes` raises PDFTooLargeError. `source` is
+    what PDFExtractor.extract takes: the bytes, or the path of the spilled file. Call `aclose()`
+    (or use the buffer as an async context manager) to delete the spilled file.
+    """
+
+    def __init__(self, spool_bytes: int = DEFAULT_SPOOL_BYTES, max_bytes: Optional[int] = None):
+        self.spool_bytes = spool_bytes
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._memory: Optional[bytearray] = bytearray()
+        self._file = None
+        self.path: Optional[str] = None
+
+    @property
+    def spilled(self) -> bool:
+        return self.path is not None
+
+    async def write(self, data: bytes) -> None:
+        if self.max_bytes is not None and self.size + len(data) > self.max_bytes:
+            raise PDFTooLargeError(f"PDF exceeds the {self.max_bytes} byte limit")
+        self.size += len(data)
+        if self._memory is not None and self.size <= self.spool_bytes:
+            self._memory += data
+            return
+        if self._file is None:
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_file:
+                self.path = temp_file.name
+            self._file = await aiofiles.open(self.path, mode="wb")
+            await self._file.write(bytes(self._memory))
+            self._memory = None
+        await self._file.write(data)
+
+    async def finish(self) -> None:
+        """Flush a spilled buffer to disk; call before reading `source`."""
+        if self._file is not None:
+            await self._file.close()
+            self._file = None
+
+    @property
+    def source(self) -> Union[str, bytes, bytearray]:
+        return self.path if self.spilled else self._memory
+
+    async def aclose(self) -> None:
+        """Release the buffer and delete its spilled file, if any."""
+        await self.finish()
+        self._memory = None
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    async def __aenter__(self) -> "PDFBuffer":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+
+class PDFExtractor:
+    """
+    Extracts text from PDFs off the event loop.
+
+    Modes:
+      - "thread": one document per task in a thread pool.
+      - "process": one document per task in a process pool whose workers import PyMuPDF once.
+      - "pages": like "process", but PDFs on disk longer than `pages_per_task` are split into page
+        ranges that are extracted by several workers in parallel. In-memory PDFs are extracted
+        in a single task: each range would pickle the whole document again. PDFBuffer only
+        spills downloads past its spool size to disk, so it is the large PDFs that fan out.
+
+    `max_pages` caps the pages read per document. `text_flags` are PyMuPDF text extraction flags
+    (default TEXTFLAGS_TEXT: plain text, no images), and `dehyphenate` joins words hyphenated
+    across line breaks. The pool is created on first use.
+    """
+
+    def __init__(self, mode: str = "pages", max_workers: Optional[int] = None,
+                 max_pages: Optional[int] = None, pages_per_task: int = 16,
+                 text_flags: Optional[int] = None, dehyphenate: bool = False):
+        if mode not in EXTRACTION_MODES:
+            raise ValueError(f"Unknown extraction mode: {mode}. Expected one of {EXTRACTION_MODES}")
+        if pages_per_task < 1:
+            raise ValueError("pages_per_task must be at least 1")
+        self.mode = mode
+        self.max_workers = max_workers or min(8, os.cpu_count() or 1)
+        self.max_pages = max_pages
+        self.pages_per_task = pages_per_task
+        self.text_flags = text_flags
+        self.dehyphenate = dehyphenate
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "PDFExtractor":
+        """Configure from PDF_EXTRACT_MODE, PDF_EXTRACT_WORKERS and PDF_MAX_PAGES."""
+        max_workers = os.getenv("PDF_EXTRACT_WORKERS")
+        max_pages = os.getenv("PDF_MAX_PAGES")
+        return cls(mode=os.getenv("PDF_EXTRACT_MODE", "pages"),
+                   max_workers=int(max_workers) if max_workers else None,
+                   max_pages=int(max_pages) if max_pages else None)
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.mode == "thread":
+                        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                            thread_name_prefix="pdf-extract")
+                    else:
+                        # spawn: forking a process that already runs threads (aiohttp, Streamlit) is unsafe
+                        self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                             mp_context=multiprocessing.get_context("spawn"),
+                                                             initializer=_init_worker)
+        return self._executor
+
+    async def extract(self, source: Union[str, bytes, bytearray]) -> str:
+        """Text of the PDF at path `source` (or in the bytes `source`), up to `max_pages` pages."""
+        loop = asyncio.get_running_loop()
+
+        def run(source: Union[str, bytes, bytearray], start: int, stop: Optional[int]):
+            return loop.run_in_executor(self.executor, _extract_range, source, start, stop,
+                                        self.text_flags, self.dehyphenate)
+
+        if self.mode != "pages" or not isinstance(source, str):
+            return (await run(source, 0, self.max_pages))[1]
+
+        # The first range also tells us the page count; the rest are fanned out across workers
+        first_stop = self.pages_per_task if self.max_pages is None else min(self.pages_per_task, self.max_pages)
+        page_count, first_text = await run(source, 0, first_stop)
+        last = page_count if self.max_pages is None else min(page_count, self.max_pages)
+        if last <= first_stop:
+            return first_text
+        rest = await asyncio.gather(*(run(source, start, min(start + self.pages_per_task, last))
+                                      for start in range(first_stop, last, self.pages_per_task)))
+        return first_text + "".join(text for _, text in rest)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+_extractor: Optional[PDFExtractor] = None
+_extractor_lock = threading.Lock()
+
+
+def get_extractor() -> PDFExtractor:
+    """Return the process-wide PDFExtractor, configured from the environment on first use."""
+    global _extractor
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                _extractor = PDFExtractor.from_env()
+    return _extractor
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class _LeaderCancelled(Exception):
+    """Set on a shared call whose leader was cancelled, so a waiting follower takes over."""
+
+
+async def _wait(future: concurrent.futures.Future) -> Any:
+    """Await a shared future without letting this caller's cancellation cancel it for everyone."""
+    loop = asyncio.get_running_loop()
+    waiter = loop.create_future()
+
+    def wake() -> None:
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def on_done(_: concurrent.futures.Future) -> None:
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(wake)
+
+    future.add_done_callback(on_done)
+    await waiter
+    return future.result()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution whose outcome (result
+    or exception) is shared by every caller. Calls are tracked with thread-safe futures,
+    so callers on different threads and event loops (e.g. separate Streamlit sessions
+    sharing one handler) coalesce too. Nothing is kept once a call finishes.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": self.in_flight, "coalesced": self.coalesced}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await `fn()`, or the identical call already in flight for `key`."""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return await _wait(future)
+            except _LeaderCancelled:
+                continue
+
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            self._finish(key, future, exception=_LeaderCancelled())
+            raise
+        except BaseException as e:
+            self._finish(key, future, exception=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    def do_sync(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Blocking counterpart of `do` for synchronous callers."""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return future.result()
+            except _LeaderCancelled:
+                continue
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future, exception=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    def _join(self, key: Hashable):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                logger.debug(f"Coalescing request {str(key)[:12]} with the call in flight")
+                return future, False
+            future = self._calls[key] = concurrent.futures.Future()
+            return future, True
+
+    def _finish(self, key: Hashable, future: concurrent.futures.Future, result: Any = None,
+                exception: BaseException = None) -> None:
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
@@ -1,10 +1,15 @@
 import streamlit as st
+import os
+import uuid
 import asyncio
 from get_search_queries import QueryGenerator
 from searchers import CORESearch, ArXivSearch
+from searchers.fulltext_store import get_fulltext_store
 from analyze_papers import PaperAnalyzer
 from synthesize_results import ResultSynthesizer
-from models import SearchQueries, SearchResults, RankedPapers
+from models import SearchQueries, SearchResults, RankedPapers, RankedPaper
+from http_pools import get_pools
+from request_scheduler import tenant
 import time
 
 # Set page config with a dark theme
@@ -41,8 +46,19 @@ st.markdown("""
 
 @st.cache_resource
 def get_llm_handler():
-    from llm_api_handler import LLMAPIHandler
-    return LLMAPIHandler()
+    from llm_api_handler import get_handler
+    return get_handler()
+
+@st.cache_resource
+def start_metrics_exporter():
+    # Set LLM_METRICS_PORT to expose LLM usage, latency and cost at /metrics and /metrics.json
+    port = os.getenv("LLM_METRICS_PORT")
+    if not port:
+        return None
+    from llm_metrics import start_metrics_server
+    return start_metrics_server(int(port))
+
+start_metrics_exporter()
 
 st.title("📚 AI-Powered Literature Review Assistant")
 
@@ -75,19 +91,26 @@ num_results = st.number_input("Number of results per search engine:", min_value=
 async def process(user_query: str, search_engine: str, num_results: int):
     llm_handler = get_llm_handler()
 
+    # Open connections to the LLM and search APIs while the search queries are generated
+    warm_up = asyncio.create_task(get_pools().warm_up())
+
     query_generator = QueryGenerator()
     search_queries: SearchQueries = await query_generator.generate_queries(user_query, num_queries=5)
+    await warm_up
     with st.expander("Click to see Generated Search Queries"):
         st.json(search_queries.model_dump())
 
     search_results = SearchResults(results=[])
+    # Rank on abstracts and fetch full texts only for the papers that get analyzed
+    metadata_only = os.getenv("LAZY_FULL_TEXT", "1") != "0"
     if search_engine in ["CORE", "Both"]:
-        core_search = CORESearch(max_results=num_results)
+        core_search = CORESearch(max_results=num_results, store=get_fulltext_store(), metadata_only=metadata_only)
         core_results = await core_search.search_and_parse_queries(search_queries)
         search_results.results.extend(core_results.results[:num_results])
 
     if search_engine in ["arXiv", "Both"]:
-        arxiv_search = ArXivSearch(max_results=num_results)
+        arxiv_search = ArXivSearch(max_results=num_results, store=get_fulltext_store(),
+                                   metadata_only=metadata_only)
         arxiv_results = await arxiv_search.search_and_parse_queries(search_queries)
         search_results.results.extend(arxiv_results.results[:num_results])
 
@@ -100,19 +123,16 @@ async def process(user_query: str, search_engine: str, num_results: int):
         st.json(search_results.model_dump())
 
     paper_analyzer = PaperAnalyzer()
-    ranked_papers: RankedPapers = await paper_analyzer.analyze_papers(search_results, user_query)
+    ranked_expander = st.expander("Click to see Ranked Papers")
 
-    # Check if there are any ranked papers
-    if not ranked_papers.papers:
-        st.error("⚠️ No valid papers were analyzed based on the search results.")
-        return  # Halt the process
-
-    with st.expander("Click to see Ranked Papers"):
-        for i, paper in enumerate(ranked_papers.papers, 1):
-            st.write(f"**Paper {i}:**")
+    # Show each paper as soon as its analysis completes rather than after the whole batch,
+    # labelled with its rank since analyses finish out of order
+    def show_ranked_paper(rank: int, paper: RankedPaper):
+        with ranked_expander:
+            st.write(f"**Paper {rank}:**")
             st.write(f"**Title:** {paper.title}")
-            st.write(f"**Authors:** {', '.join(paper.authors)}")
-            st.write(f"**Year:** {paper.year}")
+            st.write(f"**Authors:** {', '.join(paper.authors or [])}")
+            st.write(f"**Year:** {paper.publication_year}")
             st.write(f"**Relevance Score:** {paper.relevance_score}")
             st.write(f"**Analysis:** {paper.analysis}")
             st.write("**Relevant Quotes:**")
@@ -120,6 +140,15 @@ async def process(user_query: str, search_engine: str, num_results: int):
                 st.write(f"- {quote}")
             st.write("---")
 
+    ranked_papers: RankedPapers = await paper_analyzer.analyze_papers(
+        search_results, user_query, on_paper_analyzed=show_ranked_paper
+    )
+
+    # Check if there are any ranked papers
+    if not ranked_papers.papers:
+        st.error("⚠️ No valid papers were analyzed based on the search results.")
+        return  # Halt the process
+
     result_synthesizer = ResultSynthesizer()
     synthesis = await result_synthesizer.synthesize(ranked_papers, user_query)
 
@@ -127,7 +156,11 @@ async def process(user_query: str, search_engine: str, num_results: int):
     st.markdown(synthesis)
 
 async def handle_submit(user_query: str, search_engine: str, num_results: int):
-    await process(user_query, search_engine, num_results)
+    # Queue this session's LLM calls fairly against other sessions sharing the handler, and
+    # close this event loop's HTTP connections (search session and SDK pools) when done
+    async with get_pools():
+        with tenant(st.session_state.setdefault("tenant_id", uuid.uuid4().hex)):
+            await process(user_query, search_engine, num_results)
 
 def run_async_task(coro):
     try:
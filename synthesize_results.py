@@ -1,5 +1,5 @@
 import logging
-from llm_api_handler import LLMAPIHandler
+from llm_api_handler import LLMAPIHandler, get_handler
 from models import RankedPapers, RankedPaper
 from typing import List
 from pydantic import BaseModel
@@ -52,7 +52,7 @@ Respond in the following JSON format:
 
 class ResultSynthesizer:
     def __init__(self):
-        self.llm_api_handler = LLMAPIHandler()
+        self.llm_api_handler = get_handler()
         logger.debug("ResultSynthesizer initialized")
 
     def _format_paper_analyses(self, papers: List[RankedPaper]) -> str:
@@ -94,12 +94,13 @@ Relevant Quotes:
 
         try:
             logger.info(f"Sending request to LLM API for query: {user_query}")
-            response = await self.llm_api_handler.async_process(
+            response = await self.llm_api_handler.async_process_cascade(
                 prompts=[prompt],
-                model="gpt-4o-2024-08-06",
+                task="synthesis",
                 system_message="You are a helpful assistant tasked with synthesizing research paper analyses.",
                 temperature=0.6,
-                response_format=SynthesisResponse
+                response_format=SynthesisResponse,
+                stage="synthesis"
             )
             logger.info("Successfully received response from LLM API")
             synthesis = response[0]
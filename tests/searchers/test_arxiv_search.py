@@ -1,13 +1,17 @@
 import pytest
+import asyncio
 from unittest.mock import AsyncMock, patch
 from searchers.arxiv_search import ArXivSearch
+from searchers.pdf_extraction import PDFBuffer
+from searchers.fulltext_store import FullTextStore
 from models import SearchQueries, SearchQuery, SearchResults
 
 @pytest.mark.asyncio
 async def test_arxiv_search_success():
     arxiv_search = ArXivSearch(max_results=1)
     with patch.object(arxiv_search, 'search', new_callable=AsyncMock) as mock_search, \
-         patch.object(arxiv_search, 'get_full_text', new_callable=AsyncMock) as mock_get_full_text:
+         patch.object(arxiv_search, 'fetch_pdf', new_callable=AsyncMock) as mock_fetch_pdf, \
+         patch.object(arxiv_search, 'extract_text_from_pdf', new_callable=AsyncMock) as mock_extract:
         mock_search.return_value = [{
             'id': 'arxiv:1234.5678',
             'title': 'ArXiv Test Paper',
@@ -15,10 +19,153 @@ async def test_arxiv_search_success():
             'published': '2021-01-01T00:00:00Z',
             'pdf_url': 'http://example.com/arxiv.pdf',
         }]
-        mock_get_full_text.return_value = 'Full text of the arXiv paper.'
+        mock_fetch_pdf.return_value = PDFBuffer()
+        mock_extract.return_value = 'Full text of the arXiv paper.'
         search_queries = SearchQueries(queries=[
             SearchQuery(search_query="machine learning", query_rationale="Test rationale")
         ])
         results = await arxiv_search.search_and_parse_queries(search_queries)
         assert len(results.results) == 1
         assert results.results[0].title == 'ArXiv Test Paper'
+        assert results.results[0].full_text == 'Full text of the arXiv paper.'
+
+@pytest.mark.asyncio
+async def test_pipeline_overlaps_stages_and_keeps_serial_order():
+    arxiv_search = ArXivSearch(max_results=5, download_concurrency=4, extract_concurrency=2)
+    active = {"downloads": 0, "peak": 0}
+    downloaded, buffers = [], []
+
+    async def fake_search(session, query):
+        # Later queries answer first; results must still come back in query order
+        await asyncio.sleep(0.03 / (int(query[1]) + 1))
+        return [{'id': f"{query}-{rank}", 'title': f"{query}-{rank}", 'authors': [],
+                 'published': '2021-01-01T00:00:00Z', 'pdf_url': f"http://example.com/{query}-{rank}.pdf"}
+                for rank in range(3)]
+
+    async def fake_fetch_pdf(session, pdf_url):
+        active["downloads"] += 1
+        active["peak"] = max(active["peak"], active["downloads"])
+        await asyncio.sleep(0.02)
+        active["downloads"] -= 1
+        downloaded.append(pdf_url)
+        if pdf_url.endswith("q1-0.pdf"):
+            return None
+        pdf = PDFBuffer()
+        await pdf.write(pdf_url.encode())
+        buffers.append(pdf)
+        return pdf
+
+    async def fake_extract(source):
+        return f"text of {bytes(source).decode()}"
+
+    with patch.object(arxiv_search, 'search', side_effect=fake_search), \
+         patch.object(arxiv_search, 'fetch_pdf', side_effect=fake_fetch_pdf), \
+         patch.object(arxiv_search, 'extract_text_from_pdf', side_effect=fake_extract):
+        results = await arxiv_search.search_and_parse_queries(SearchQueries(queries=[
+            SearchQuery(search_query=f"q{i}", query_rationale="") for i in range(3)
+        ]))
+
+    assert [r.title for r in results.results] == ["q0-0", "q0-1", "q0-2", "q1-0", "q1-1"]
+    assert results.results[3].full_text == ""  # failed download
+    assert results.results[0].full_text == "text of http://example.com/q0-0.pdf"
+    # Papers past max_results are never downloaded, and downloads overlap
+    assert len(downloaded) == 5
+    assert active["peak"] > 1
+    assert len(buffers) == 4 and all(pdf.source is None for pdf in buffers)
+
+class FakeContent:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
+
+    async def iter_chunked(self, size):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+class FakeResponse:
+    def __init__(self, chunks, content_length=None):
+        self.status = 200
+        self.content_length = content_length
+        self.content = FakeContent(chunks)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url):
+        return self.response
+
+@pytest.mark.asyncio
+async def test_pdf_download_stays_in_memory_below_spool_threshold():
+    arxiv_search = ArXivSearch(spool_bytes=1024)
+    pdf = await arxiv_search.fetch_pdf(FakeSession(FakeResponse([b"%PDF", b"-1.7"])), "http://example.com/a.pdf")
+    assert not pdf.spilled
+    assert bytes(pdf.source) == b"%PDF-1.7"
+    await pdf.aclose()
+
+@pytest.mark.asyncio
+async def test_oversized_pdf_download_is_aborted_early():
+    arxiv_search = ArXivSearch(max_pdf_bytes=10, spool_bytes=4)
+    response = FakeResponse([b"x" * 6] * 5)
+    assert await arxiv_search.fetch_pdf(FakeSession(response), "http://example.com/big.pdf") is None
+    assert response.content.read == 2
+    # A declared Content-Length over the limit is rejected before reading the body
+    response = FakeResponse([b"x"], content_length=11)
+    assert await arxiv_search.fetch_pdf(FakeSession(response), "http://example.com/big.pdf") is None
+    assert response.content.read == 0
+
+@pytest.mark.asyncio
+async def test_stored_full_text_skips_download(tmp_path):
+    store = FullTextStore(str(tmp_path / "fulltext.sqlite3"))
+    store.put(["arxiv:1234.5678v2"], "Stored text.")
+    arxiv_search = ArXivSearch(max_results=2, store=store)
+    with patch.object(arxiv_search, 'search', new_callable=AsyncMock) as mock_search, \
+         patch.object(arxiv_search, 'fetch_pdf', new_callable=AsyncMock) as mock_fetch_pdf, \
+         patch.object(arxiv_search, 'extract_text_from_pdf', new_callable=AsyncMock) as mock_extract:
+        mock_search.return_value = [
+            {'id': 'http://arxiv.org/abs/1234.5678v2', 'title': 'Stored', 'authors': [],
+             'published': '2021-01-01T00:00:00Z', 'pdf_url': 'http://arxiv.org/pdf/1234.5678v2'},
+            {'id': 'http://arxiv.org/abs/2345.6789v1', 'title': 'New', 'authors': [],
+             'published': '2021-01-01T00:00:00Z', 'pdf_url': 'http://arxiv.org/pdf/2345.6789v1'},
+        ]
+        mock_fetch_pdf.return_value = PDFBuffer()
+        mock_extract.return_value = 'Extracted text.'
+        results = await arxiv_search.search_and_parse_queries(SearchQueries(queries=[
+            SearchQuery(search_query="soil", query_rationale="")
+        ]))
+    assert [r.full_text for r in results.results] == ['Stored text.', 'Extracted text.']
+    mock_fetch_pdf.assert_awaited_once()
+    # The newly extracted text is stored for next time
+    assert store.get(["arxiv:2345.6789v1"]).text == 'Extracted text.'
+
+@pytest.mark.asyncio
+async def test_metadata_only_defers_pdf_download_to_loader():
+    arxiv_search = ArXivSearch(max_results=2, metadata_only=True)
+    with patch.object(arxiv_search, 'search', new_callable=AsyncMock) as mock_search, \
+         patch.object(arxiv_search, 'fetch_pdf', new_callable=AsyncMock) as mock_fetch_pdf, \
+         patch.object(arxiv_search, 'extract_text_from_pdf', new_callable=AsyncMock) as mock_extract:
+        mock_search.return_value = [
+            {'id': f'http://arxiv.org/abs/2101.0000{i}v1', 'title': f'Paper {i}', 'authors': [],
+             'summary': f'Abstract {i}', 'published': '2021-01-01T00:00:00Z',
+             'pdf_url': f'http://arxiv.org/pdf/2101.0000{i}v1'}
+            for i in range(2)
+        ]
+        mock_fetch_pdf.return_value = PDFBuffer()
+        mock_extract.return_value = 'Full text.'
+        results = await arxiv_search.search_and_parse_queries(SearchQueries(queries=[
+            SearchQuery(search_query="soil", query_rationale="")
+        ]))
+        assert [r.abstract for r in results.results] == ['Abstract 0', 'Abstract 1']
+        assert all(r.full_text == "" for r in results.results)
+        mock_fetch_pdf.assert_not_awaited()
+        assert 'full_text_loader' not in results.results[0].model_dump()
+
+        assert await results.results[1].full_text_loader() == 'Full text.'
+        assert mock_fetch_pdf.await_args.args[1] == 'http://arxiv.org/pdf/2101.00001v1'
@@ -1,24 +1,219 @@
+import json
 import pytest
+import asyncio
+from time import monotonic
 from unittest.mock import AsyncMock, patch
 from searchers.core_search import CORESearch
-from models import SearchQueries, SearchQuery, SearchResults
+from searchers.fulltext_store import FullTextStore
+from models import SearchQueries, SearchQuery, SearchResult, SearchResults
 
 @pytest.mark.asyncio
 async def test_core_search_success():
     core_search = CORESearch(max_results=1)
-    with patch.object(core_search, 'search', new_callable=AsyncMock) as mock_search:
-        mock_search.return_value = {
-            'results': [{
-                'doi': '10.1234/core.doi',
-                'title': 'Core Test Paper',
-                'authors': [{'name': 'Core Author'}],
-                'publicationYear': '2021',
-                'fullText': 'Full text of the core paper.'
-            }]
-        }
+    session = FakeSession(lambda key, body: FakeResponse(200, body={
+        'totalHits': 2,
+        'results': [{
+            'doi': '10.1234/core.doi',
+            'title': 'Core Test Paper',
+            'authors': [{'name': 'Core Author'}],
+            'publicationYear': '2021',
+            'fullText': 'Full text of the core paper.'
+        }, {'title': 'Never decoded'}]
+    }))
+    with patch.object(CORESearch, "session", session):
         search_queries = SearchQueries(queries=[
             SearchQuery(search_query="data science", query_rationale="Test rationale")
         ])
         results = await core_search.search_and_parse_queries(search_queries)
         assert len(results.results) == 1
         assert results.results[0].title == 'Core Test Paper'
+        assert results.results[0].full_text == 'Full text of the core paper.'
+    # Only the top work is requested
+    assert session.requests[0][2]["limit"] == 1
+
+class FakeContent:
+    def __init__(self, data):
+        self.data = data
+
+    async def iter_chunked(self, size):
+        # Small chunks so works are split across reads
+        for i in range(0, len(self.data), 7):
+            yield self.data[i:i + 7]
+
+class FakeResponse:
+    def __init__(self, status, headers=None, body=None):
+        self.status = status
+        self.headers = headers or {}
+        self.body = body or {}
+        self.content = FakeContent(json.dumps(self.body).encode())
+
+    async def json(self):
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = responses
+        self.keys = []
+        self.requests = []
+
+    async def request(self, method, url, headers, json=None):
+        key = headers["Authorization"].split()[-1]
+        self.keys.append(key)
+        self.requests.append((method, url, json))
+        return self.responses(key, json)
+
+@pytest.fixture
+def two_keys(monkeypatch):
+    monkeypatch.setenv("CORE_API_KEY1", "key-one")
+    monkeypatch.setenv("CORE_API_KEY2", "key-two")
+
+@pytest.mark.asyncio
+async def test_key_pool_prefers_key_with_most_capacity(two_keys):
+    core_search = CORESearch(max_requests_per_minute=3)
+    one, two = core_search.key_pool.limiters
+    one.update({"X-RateLimitRemaining": "1", "X-RateLimitReset": "60"}, monotonic())
+    assert (await core_search.key_pool.acquire()).key == "key-two"
+    assert (await core_search.key_pool.acquire()).key == "key-two"
+    # key-two has 1 local request left, key-one 1 according to the server
+    await core_search.key_pool.acquire()
+    await core_search.key_pool.acquire()
+    assert one.available(monotonic()) == 0 and two.available(monotonic()) == 0
+
+@pytest.mark.asyncio
+async def test_rate_limited_key_is_rested_and_request_retried_on_another(two_keys):
+    core_search = CORESearch(max_requests_per_minute=5)
+    session = FakeSession(lambda key, body: FakeResponse(429, {"Retry-After": "30"}) if key == "key-one"
+                          else FakeResponse(200, {"X-RateLimitRemaining": "9"}, {"results": []}))
+    core_search.key_pool.limiters[1].record(monotonic())  # make key-one the first choice
+    with patch.object(CORESearch, "session", session):
+        assert await core_search.search("soil") == {"results": []}
+    assert session.keys == ["key-one", "key-two"]
+    assert core_search.key_pool.limiters[0].available(monotonic()) == 0
+
+@pytest.mark.asyncio
+async def test_rate_limit_retries_are_bounded(two_keys):
+    core_search = CORESearch(max_attempts=2)
+    session = FakeSession(lambda key, body: FakeResponse(429, {"Retry-After": "30"}))
+    with patch.object(CORESearch, "session", session):
+        assert await core_search.search("soil") == {}
+    assert len(session.keys) == 2
+
+@pytest.mark.asyncio
+async def test_queries_run_concurrently_and_keep_their_order():
+    core_search = CORESearch(max_results=3, max_requests_per_minute=10)
+    started, release = [], asyncio.Event()
+
+    async def slow_works(query, **kwargs):
+        started.append(query)
+        if len(started) == 3:
+            release.set()
+        await asyncio.wait_for(release.wait(), timeout=1)
+        yield {"title": query}
+
+    with patch.object(core_search, 'iter_works', side_effect=slow_works):
+        results = await core_search.search_and_parse_queries(SearchQueries(queries=[
+            SearchQuery(search_query=f"q{i}", query_rationale="") for i in range(4)
+        ]))
+    assert [result.title for result in results.results] == ["q0", "q1", "q2"]
+
+def entry(n):
+    return {"id": n, "doi": f"10.1/{n}", "title": f"Paper {n}", "authors": [], "fullText": "text"}
+
+def paged(total_hits):
+    def respond(key, body):
+        offset, limit = body.get("offset", 0), body["limit"]
+        works = [entry(n) for n in range(offset, min(total_hits, offset + limit))]
+        if "exclude" in body:
+            works = [{k: v for k, v in work.items() if k != "fullText"} for work in works]
+        return FakeResponse(200, body={"totalHits": total_hits, "results": works})
+    return respond
+
+@pytest.mark.asyncio
+async def test_search_stream_follows_pagination_up_to_cap():
+    core_search = CORESearch(page_size=2, max_results_per_query=5)
+    session = FakeSession(paged(100))
+    with patch.object(CORESearch, "session", session):
+        results = [r async for r in core_search.search_stream(SearchQuery(search_query="soil", query_rationale=""))]
+    assert [r.doi for r in results] == [f"10.1/{n}" for n in range(5)]
+    assert [(body.get("offset", 0), body["limit"]) for _, _, body in session.requests] == [(0, 2), (2, 2), (4, 1)]
+
+@pytest.mark.asyncio
+async def test_search_stream_stops_when_hits_run_out():
+    core_search = CORESearch(page_size=3, max_results_per_query=50)
+    session = FakeSession(paged(4))
+    with patch.object(CORESearch, "session", session):
+        results = [r async for r in core_search.search_stream(SearchQuery(search_query="soil", query_rationale=""))]
+    assert len(results) == 4
+    assert len(session.requests) == 2
+
+@pytest.mark.asyncio
+async def test_stream_queries_dedupes_and_stops_once_enough_results():
+    core_search = CORESearch(page_size=2, max_results_per_query=100, max_requests_per_minute=100)
+    # Both queries return the same works
+    session = FakeSession(paged(1000))
+    queries = SearchQueries(queries=[SearchQuery(search_query=q, query_rationale="") for q in ("a", "b")])
+    with patch.object(CORESearch, "session", session):
+        results = [r async for r in core_search.stream_queries(queries, max_results=6)]
+    assert len({r.doi for r in results}) == len(results) == 6
+    # Backpressure keeps each query only a few pages ahead of what was consumed
+    assert len(session.requests) < 12
+
+@pytest.mark.asyncio
+async def test_metadata_only_pages_are_hydrated_on_demand():
+    core_search = CORESearch(page_size=5, max_results_per_query=5, max_requests_per_minute=100, metadata_only=True)
+    def respond(key, body):
+        if body is None:
+            return FakeResponse(200, body={"id": 1, "fullText": "full text 1"})
+        return paged(5)(key, body)
+    session = FakeSession(respond)
+    with patch.object(CORESearch, "session", session):
+        results = [r async for r in core_search.search_stream(SearchQuery(search_query="soil", query_rationale=""))]
+        assert session.requests[0][2]["exclude"] == ["fullText"]
+        assert all(r.full_text == "" for r in results)
+        hydrated = await core_search.hydrate([results[1]])
+        assert await results[1].full_text_loader() == "full text 1"
+    assert hydrated[0].full_text == "full text 1"
+    assert hydrated[0].full_text_loader is None
+    assert session.requests[-1][:2] == ("GET", "https://api.core.ac.uk/v3/works/1")
+
+@pytest.mark.asyncio
+async def test_hydrate_uses_full_text_store_before_api(tmp_path):
+    store = FullTextStore(str(tmp_path / "fulltext.sqlite3"))
+    core_search = CORESearch(page_size=5, max_results_per_query=5, max_requests_per_minute=100,
+                             metadata_only=True, store=store)
+    session = FakeSession(lambda key, body: FakeResponse(200, body={"id": 1, "fullText": "full text 1"}))
+    result = SearchResult(title="Paper 1", doi="10.1/ONE", source_id="1")
+    with patch.object(CORESearch, "session", session):
+        first = await core_search.hydrate([result])
+        # Found again through its DOI, e.g. from another source
+        second = await core_search.hydrate([result.model_copy(update={"source_id": "other"})])
+    assert first[0].full_text == second[0].full_text == "full text 1"
+    assert len(session.requests) == 1
+    assert store.get(["doi:10.1/one"]).metadata["id"] == "1"
+
+@pytest.mark.asyncio
+async def test_full_texts_from_search_pages_are_stored_for_later_lookups(tmp_path):
+    store = FullTextStore(str(tmp_path / "fulltext.sqlite3"))
+    work = {"id": 7, "doi": "10.1/seven", "title": "Paper 7", "fullText": "full text 7"}
+
+    def respond(key, body):
+        if body is not None and "fullText" in body.get("exclude", []):
+            return FakeResponse(200, body={"totalHits": 1, "results": [{k: v for k, v in work.items() if k != "fullText"}]})
+        return FakeResponse(200, body={"totalHits": 1, "results": [work]})
+
+    session = FakeSession(respond)
+    query = SearchQuery(search_query="seven", query_rationale="r")
+    with patch.object(CORESearch, "session", session):
+        first = await CORESearch(store=store).search_and_parse("q0", query)
+        lazy = await CORESearch(store=store, metadata_only=True).search_and_parse("q0", query)
+        assert await lazy.full_text_loader() == "full text 7"
+    assert first.full_text == "full text 7"
+    assert store.get(["core:7"]).text == "full text 7"
+    # The metadata-only result was filled from the store, not with a GET of the work
+    assert [method for method, _, _ in session.requests] == ["POST", "POST"]
@@ -0,0 +1,55 @@
+import pytest
+from searchers.fulltext_store import FullTextStore, arxiv_key, doi_key
+
+@pytest.fixture
+def store(tmp_path):
+    store = FullTextStore(str(tmp_path / "fulltext.sqlite3"))
+    yield store
+    store.close()
+
+def test_keys_are_normalized():
+    assert arxiv_key("http://arxiv.org/abs/2101.01234v2") == "arxiv:2101.01234v2"
+    assert arxiv_key("2101.01234") == "arxiv:2101.01234"
+    assert arxiv_key("not an id") is None
+    assert doi_key("https://doi.org/10.1000/ABC") == "doi:10.1000/abc"
+    assert doi_key("") is None
+
+def test_put_and_get_by_any_key(store):
+    store.put(["arxiv:2101.01234v2", "doi:10.1000/abc"], "Full text.", {"title": "Paper"})
+    assert store.get(["doi:10.1000/abc"]).text == "Full text."
+    assert store.get([None, "missing", "arxiv:2101.01234v2"]).metadata == {"title": "Paper"}
+    assert store.get(["missing"]) is None
+
+def test_identical_texts_are_stored_once(store):
+    first = store.put(["arxiv:2101.01234v1"], "Same text.")
+    second = store.put(["core:42"], "Same text.")
+    assert first == second
+    assert store.stats()["texts"] == 1 and store.stats()["keys"] == 2
+
+def test_empty_texts_are_not_stored(store):
+    assert store.put(["core:1"], "") is None
+    assert store.stats()["texts"] == 0
+
+def test_least_recently_used_texts_are_evicted(tmp_path):
+    store = FullTextStore(str(tmp_path / "fulltext.sqlite3"), max_bytes=None)
+    store.put(["a"], "text a " * 100)
+    store.put(["b"], "text b " * 100)
+    store.get(["a"])
+    # Room for two of the three texts
+    store.max_bytes = store.stats()["bytes"]
+    store.put(["c"], "text c " * 100)
+    assert store.get(["a"]) is not None
+    assert store.get(["b"]) is None
+    assert store.get(["c"]) is not None
+
+def test_store_persists_across_instances(tmp_path):
+    path = str(tmp_path / "fulltext.sqlite3")
+    FullTextStore(path).put(["core:7"], "Persisted.")
+    assert FullTextStore(path).get(["core:7"]).text == "Persisted."
+
+def test_from_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("FULLTEXT_STORE_PATH", "off")
+    assert FullTextStore.from_env() is None
+    monkeypatch.setenv("FULLTEXT_STORE_PATH", str(tmp_path / "store.sqlite3"))
+    monkeypatch.setenv("FULLTEXT_STORE_MAX_BYTES", "1000")
+    assert FullTextStore.from_env().max_bytes == 1000
@@ -0,0 +1,37 @@
+import json
+import pytest
+from searchers.json_stream import JSONArrayStreamDecoder, JSONStreamError
+
+DOCUMENT = {
+    "totalHits": 42,
+    "results": [{"id": i, "title": f'Quote " and \\ backslash {i} é', "fullText": "]}{[" * 50, "score": 1.5e3,
+                 "authors": [{"name": "A"}], "doi": None} for i in range(4)],
+    "tail": [1, 2, {"a": "b"}],
+}
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64, 100_000])
+def test_decodes_array_items_incrementally(chunk_size):
+    data = json.dumps(DOCUMENT, ensure_ascii=False, indent=2).encode()
+    decoder = JSONArrayStreamDecoder("results")
+    items = []
+    for i in range(0, len(data), chunk_size):
+        items.extend(decoder.feed(data[i:i + chunk_size]))
+    decoder.close()
+    assert items == DOCUMENT["results"]
+    assert decoder.fields == {"totalHits": 42, "tail": [1, 2, {"a": "b"}]}
+
+def test_items_are_returned_before_the_document_ends():
+    data = json.dumps(DOCUMENT).encode()
+    decoder = JSONArrayStreamDecoder("results")
+    first_item_end = data.index(b', {"id": 1')
+    assert decoder.feed(data[:first_item_end + 1]) == DOCUMENT["results"][:1]
+    # Only the unfinished remainder is buffered
+    assert len(decoder._buffer) < 10
+
+def test_truncated_and_malformed_documents_raise():
+    decoder = JSONArrayStreamDecoder()
+    decoder.feed(b'{"results": [{"id": 1}, {"id"')
+    with pytest.raises(JSONStreamError):
+        decoder.close()
+    with pytest.raises(JSONStreamError):
+        JSONArrayStreamDecoder().feed(b'[1, 2]')
@@ -0,0 +1,90 @@
+import pytest
+import os
+from concurrent.futures import ThreadPoolExecutor
+from searchers.pdf_extraction import PDFBuffer, PDFExtractor, PDFTooLargeError, _extract_range
+
+fitz = pytest.importorskip("fitz")
+
+def make_pdf(path, pages):
+    doc = fitz.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"Page number {i}")
+    doc.save(path)
+    doc.close()
+    return str(path)
+
+@pytest.fixture
+def sample_pdf(tmp_path):
+    return make_pdf(tmp_path / "sample.pdf", 7)
+
+def page_numbers(text):
+    return [int(line.split()[-1]) for line in text.splitlines() if line.startswith("Page number")]
+
+@pytest.mark.asyncio
+async def test_thread_mode_extracts_every_page_and_honours_page_cap(sample_pdf):
+    extractor = PDFExtractor(mode="thread", max_workers=2)
+    try:
+        assert page_numbers(await extractor.extract(sample_pdf)) == list(range(7))
+        extractor.max_pages = 3
+        with open(sample_pdf, "rb") as f:
+            assert page_numbers(await extractor.extract(f.read())) == [0, 1, 2]
+    finally:
+        extractor.close()
+
+@pytest.mark.asyncio
+async def test_pages_mode_splits_documents_across_worker_processes(sample_pdf):
+    extractor = PDFExtractor(mode="pages", max_workers=2, pages_per_task=2, max_pages=5)
+    try:
+        assert page_numbers(await extractor.extract(sample_pdf)) == [0, 1, 2, 3, 4]
+    finally:
+        extractor.close()
+
+@pytest.mark.asyncio
+async def test_pages_mode_extracts_in_memory_pdfs_in_one_task(sample_pdf, monkeypatch):
+    sources = []
+
+    def recording_extract_range(source, *args):
+        sources.append(source)
+        return _extract_range(source, *args)
+
+    monkeypatch.setattr("searchers.pdf_extraction._extract_range", recording_extract_range)
+    extractor = PDFExtractor(mode="pages", pages_per_task=2)
+    extractor._executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        with open(sample_pdf, "rb") as f:
+            assert page_numbers(await extractor.extract(f.read())) == list(range(7))
+    finally:
+        extractor.close()
+    # The bytes are pickled once and never written to disk
+    assert len(sources) == 1 and isinstance(sources[0], bytes)
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        PDFExtractor(mode="gpu")
+
+@pytest.mark.asyncio
+async def test_buffer_spills_to_disk_past_threshold_and_extracts_from_either(sample_pdf):
+    with open(sample_pdf, "rb") as f:
+        data = f.read()
+    extractor = PDFExtractor(mode="thread", max_workers=1)
+    try:
+        for spool_bytes in (len(data), 100):
+            pdf = PDFBuffer(spool_bytes=spool_bytes)
+            for i in range(0, len(data), 64):
+                await pdf.write(data[i:i + 64])
+            await pdf.finish()
+            assert pdf.spilled == (spool_bytes == 100)
+            path = pdf.path
+            assert page_numbers(await extractor.extract(pdf.source)) == list(range(7))
+            await pdf.aclose()
+            assert path is None or not os.path.exists(path)
+    finally:
+        extractor.close()
+
+@pytest.mark.asyncio
+async def test_buffer_rejects_writes_past_max_bytes():
+    async with PDFBuffer(spool_bytes=4, max_bytes=8) as pdf:
+        await pdf.write(b"12345678")
+        with pytest.raises(PDFTooLargeError):
+            await pdf.write(b"9")
+        assert pdf.size == 8
@@ -91,4 +91,90 @@ async def test_analyze_paper_analysis(mock_search_results):
         analysis = await analyzer.analyze_paper("impact of climate change", paper)
         assert analysis.analysis == "This paper is highly relevant."
         assert len(analysis.relevant_quotes) == 1
-        assert analysis.relevant_quotes[0] == "Significant impact on climate change."
\ No newline at end of file
+        assert analysis.relevant_quotes[0] == "Significant impact on climate change."
+
+@pytest.mark.asyncio
+async def test_analyze_long_paper_map_reduce(mock_search_results):
+    analyzer = PaperAnalyzer(single_pass_tokens=200, chunk_tokens=100, chunk_overlap_tokens=0, paper_token_budget=250)
+    paper = mock_search_results.results[0].model_copy(update={"full_text": "\n\n".join(
+        ["Filler about unrelated topics. " * 10] * 4 + ["Climate change impact measured in 40 sites. " * 5]
+    )})
+
+    async def fake_async_process(prompts, **kwargs):
+        if len(prompts) > 1:
+            assert kwargs["return_exceptions"] is True
+            return [PaperAnalysis(analysis=f"notes {i}", relevant_quotes=[f"quote {i}"]) for i in range(len(prompts) - 1)] + [ValueError("boom")]
+        assert "Part 1:\nnotes 0" in prompts[0]
+        return [PaperAnalysis(analysis="Combined analysis.", relevant_quotes=["quote 0"])]
+
+    with patch('analyze_papers.LLMAPIHandler.async_process', side_effect=fake_async_process) as mock_llm:
+        analysis = await analyzer.analyze_paper("climate change impact", paper)
+
+    assert analysis.analysis == "Combined analysis."
+    assert mock_llm.call_count == 2
+    map_prompts = mock_llm.call_args_list[0].kwargs["prompts"]
+    # The budget keeps the chunk mentioning the claim even though it comes last
+    assert any("Climate change impact" in prompt for prompt in map_prompts)
+    assert len(map_prompts) < 5
+
+@pytest.mark.asyncio
+async def test_ranking_uses_abstracts_and_loads_full_text_for_finalists_only():
+    full_text = " ".join(["This is a test sentence."] * 50)
+    loaded = []
+
+    def loader(i):
+        async def load():
+            loaded.append(i)
+            return "" if i == 0 else full_text  # paper 0's PDF cannot be fetched
+        return load
+
+    search_results = SearchResults(results=[
+        SearchResult(title=f"Paper {i}", abstract=f"Abstract {i}", full_text_loader=loader(i)) for i in range(5)
+    ])
+    analyzer = PaperAnalyzer()
+    with patch.object(analyzer, 'rank_papers', new_callable=AsyncMock) as mock_rank_papers:
+        mock_rank_papers.return_value = []
+        await analyzer.analyze_papers(search_results, "claim")
+    papers = mock_rank_papers.call_args.args[0]
+    assert [paper.abstract for paper in papers] == [f"Abstract {i}" for i in range(5)]
+
+    async def fake_async_process(prompts, **kwargs):
+        # All five papers form one group; rank them by paper number
+        assert all("Abstract 4" in prompt for prompt in prompts)
+        return [RankingResponse(rankings=[
+            PaperRanking(paper_id=f"paper_{i}", rank=i + 1, explanation="") for i in range(5)
+        ]) for _ in prompts]
+
+    with patch('analyze_papers.LLMAPIHandler.async_process', side_effect=fake_async_process), \
+         patch.object(analyzer, 'analyze_paper', new_callable=AsyncMock) as mock_analyze_paper:
+        mock_analyze_paper.return_value = PaperAnalysis(analysis="Relevant.", relevant_quotes=["quote"])
+        ranked_papers = await analyzer.rank_papers(papers, "claim", top_n=2)
+
+    assert [paper.title for paper in ranked_papers] == ["Paper 1", "Paper 2"]
+    # Paper 0 had no usable text and was replaced by the next candidate; the rest were never fetched
+    assert sorted(loaded) == [0, 1, 2]
+    assert all(call.args[1].full_text == full_text for call in mock_analyze_paper.call_args_list)
+
+@pytest.mark.asyncio
+async def test_papers_are_reported_with_their_rank_as_analyses_finish(mock_search_results):
+    analyzer = PaperAnalyzer()
+    reported = []
+
+    async def fake_analyze_paper(claim, paper):
+        if paper.id == "paper_0":
+            await asyncio.sleep(0.01)  # the top paper finishes last
+        return PaperAnalysis(analysis=f"Analysis of {paper.id}", relevant_quotes=[])
+
+    with patch('analyze_papers.LLMAPIHandler.async_process', new_callable=AsyncMock) as mock_llm, \
+         patch.object(analyzer, 'analyze_paper', side_effect=fake_analyze_paper):
+        mock_llm.return_value = [RankingResponse(rankings=[
+            PaperRanking(paper_id="paper_0", rank=1, explanation="Highly relevant"),
+            PaperRanking(paper_id="paper_1", rank=2, explanation="Less relevant"),
+        ])]
+        ranked_papers = await analyzer.analyze_papers(
+            mock_search_results, "impact of climate change",
+            on_paper_analyzed=lambda rank, paper: reported.append((rank, paper.id, paper.publication_year))
+        )
+
+    assert reported == [(2, "paper_1", 2022), (1, "paper_0", 2021)]
+    assert [paper.publication_year for paper in ranked_papers.papers] == [2021, 2022]
@@ -0,0 +1,197 @@
+import os
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from pydantic import BaseModel
+from llm_api_handler import LLMAPIHandler, BatchJob
+
+class ResponseModel(BaseModel):
+    answer: str
+    confidence: float
+
+def output_line(custom_id, answer):
+    return json.dumps({
+        "custom_id": custom_id,
+        "response": {"status_code": 200, "body": {"choices": [
+            {"message": {"content": json.dumps({"answer": answer, "confidence": 0.9})}}
+        ]}}
+    })
+
+class FakeStreamedResponse:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def iter_bytes(self, chunk_size):
+        for i in range(0, len(self.data), 7):  # tiny chunks exercise line reassembly
+            yield self.data[i:i + 7]
+
+@pytest.fixture
+def handler():
+    return LLMAPIHandler()
+
+@pytest.fixture
+def mock_batch_api(handler):
+    client = handler.async_openai_client
+    with patch.object(client.files, 'create', new_callable=AsyncMock) as files_create, \
+         patch.object(client.batches, 'create', new_callable=AsyncMock) as batches_create, \
+         patch.object(client.batches, 'retrieve', new_callable=AsyncMock) as batches_retrieve, \
+         patch.object(client.files.with_streaming_response, 'content') as files_content:
+        files = {
+            "file-out": ("\n".join([
+                output_line("request_1", "Madrid"),
+                output_line("request_2", "Rome"),
+            ]) + "\n").encode()
+        }
+        files_create.return_value = MagicMock(id="file-in")
+        batches_create.return_value = MagicMock(id="batch_1", input_file_id="file-in", status="validating", created_at=1)
+        batches_retrieve.side_effect = [
+            MagicMock(status="in_progress"),
+            MagicMock(status="completed", output_file_id="file-out", error_file_id=None),
+        ]
+        files_content.side_effect = lambda file_id: FakeStreamedResponse(files[file_id])
+        yield MagicMock(files=files, files_create=files_create, batches_retrieve=batches_retrieve, files_content=files_content)
+
+@pytest.mark.asyncio
+async def test_submit_and_wait_for_batch(handler, mock_batch_api, tmp_path):
+    job = await handler.submit_batch(
+        ["Capital of Spain?", "Capital of Spain?", "Capital of Italy?"],
+        response_format=ResponseModel,
+        output_dir=str(tmp_path),
+        deduplicate_prompts=True
+    )
+    assert job.batch_ids == ["batch_1"]
+    assert os.path.exists(job.metadata_path)
+    assert job.load_metadata()["num_requests"] == 2
+
+    result = await handler.wait_for_batch(job, ResponseModel, poll_interval=0)
+    assert result.metadata["status"] == "completed"
+    assert [r["prompt"] for r in result.results] == ["Capital of Spain?", "Capital of Italy?"]
+    assert result.results[1]["response"].answer == "Rome"
+    assert mock_batch_api.batches_retrieve.call_count == 2
+
+@pytest.mark.asyncio
+async def test_reattach_to_batch_from_metadata(handler, mock_batch_api, tmp_path):
+    job = await handler.submit_batch(["Capital of Spain?", "Capital of Italy?"], output_dir=str(tmp_path))
+
+    # A new process only has the metadata file to go on
+    resumed = LLMAPIHandler().attach_batch(job.metadata_path)
+    assert resumed == BatchJob.from_metadata(job.metadata_path)
+    assert resumed.batch_ids == ["batch_1"]
+
+    result = await handler.wait_for_batch(resumed, poll_interval=0)
+    assert [r["response"] for r in result.results] == [
+        json.dumps({"answer": "Madrid", "confidence": 0.9}),
+        json.dumps({"answer": "Rome", "confidence": 0.9}),
+    ]
+
+@pytest.mark.asyncio
+async def test_wait_for_failed_batch(handler, mock_batch_api, tmp_path):
+    mock_batch_api.batches_retrieve.side_effect = [MagicMock(status="failed")]
+    job = await handler.submit_batch(["Capital of Spain?"], output_dir=str(tmp_path))
+    result = await handler.wait_for_batch(job, poll_interval=0)
+    assert result.results == []
+    assert result.metadata["error"] == "Batch processing failed"
+
+@pytest.mark.asyncio
+async def test_batch_results_joined_by_custom_id_with_errors(handler, mock_batch_api, tmp_path):
+    # Output order differs from input order, one request errored and one is missing entirely
+    mock_batch_api.files["file-out"] = (output_line("request_3", "Rome") + "\n" + json.dumps({
+        "custom_id": "request_2",
+        "response": {"status_code": 400, "body": {"error": {"message": "Invalid request"}}},
+        "error": None
+    }) + "\n").encode()
+    mock_batch_api.files["file-err"] = (json.dumps({
+        "custom_id": "request_1",
+        "response": None,
+        "error": {"code": "server_error", "message": "Internal error"}
+    }) + "\n").encode()
+    mock_batch_api.batches_retrieve.side_effect = [
+        MagicMock(status="completed", output_file_id="file-out", error_file_id="file-err")
+    ]
+
+    job = await handler.submit_batch(
+        ["Capital of Spain?", "Capital of France?", "Capital of Italy?", "Capital of Peru?"],
+        response_format=ResponseModel,
+        output_dir=str(tmp_path)
+    )
+    result = await handler.wait_for_batch(job, ResponseModel, poll_interval=0)
+
+    assert [r["prompt"] for r in result.results] == [
+        "Capital of Spain?", "Capital of France?", "Capital of Italy?", "Capital of Peru?"
+    ]
+    assert result.results[0]["error"] == "Internal error"
+    assert result.results[1]["error"] == "Invalid request"
+    assert result.results[2]["response"].answer == "Rome"
+    assert "error" in result.results[3]
+    assert os.path.exists(result.metadata["shards"][0]["error_file_path"])
+
+@pytest.mark.asyncio
+async def test_large_batches_are_sharded_and_merged_in_prompt_order(handler, mock_batch_api, tmp_path):
+    prompts = [f"Question {i}?" for i in range(5)]
+    mock_batch_api.batches_create = handler.async_openai_client.batches.create
+    mock_batch_api.batches_create.side_effect = [
+        MagicMock(id=f"batch_{i}", input_file_id=f"file-in-{i}", status="validating", created_at=1) for i in range(3)
+    ]
+    outputs = {"batch_0": ["request_2", "request_1"], "batch_1": ["request_4", "request_3"], "batch_2": ["request_5"]}
+    for batch_id, custom_ids in outputs.items():
+        mock_batch_api.files[f"out-{batch_id}"] = "".join(
+            output_line(custom_id, custom_id.upper()) + "\n" for custom_id in custom_ids
+        ).encode()
+    mock_batch_api.batches_retrieve.side_effect = lambda batch_id: MagicMock(
+        status="completed", output_file_id=f"out-{batch_id}", error_file_id=None
+    )
+
+    job = await handler.submit_batch(prompts, response_format=ResponseModel, output_dir=str(tmp_path),
+                                     max_requests_per_shard=2)
+    assert job.batch_ids == ["batch_0", "batch_1", "batch_2"]
+    assert mock_batch_api.files_create.call_count == 3
+
+    result = await handler.wait_for_batch(job, ResponseModel, poll_interval=0)
+    assert [r["prompt"] for r in result.results] == prompts
+    assert [r["response"].answer for r in result.results] == [f"REQUEST_{i}" for i in range(1, 6)]
+
+def test_batch_shards_respect_byte_limit(handler, tmp_path):
+    requests = handler._construct_batch_requests(["x" * 100] * 4, "gpt-4o-mini", 0.7)
+    paths = handler._write_batch_shards(requests, None, str(tmp_path), "job", max_requests=100, max_bytes=700)
+    assert len(paths) == 2
+    assert all(os.path.getsize(path) <= 700 for path in paths)
+    with pytest.raises(ValueError):
+        handler._write_batch_shards(requests, None, str(tmp_path), "job", max_requests=100, max_bytes=50)
+
+@pytest.mark.asyncio
+async def test_sync_batch_mode_refuses_to_run_inside_event_loop(handler, mock_batch_api, tmp_path):
+    with pytest.raises(RuntimeError, match="submit_batch"):
+        handler.process(["a", "b"], mode="batch", output_dir=str(tmp_path))
+    assert not os.listdir(tmp_path)
+
+@pytest.mark.asyncio
+async def test_failed_submission_records_and_cancels_created_shards(handler, mock_batch_api, tmp_path):
+    client = handler.async_openai_client
+    client.batches.create.side_effect = [
+        MagicMock(id="batch_0", input_file_id="file-in", status="validating", created_at=1),
+        RuntimeError("upload rejected"),
+    ]
+    with patch.object(client.batches, 'cancel', new_callable=AsyncMock) as batches_cancel:
+        batches_cancel.return_value = MagicMock(status="cancelling")
+        with pytest.raises(RuntimeError, match="upload rejected"):
+            await handler.submit_batch(["a", "b"], output_dir=str(tmp_path), max_requests_per_shard=1)
+    batches_cancel.assert_awaited_once_with("batch_0")
+    [metadata_path] = [path for path in os.listdir(tmp_path) if path.endswith("_metadata.json")]
+    job = handler.attach_batch(str(tmp_path / metadata_path))
+    assert job.batch_ids == ["batch_0"]
+    metadata = job.load_metadata()
+    assert metadata["status"] == "failed"
+    assert metadata["shards"][0]["status"] == "cancelling"
+
+def test_sync_batch_mode_closes_its_event_loop_pools(handler, mock_batch_api, tmp_path):
+    with patch("http_pools.HTTPPools.aclose", new_callable=AsyncMock) as pools_aclose:
+        result = handler.process(["What's the capital of Spain?", "What's the capital of Italy?"], mode="batch",
+                                 response_format=ResponseModel, output_dir=str(tmp_path), update_interval=0)
+    assert [r["response"].answer for r in result.results] == ["Madrid", "Rome"]
+    pools_aclose.assert_awaited_once()
@@ -0,0 +1,105 @@
+import pytest
+import asyncio
+from concurrency_control import AIMDController, ConcurrencyRegistry, parse_duration
+from http_pools import HTTPPools, TransportConfig, _httpx_module
+from llm_api_handler import LLMAPIHandler
+
+class RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, headers):
+        super().__init__("rate limited")
+        self.response = type("Response", (), {"headers": headers})()
+
+def test_parse_duration():
+    assert parse_duration("2") == 2.0
+    assert parse_duration("1.5s") == 1.5
+    assert parse_duration("6m0s") == 360.0
+    assert parse_duration("250ms") == 0.25
+    assert parse_duration("soon") is None
+
+@pytest.mark.asyncio
+async def test_controller_bounds_concurrency():
+    controller = AIMDController(initial_limit=2, max_limit=2)
+    peak = 0
+
+    async def work():
+        nonlocal peak
+        async with controller.slot():
+            peak = max(peak, controller.in_flight)
+            await asyncio.sleep(0.01)
+
+    tasks = [asyncio.create_task(work()) for _ in range(6)]
+    await asyncio.sleep(0)
+    assert controller.queue_depth == 4
+    await asyncio.gather(*tasks)
+    assert peak == 2
+    assert controller.in_flight == 0
+    assert controller.queue_depth == 0
+
+@pytest.mark.asyncio
+async def test_controller_additive_increase_and_multiplicative_decrease():
+    controller = AIMDController(initial_limit=4, cooldown=0)
+    for _ in range(8):
+        await controller.acquire()
+        await controller.acquire()
+        await controller.acquire()
+        await controller.acquire()
+        controller.on_success(0.1)
+        for _ in range(4):
+            controller.release()
+    assert controller.limit > 4
+
+    before = controller.limit
+    with pytest.raises(RateLimitError):
+        async with controller.slot():
+            raise RateLimitError({"retry-after": "0"})
+    assert controller.limit == max(1, int(before * 0.5))
+
+def test_controller_backs_off_on_latency():
+    controller = AIMDController(initial_limit=10, cooldown=0)
+    controller.on_success(0.1)
+    for _ in range(10):
+        controller.on_success(2.0)
+    assert controller.limit < 10
+
+def test_controller_retry_after_pauses_dispatch():
+    controller = AIMDController()
+    controller.observe_headers({"Retry-After": "5"})
+    assert controller.stats()["paused_for"] > 4
+
+def test_registry_is_per_provider_and_model():
+    registry = ConcurrencyRegistry(overrides={"openai": {"initial_limit": 8}, "openai:gpt-4o-mini": {"initial_limit": 32}})
+    assert registry.get("openai", "gpt-4o-mini").limit == 32
+    assert registry.get("openai", "gpt-4o-2024-08-06").limit == 8
+    assert registry.get("anthropic", "claude-3-5-sonnet-20240620").limit == 16
+    assert registry.get("openai", "gpt-4o-mini") is registry.get("openai", "gpt-4o-mini")
+    assert set(registry.snapshot()) == {"openai:gpt-4o-mini", "openai:gpt-4o-2024-08-06", "anthropic:claude-3-5-sonnet-20240620"}
+
+def test_latency_is_compared_within_each_stage():
+    controller = AIMDController(initial_limit=16, cooldown=0)
+    for _ in range(30):
+        controller.on_success(3.0, key="ranking")
+    for _ in range(15):
+        controller.on_success(25.0, key="analysis")
+    assert controller.limit == 16
+    for _ in range(10):
+        controller.on_success(25.0, key="ranking")
+    assert controller.limit < 16
+
+@pytest.mark.asyncio
+async def test_rate_limit_headers_of_successful_calls_reach_controller(monkeypatch):
+    httpx = _httpx_module("openai")
+    completion = {
+        "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "Paris"}}],
+        "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6},
+    }
+    monkeypatch.setattr(httpx, "AsyncHTTPTransport", lambda **kwargs: httpx.MockTransport(
+        lambda request: httpx.Response(200, json=completion, headers={"x-ratelimit-remaining-requests": "0"})))
+    pools = HTTPPools(TransportConfig())
+    handler = LLMAPIHandler(pools=pools)
+    controller = handler.concurrency.get("openai", "gpt-4o-mini")
+    async with pools:
+        assert await handler.async_process(["Capital of France?"], model="gpt-4o-mini", use_cache=False) == ["Paris"]
+    assert controller.limit == 8
@@ -0,0 +1,111 @@
+import pytest
+import asyncio
+from unittest.mock import MagicMock, patch
+from hedging import Hedger, LatencyTracker
+from llm_api_handler import LLMAPIHandler
+from llm_metrics import DEFAULT_STAGE, MetricsRegistry
+
+def responder(value, delay, error=None):
+    state = {"started": False, "cancelled": False}
+
+    async def call():
+        state["started"] = True
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+        if error:
+            raise error
+        return value
+    return call, state
+
+def test_latency_tracker_percentile():
+    tracker = LatencyTracker(window=100)
+    for latency in range(1, 101):
+        tracker.observe(latency / 100)
+    assert tracker.percentile(50) == pytest.approx(0.51)
+    assert tracker.percentile(95) == pytest.approx(0.96)
+
+@pytest.mark.asyncio
+async def test_no_hedge_without_history():
+    hedger = Hedger(min_samples=1, max_hedge_ratio=1.0)
+    primary, _ = responder("primary", 0.01)
+    backup, backup_state = responder("backup", 0)
+    assert await hedger.run("model", primary, backup) == "primary"
+    assert not backup_state["started"]
+    assert hedger.delay_for("model") == 0.5  # min_delay floor
+
+@pytest.mark.asyncio
+async def test_slow_primary_is_hedged_and_cancelled():
+    hedger = Hedger(min_samples=1, min_delay=0.01, max_hedge_ratio=1.0)
+    hedger.observe("model", 0.01)
+    primary, primary_state = responder("primary", 1.0)
+    backup, _ = responder("backup", 0.01)
+    assert await hedger.run("model", primary, backup) == "backup"
+    assert primary_state["cancelled"]
+    assert hedger.stats()["backup_wins"] == 1
+
+@pytest.mark.asyncio
+async def test_hedge_budget_caps_duplicates():
+    hedger = Hedger(percentile=0, min_samples=1, min_delay=0.01, max_hedge_ratio=0.25, burst=1.0)
+    hedger.observe("model", 0.01)
+    for _ in range(8):
+        primary, _ = responder("primary", 0.03)
+        backup, _ = responder("backup", 0.0)
+        await hedger.run("model", primary, backup)
+    assert hedger.hedges == 2
+
+@pytest.mark.asyncio
+async def test_failed_primary_falls_back_to_backup_and_errors_propagate():
+    hedger = Hedger(min_samples=1, min_delay=0.01, max_hedge_ratio=1.0)
+    hedger.observe("model", 0.01)
+    primary, _ = responder(None, 0.02, error=ValueError("primary failed"))
+    backup, _ = responder("backup", 0.03)
+    assert await hedger.run("model", primary, backup) == "backup"
+
+    primary, _ = responder(None, 0.0, error=ValueError("primary failed"))
+    backup, backup_state = responder("backup", 0.0)
+    with pytest.raises(ValueError, match="primary failed"):
+        await hedger.run("model", primary, backup)
+    assert not backup_state["started"]
+
+@pytest.mark.asyncio
+async def test_handler_hedges_to_fallback_model():
+    metrics = MetricsRegistry()
+    hedger = Hedger(min_samples=1, min_delay=0.01, max_hedge_ratio=1.0,
+                    fallback_models={"gpt-4o-mini": "claude-3-5-sonnet-20240620"})
+    handler = LLMAPIHandler(hedging=hedger, metrics=metrics)
+    hedger.observe(("gpt-4o-mini", DEFAULT_STAGE), 0.01)
+
+    async def slow_openai(**kwargs):
+        await asyncio.sleep(1.0)
+
+    async def fast_anthropic(**kwargs):
+        return MagicMock(content=[MagicMock(text="from claude")])
+
+    with patch.object(handler.async_openai_client.chat.completions, 'create', side_effect=slow_openai), \
+         patch.object(handler.async_anthropic_client.messages, 'create', side_effect=fast_anthropic):
+        assert await handler.async_process(["Capital of France?"], model="gpt-4o-mini") == ["from claude"]
+
+    records = {record.model: record for record in metrics.recent()}
+    assert records["claude-3-5-sonnet-20240620"].error is None
+    assert "CancelledError" in records["gpt-4o-mini"].error
+
+@pytest.mark.asyncio
+async def test_handler_tracks_hedge_delays_per_model_and_stage():
+    hedger = Hedger(min_samples=1, min_delay=0.01, max_hedge_ratio=1.0)
+    handler = LLMAPIHandler(hedging=hedger)
+    for _ in range(20):
+        hedger.observe(("gpt-4o-mini", "ranking"), 0.05)
+
+    async def analysis_call(**kwargs):
+        await asyncio.sleep(0.1)  # slower than ranking calls, but normal for an analysis
+        return MagicMock(choices=[MagicMock(message=MagicMock(content="analysis"))])
+
+    with patch.object(handler.async_openai_client.chat.completions, 'create', side_effect=analysis_call) as mock_create:
+        assert await handler.async_process(["Analyze this paper"], model="gpt-4o-mini", stage="analysis") == ["analysis"]
+
+    assert mock_create.call_count == 1
+    assert hedger.hedges == 0
+    assert hedger.delay_for(("gpt-4o-mini", "analysis")) == pytest.approx(0.1, abs=0.05)
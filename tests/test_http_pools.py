@@ -0,0 +1,86 @@
+import sys
+import pytest
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from llm_api_handler import LLMAPIHandler
+from http_pools import HTTPPools, TransportConfig, _httpx_module, _loop_aware_transport_class
+
+class HeadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def local_origin():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), HeadHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+def test_transport_config_from_env(monkeypatch):
+    monkeypatch.setenv("HTTP_MAX_CONNECTIONS", "12")
+    monkeypatch.setenv("LLM_HTTP2", "1")
+    config = TransportConfig.from_env()
+    assert config.max_connections == 12
+    assert config.http2 is True
+
+def test_handlers_share_sdk_http_clients():
+    pools = HTTPPools(TransportConfig())
+    first, second = LLMAPIHandler(pools=pools), LLMAPIHandler(pools=pools)
+    assert first.async_openai_client is not second.async_openai_client
+    assert first.async_openai_client._client is second.async_openai_client._client is pools.sdk_http_client("openai")
+    assert first.anthropic_client._client is pools.sdk_http_client("anthropic", is_async=False)
+    pools.close()
+
+def test_http2_falls_back_without_h2(monkeypatch):
+    pools = HTTPPools(TransportConfig(http2=True))
+    monkeypatch.setitem(sys.modules, "h2", None)
+    assert pools._http2_enabled() is False
+
+def test_loop_aware_transport_keeps_one_pool_per_loop():
+    httpx = _httpx_module("openai")
+    created = []
+
+    def factory():
+        created.append(httpx.MockTransport(lambda request: httpx.Response(200, text="ok")))
+        return created[-1]
+
+    client = httpx.AsyncClient(transport=_loop_aware_transport_class(httpx)(factory))
+
+    async def fetch_twice():
+        for _ in range(2):
+            assert (await client.get("http://example.test/")).text == "ok"
+
+    asyncio.run(fetch_twice())
+    asyncio.run(fetch_twice())
+    assert len(created) == 2
+
+def test_aiohttp_session_is_shared_within_a_loop_and_closed_on_exit():
+    pools = HTTPPools(TransportConfig())
+
+    async def use():
+        async with pools:
+            session = pools.aiohttp_session()
+            assert pools.aiohttp_session() is session
+        assert session.closed
+        return session
+
+    assert asyncio.run(use()) is not asyncio.run(use())
+
+@pytest.mark.asyncio
+async def test_warm_up_opens_connections_and_reports_failures(local_origin):
+    pools = HTTPPools(TransportConfig(warm_up_timeout=2))
+    async with pools:
+        results = await pools.warm_up([
+            (local_origin, "aiohttp"),
+            (local_origin + "/", "openai"),
+            ("http://127.0.0.1:9", "aiohttp"),
+        ])
+    assert results == {local_origin: True, local_origin + "/": True, "http://127.0.0.1:9": False}
@@ -0,0 +1,104 @@
+import json
+import pytest
+import urllib.request
+from unittest.mock import AsyncMock, MagicMock, patch
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.completion_usage import CompletionUsage, PromptTokensDetails
+from llm_api_handler import LLMAPIHandler
+from llm_metrics import (CallRecord, Histogram, MetricsRegistry, estimate_cost, stage,
+                         start_metrics_server, usage_breakdown)
+
+def completion(content="Paris"):
+    return ChatCompletion(
+        id="chatcmpl-123",
+        choices=[Choice(index=0, message=ChatCompletionMessage(role="assistant", content=content), finish_reason="stop")],
+        created=1677652288,
+        model="gpt-4o-mini",
+        object="chat.completion",
+        usage=CompletionUsage(prompt_tokens=1000, completion_tokens=200, total_tokens=1200,
+                              prompt_tokens_details=PromptTokensDetails(cached_tokens=400))
+    )
+
+def test_usage_breakdown_for_both_providers():
+    assert usage_breakdown(completion()) == (1000, 200, 400)
+    anthropic_message = MagicMock(usage=MagicMock(spec=["input_tokens", "output_tokens", "cache_read_input_tokens"],
+                                                  input_tokens=50, output_tokens=20, cache_read_input_tokens=100))
+    assert usage_breakdown(anthropic_message) == (150, 20, 100)
+    assert usage_breakdown(MagicMock(usage=None)) == (0, 0, 0)
+
+def test_estimate_cost_discounts_cached_tokens():
+    assert estimate_cost("gpt-4o-mini", 1_000_000, 0) == pytest.approx(0.15)
+    assert estimate_cost("gpt-4o-mini", 1_000_000, 1_000_000, cached_tokens=1_000_000) == pytest.approx(0.675)
+    assert estimate_cost("unknown-model", 1000, 1000) == 0.0
+
+def test_histogram_percentiles():
+    histogram = Histogram(buckets=(1.0, 10.0))
+    for value in range(1, 101):
+        histogram.observe(value / 10)
+    assert histogram.percentile(50) == pytest.approx(5.1)
+    assert histogram.percentile(99) == pytest.approx(10.0)
+    assert histogram.counts == [10, 90, 0]
+
+def test_registry_exports_prometheus_and_json():
+    registry = MetricsRegistry()
+    registry.record(CallRecord(stage="ranking", provider="openai", model="gpt-4o-mini",
+                               prompt_tokens=100, completion_tokens=10, wall_time=0.3, retries=1, cost=0.001))
+    registry.record(CallRecord(stage="ranking", provider="openai", model="gpt-4o-mini", cache_hit=True))
+
+    series = json.loads(registry.to_json())["series"]
+    assert len(series) == 1
+    assert series[0]["calls"] == 2
+    assert series[0]["cache_hits"] == 1
+    assert series[0]["wall_time_seconds"]["count"] == 1
+
+    text = registry.to_prometheus()
+    labels = 'stage="ranking",provider="openai",model="gpt-4o-mini"'
+    assert f"llm_calls_total{{{labels}}} 2" in text
+    assert f"llm_retries_total{{{labels}}} 1" in text
+    assert f'llm_call_duration_seconds_bucket{{{labels},le="0.5"}} 1' in text
+    assert f'llm_call_duration_seconds_bucket{{{labels},le="+Inf"}} 1' in text
+
+def test_metrics_server_serves_both_formats():
+    registry = MetricsRegistry()
+    registry.record(CallRecord(stage="synthesis", provider="openai", model="gpt-4o-mini"))
+    server = start_metrics_server(port=0, metrics=registry)
+    try:
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{base}/metrics") as response:
+            assert b'stage="synthesis"' in response.read()
+        with urllib.request.urlopen(f"{base}/metrics.json") as response:
+            assert json.load(response)["series"][0]["stage"] == "synthesis"
+    finally:
+        server.shutdown()
+
+@pytest.mark.asyncio
+async def test_handler_records_calls_by_stage():
+    registry = MetricsRegistry()
+    handler = LLMAPIHandler(metrics=registry)
+    with patch.object(handler.async_openai_client.chat.completions, 'create', new_callable=AsyncMock) as mock_create:
+        mock_create.return_value = completion()
+        await handler.async_process(prompts=["Capital of France?"], model="gpt-4o-mini", stage="analysis")
+        with stage("synthesis"):
+            await handler.async_process(prompts=["Capital of Spain?"], model="gpt-4o-mini")
+
+    records = registry.recent()
+    assert [record.stage for record in records] == ["analysis", "synthesis"]
+    assert records[0].prompt_tokens == 1000
+    assert records[0].completion_tokens == 200
+    assert records[0].cached_tokens == 400
+    assert records[0].cost == pytest.approx(estimate_cost("gpt-4o-mini", 1000, 200, 400))
+    assert records[0].retries == 0
+    assert records[0].wall_time >= records[0].queue_wait >= 0
+
+def test_handler_records_failures_with_retries():
+    registry = MetricsRegistry()
+    handler = LLMAPIHandler(metrics=registry, max_retries=1)
+    error = ValueError("bad request")
+    with patch.object(handler.openai_client.chat.completions, 'create', side_effect=error):
+        with pytest.raises(ValueError):
+            handler.process("Capital of France?", model="gpt-4o-mini", stage="query_generation", use_cache=False)
+    record = registry.recent()[0]
+    assert record.stage == "query_generation"
+    assert record.error == repr(error)
+    assert record.retries == 0
@@ -0,0 +1,78 @@
+import pytest
+from unittest.mock import patch
+from model_registry import ModelRegistry, ModelSpec
+from llm_api_handler import LLMAPIHandler
+from llm_metrics import MetricsRegistry
+from analyze_papers import is_consistent_ranking
+from models import Paper, PaperRanking, RankingResponse
+
+def spec(name, input_cost, context_tokens=128_000, tokens_per_second=50):
+    return ModelSpec(name=name, provider="openai", input_cost=input_cost, cached_input_cost=input_cost / 2,
+                     output_cost=input_cost * 4, context_tokens=context_tokens, max_output_tokens=1000,
+                     tokens_per_second=tokens_per_second)
+
+def test_registry_routes_and_unknown_models():
+    registry = ModelRegistry()
+    assert registry.get("claude-3-5-sonnet-20240620").provider == "anthropic"
+    assert [s.name for s in registry.cascade("ranking")] == ["gpt-4o-mini", "gpt-4o-2024-08-06"]
+    assert registry.primary("synthesis") == "gpt-4o-2024-08-06"
+    with pytest.raises(ValueError):
+        registry.get("invalid-model")
+    with pytest.raises(ValueError):
+        registry.set_route("ranking", ["invalid-model"])
+
+def test_unrouted_task_prefers_cheap_then_fast_models():
+    registry = ModelRegistry([spec("slow", 1.0, tokens_per_second=10), spec("fast", 1.0, tokens_per_second=90),
+                              spec("pricey", 5.0)], routes={})
+    assert [s.name for s in registry.cascade("anything")] == ["fast", "slow", "pricey"]
+
+def test_model_cost():
+    mini = ModelRegistry().get("gpt-4o-mini")
+    assert mini.cost(1_000_000, 1_000_000, cached_tokens=1_000_000) == pytest.approx(0.675)
+
+@pytest.mark.asyncio
+async def test_cascade_escalates_only_invalid_responses():
+    handler = LLMAPIHandler(cache=None, metrics=MetricsRegistry())
+    calls = []
+
+    async def fake_async_process(self, prompts, model, **kwargs):
+        calls.append((model, list(prompts)))
+        if model == "gpt-4o-mini":
+            return ["bad" if prompt == "hard" else f"ok {prompt}" for prompt in prompts[:-1]] + [ValueError("boom")]
+        return [f"ok {prompt} on {model}" for prompt in prompts]
+
+    with patch.object(LLMAPIHandler, "async_process", fake_async_process):
+        results = await handler.async_process_cascade(
+            ["easy", "hard", "flaky"], task="ranking", validate=lambda i, response: response.startswith("ok"))
+
+    assert results == ["ok easy", "ok hard on gpt-4o-2024-08-06", "ok flaky on gpt-4o-2024-08-06"]
+    assert calls == [("gpt-4o-mini", ["easy", "hard", "flaky"]), ("gpt-4o-2024-08-06", ["hard", "flaky"])]
+
+@pytest.mark.asyncio
+async def test_cascade_skips_tiers_too_small_for_the_prompt_and_raises_final_errors():
+    registry = ModelRegistry([spec("small", 0.1, context_tokens=1100), spec("large", 1.0)],
+                             routes={"analysis": ["small", "large"]})
+    handler = LLMAPIHandler(cache=None, metrics=MetricsRegistry(), model_registry=registry)
+    calls = []
+
+    async def fake_async_process(self, prompts, model, **kwargs):
+        calls.append((model, list(prompts)))
+        return [ValueError("down") if model == "large" else "ok" for _ in prompts]
+
+    with patch.object(LLMAPIHandler, "async_process", fake_async_process):
+        results = await handler.async_process_cascade(["short", "word " * 2000], task="analysis",
+                                                      return_exceptions=True)
+        assert results[0] == "ok"
+        assert isinstance(results[1], ValueError)
+        assert calls == [("small", ["short"]), ("large", ["word " * 2000])]
+        with pytest.raises(ValueError):
+            await handler.async_process_cascade(["word " * 2000], task="analysis")
+
+def test_ranking_validation_requires_each_paper_ranked_once():
+    group = [Paper(id=f"paper_{i}", title=f"Paper {i}", authors=[], full_text="") for i in range(2)]
+    def response(*pairs):
+        return RankingResponse(rankings=[PaperRanking(paper_id=pid, rank=rank, explanation="") for pid, rank in pairs])
+    assert is_consistent_ranking(group, response(("paper_0", 2), ("paper_1", 1)))
+    assert not is_consistent_ranking(group, response(("paper_0", 1), ("paper_1", 1)))
+    assert not is_consistent_ranking(group, response(("paper_0", 1), ("paper_9", 2)))
+    assert not is_consistent_ranking(group, ValueError("failed"))
@@ -0,0 +1,91 @@
+import pytest
+import asyncio
+from unittest.mock import MagicMock, patch
+from llm_api_handler import LLMAPIHandler
+from llm_metrics import MetricsRegistry
+from request_scheduler import RequestScheduler, PRIORITY_CLASSES, resolve_priority, tenant
+
+async def admission_order(scheduler, requests):
+    """Hold the only admission, queue `requests` as (label, priority, tenant), then record service order."""
+    order = []
+    await scheduler.acquire()
+
+    async def request(label, priority, tenant_name):
+        async with scheduler.admit(priority, tenant_name):
+            order.append(label)
+            await asyncio.sleep(0)
+
+    tasks = []
+    for label, priority, tenant_name in requests:
+        tasks.append(asyncio.create_task(request(label, priority, tenant_name)))
+        await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+def test_resolve_priority():
+    assert resolve_priority(None, "synthesis") < resolve_priority(None, "analysis") < resolve_priority(None, "ranking")
+    assert resolve_priority("batch") == PRIORITY_CLASSES["batch"]
+    assert resolve_priority(7) == 7
+    with pytest.raises(ValueError):
+        resolve_priority("urgent")
+
+@pytest.mark.asyncio
+async def test_higher_priority_classes_are_served_first():
+    scheduler = RequestScheduler(capacity=1)
+    order = await admission_order(scheduler, [
+        ("ranking", 2, "a"), ("batch", 3, "a"), ("analysis", 1, "a"), ("synthesis", 0, "b"),
+    ])
+    assert order == ["synthesis", "analysis", "ranking", "batch"]
+    assert scheduler.stats()["wait"][0]["admitted"] == 1
+
+@pytest.mark.asyncio
+async def test_tenants_share_a_class_fairly():
+    scheduler = RequestScheduler(capacity=1)
+    order = await admission_order(scheduler, [(f"a{i}", 2, "a") for i in range(4)] + [("b0", 2, "b"), ("b1", 2, "b")])
+    assert order == ["a0", "b0", "a1", "b1", "a2", "a3"]
+
+@pytest.mark.asyncio
+async def test_tenant_weights():
+    scheduler = RequestScheduler(capacity=1, tenant_weights={"heavy": 2.0})
+    order = await admission_order(scheduler, [(f"h{i}", 1, "heavy") for i in range(4)] + [(f"l{i}", 1, "light") for i in range(2)])
+    assert order == ["h0", "h1", "l0", "h2", "h3", "l1"]
+
+@pytest.mark.asyncio
+async def test_cancelled_waiters_do_not_leak_admissions():
+    scheduler = RequestScheduler(capacity=1)
+    await scheduler.acquire()
+    waiter = asyncio.create_task(scheduler.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert scheduler.queue_depth == 0
+    scheduler.release()
+    assert scheduler.in_flight == 0
+    assert await scheduler.acquire() == 0.0
+
+@pytest.mark.asyncio
+async def test_interactive_call_overtakes_ranking_fan_out():
+    metrics = MetricsRegistry()
+    handler = LLMAPIHandler(concurrency_limits={"anthropic": {"initial_limit": 1, "max_limit": 1}}, metrics=metrics)
+    served = []
+
+    async def fake_create(**kwargs):
+        served.append(kwargs["messages"][-1]["content"])
+        await asyncio.sleep(0.01)
+        return MagicMock(content=[MagicMock(text="ok")])
+
+    model = "claude-3-5-sonnet-20240620"
+    with patch.object(handler.async_anthropic_client.messages, 'create', side_effect=fake_create):
+        with tenant("user-a"):
+            ranking = asyncio.create_task(handler.async_process(
+                [f"rank {i}" for i in range(5)], model=model, stage="ranking"))
+        await asyncio.sleep(0.005)
+        await handler.async_process(["synthesize"], model=model, stage="synthesis", tenant="user-b")
+        await ranking
+
+    assert served.index("synthesize") <= 2
+    records = {record.tenant for record in metrics.recent()}
+    assert records == {"user-a", "user-b"}
+    assert max(record.schedule_wait for record in metrics.recent()) > 0
@@ -0,0 +1,68 @@
+import json
+import pytest
+from pydantic import BaseModel
+from request_templates import _openai_response_format, compile_request
+from models import PaperAnalysis, RankingResponse, SearchQueries, SynthesisResponse
+
+class ResponseModel(BaseModel):
+    answer: str
+    confidence: float
+
+def test_compile_request_is_cached():
+    first = compile_request("openai", "gpt-4o-mini", None, ResponseModel)
+    assert compile_request("openai", "gpt-4o-mini", None, ResponseModel) is first
+    assert compile_request("openai", "gpt-4o-mini", "Be brief.", ResponseModel) is not first
+
+def test_openai_messages_and_response_format():
+    compiled = compile_request("openai", "gpt-4o-mini", "Be brief.", ResponseModel)
+    messages = compiled.messages("Capital of France?")
+    assert messages[0]["content"].startswith("Answer exclusively in this JSON format:")
+    assert messages[-1] == {"role": "user", "content": "Capital of France?"}
+    assert compiled.openai_response_format["type"] == "json_schema"
+
+    plain = compile_request("openai", "gpt-4o-mini", None, None)
+    assert plain.messages("Hi") == [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": "Hi"}
+    ]
+    assert plain.openai_response_format is None
+
+@pytest.mark.parametrize("response_format", [RankingResponse, PaperAnalysis, SearchQueries, SynthesisResponse])
+def test_openai_response_format_is_strict(response_format):
+    param = _openai_response_format(response_format)
+    assert param["json_schema"]["strict"] is True
+    ranking = _openai_response_format(RankingResponse)["json_schema"]["schema"]["$defs"]["PaperRanking"]
+    assert ranking["additionalProperties"] is False
+    assert ranking["required"] == ["paper_id", "rank", "explanation"]
+    # Same parameter the OpenAI SDK's own parse helper builds, where that private helper exists
+    try:
+        from openai.lib._parsing._completions import type_to_response_format_param
+    except ImportError:
+        return
+    assert param == type_to_response_format_param(response_format)
+
+def test_anthropic_prompt_carries_schema():
+    compiled = compile_request("anthropic", "claude-3-5-sonnet-20240620", None, ResponseModel)
+    messages = compiled.messages("Capital of Germany?")
+    assert len(messages) == 1
+    assert messages[0]["content"].endswith("\n\nCapital of Germany?")
+    assert compiled.schema_text in messages[0]["content"]
+
+def test_batch_line_matches_full_serialization():
+    compiled = compile_request("openai", "gpt-4o-mini", "Be brief.", ResponseModel)
+    prompt = 'Quote "this" \\ and ünïcode\n'
+    line = compiled.batch_line("request_7", prompt, 0.3)
+    record = json.loads(line)
+    assert line.endswith(b"\n")
+    assert record["custom_id"] == "request_7"
+    assert record["body"]["temperature"] == 0.3
+    assert [m["role"] for m in record["body"]["messages"]] == ["system", "system", "user"]
+    assert record["body"]["messages"][-1]["content"] == prompt
+
+def test_decode_fast_path_and_fallback():
+    compiled = compile_request("anthropic", "claude-3-5-sonnet-20240620", None, ResponseModel)
+    assert compiled.decode('{"answer": "Paris", "confidence": 0.9}').answer == "Paris"
+    assert compiled.decode('Sure:\n{"answer": "Rome", "confidence": 0.8}\nDone').answer == "Rome"
+    with pytest.raises(ValueError):
+        compiled.decode("no json here")
+    assert compile_request("openai", "gpt-4o-mini", None, None).decode("plain text") == "plain text"
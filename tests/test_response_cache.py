@@ -0,0 +1,120 @@
+import pytest
+import asyncio
+import itertools
+from unittest.mock import AsyncMock, patch
+from pydantic import BaseModel
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from llm_api_handler import LLMAPIHandler
+from response_cache import ResponseCache, MISS, make_cache_key
+
+class ResponseModel(BaseModel):
+    answer: str
+    confidence: float
+
+class OtherModel(BaseModel):
+    answer: str
+
+REQUEST = {
+    "model": "gpt-4o-mini",
+    "prompt": "What's the capital of France?",
+    "system_message": None,
+    "temperature": 0.7
+}
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite3"))
+    yield cache
+    cache.close()
+
+def test_cache_key_depends_on_request_and_schema():
+    key = make_cache_key(REQUEST, ResponseModel)
+    assert key == make_cache_key(dict(REQUEST), ResponseModel)
+    assert key != make_cache_key(REQUEST, OtherModel)
+    assert key != make_cache_key(REQUEST, None)
+    assert key != make_cache_key({**REQUEST, "temperature": 0.2}, ResponseModel)
+
+def test_cache_key_generates_schema_once_per_model():
+    class FreshModel(BaseModel):
+        answer: str
+
+    with patch.object(FreshModel, "model_json_schema", wraps=FreshModel.model_json_schema) as mock_schema:
+        keys = {make_cache_key({**REQUEST, "prompt": f"Question {i}"}, FreshModel) for i in range(3)}
+    assert len(keys) == 3
+    assert mock_schema.call_count == 1
+
+def test_cache_rehydrates_models_and_text(cache):
+    cache.set("model_key", ResponseModel(answer="Paris", confidence=0.9))
+    cache.set("text_key", "Paris")
+    cached = cache.get("model_key", ResponseModel)
+    assert isinstance(cached, ResponseModel)
+    assert cached.answer == "Paris"
+    assert cache.get("text_key") == "Paris"
+    assert cache.get("missing") is MISS
+
+def test_cache_ttl_expiry(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite3"), ttl_seconds=60)
+    with patch("response_cache.time.time", return_value=1000.0):
+        cache.set("key", "value")
+    with patch("response_cache.time.time", return_value=1030.0):
+        assert cache.get("key") == "value"
+    with patch("response_cache.time.time", return_value=1100.0):
+        assert cache.get("key") is MISS
+
+def test_cache_lru_eviction(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite3"), ttl_seconds=None, max_entries=2)
+    with patch("response_cache.time.time", side_effect=itertools.count(1.0)):
+        cache.set("a", "A")
+        cache.set("b", "B")
+        assert cache.get("a") == "A"  # touches "a", so "b" is now least recently used
+        cache.set("c", "C")
+    assert cache.get("b") is MISS
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+
+@pytest.mark.asyncio
+async def test_async_process_uses_cache(cache):
+    handler = LLMAPIHandler(cache=cache)
+    with patch.object(handler.async_openai_client.chat.completions, 'create', new_callable=AsyncMock) as mock_create:
+        mock_create.return_value = ChatCompletion(
+            id="chatcmpl-123",
+            choices=[Choice(index=0, message=ChatCompletionMessage(role="assistant", content="Paris"), finish_reason="stop")],
+            created=1677652288,
+            model="gpt-4o-mini",
+            object="chat.completion"
+        )
+        first = await handler.async_process(prompts=["Capital of France?"], model="gpt-4o-mini")
+        second = await handler.async_process(prompts=["Capital of France?"], model="gpt-4o-mini")
+        assert first == second == ["Paris"]
+        assert mock_create.call_count == 1
+
+        await handler.async_process(prompts=["Capital of France?"], model="gpt-4o-mini", use_cache=False)
+        assert mock_create.call_count == 2
+
+        await handler.async_process(prompts=["Capital of France?"], model="gpt-4o-mini", refresh_cache=True)
+        assert mock_create.call_count == 3
+
+def test_cache_keeps_running_totals_and_sweeps_periodically(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "cache.sqlite3"), max_entries=3, sweep_every=100)
+    with patch.object(cache, "_count", wraps=cache._count) as count:
+        cache.set("a", "AAAA")
+        cache.set("a", "AA")
+        cache.set("b", "B")
+        cache.delete("b")
+        assert count.call_count == 0
+        for key in "cdef":
+            cache.set(key, key)
+        assert count.call_count == 2  # only the writes that went over max_entries
+    assert (cache._entries, cache._bytes) == (3, 3)
+    assert cache.stats() == {"entries": 3, "bytes": 3}
+    assert cache.get("a") is MISS
+    cache.close()
+
+@pytest.mark.asyncio
+async def test_async_cache_access_runs_off_the_event_loop(cache):
+    with patch("response_cache.asyncio.to_thread", wraps=asyncio.to_thread) as to_thread:
+        await cache.aset("key", ResponseModel(answer="Paris", confidence=0.9))
+        cached = await cache.aget("key", ResponseModel)
+    assert cached.answer == "Paris"
+    assert to_thread.call_count == 2
@@ -0,0 +1,108 @@
+import pytest
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+from llm_api_handler import LLMAPIHandler
+from retry_policy import CircuitBreaker, CircuitOpenError, is_retryable, jittered_backoff, retry_after_seconds
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = MagicMock(headers=headers or {})
+
+class APIConnectionError(Exception):
+    pass
+
+def test_is_retryable():
+    assert is_retryable(StatusError(429))
+    assert is_retryable(StatusError(503))
+    assert is_retryable(APIConnectionError())
+    assert not is_retryable(StatusError(400))
+    assert not is_retryable(ValueError("bad json"))
+    assert not is_retryable(CircuitOpenError("open"))
+
+def test_backoff_honours_retry_after():
+    assert retry_after_seconds(StatusError(429, {"Retry-After": "7"})) == 7
+    assert retry_after_seconds(StatusError(429, {"retry-after-ms": "1500"})) == 1.5
+    wait = jittered_backoff(base=0.01, max_value=30)
+    wait.send(None)
+    assert wait.send(StatusError(429, {"retry-after": "7"})) >= 7
+    assert wait.send(StatusError(500)) <= 0.02
+
+def test_circuit_breaker_opens_and_recovers():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=10)
+    with patch("retry_policy.time.monotonic", return_value=100.0):
+        breaker.record_failure(StatusError(429))  # throttling does not count
+        breaker.record_failure(StatusError(500))
+        breaker.before_call()
+        breaker.record_failure(StatusError(502))
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+    with patch("retry_policy.time.monotonic", return_value=111.0):
+        breaker.before_call()  # half-open probe
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+@pytest.mark.asyncio
+async def test_handler_retries_transient_errors():
+    handler = LLMAPIHandler()
+    with patch.object(handler.async_anthropic_client.messages, 'create', new_callable=AsyncMock) as mock_create, \
+         patch("retry_policy.random.uniform", return_value=0):
+        mock_create.side_effect = [StatusError(529), StatusError(500), MagicMock(content=[MagicMock(text="Berlin")])]
+        response = await handler.async_process(prompts=["Capital of Germany?"], model="claude-3-5-sonnet-20240620")
+        assert response == ["Berlin"]
+        assert mock_create.call_count == 3
+
+@pytest.mark.asyncio
+async def test_handler_returns_exceptions_without_losing_other_results():
+    handler = LLMAPIHandler(max_retries=0)
+    with patch.object(handler.async_anthropic_client.messages, 'create', new_callable=AsyncMock) as mock_create:
+        mock_create.side_effect = [MagicMock(content=[MagicMock(text="Berlin")]), StatusError(400)]
+        response = await handler.async_process(
+            prompts=["Capital of Germany?", "Capital of Italy?"],
+            model="claude-3-5-sonnet-20240620",
+            return_exceptions=True
+        )
+        assert response[0] == "Berlin"
+        assert isinstance(response[1], StatusError)
+
+@pytest.mark.asyncio
+async def test_handler_fails_fast_when_circuit_open():
+    handler = LLMAPIHandler()
+    handler.circuit_breakers["anthropic"] = CircuitBreaker("anthropic", failure_threshold=1, reset_timeout=60)
+    handler.circuit_breakers["anthropic"].record_failure(StatusError(503))
+    with patch.object(handler.async_anthropic_client.messages, 'create', new_callable=AsyncMock) as mock_create:
+        with pytest.raises(CircuitOpenError):
+            await handler.async_process(prompts=["Capital of Germany?"], model="claude-3-5-sonnet-20240620")
+        mock_create.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_cancelled_probe_does_not_wedge_circuit():
+    handler = LLMAPIHandler(max_retries=0)
+    breaker = handler.circuit_breakers["anthropic"] = CircuitBreaker("anthropic", failure_threshold=1, reset_timeout=10)
+    started = asyncio.Event()
+
+    async def hang(**kwargs):
+        started.set()
+        await asyncio.sleep(60)
+
+    with patch("retry_policy.time.monotonic", return_value=100.0):
+        breaker.record_failure(StatusError(503))
+    with patch("retry_policy.time.monotonic", return_value=111.0), \
+         patch.object(handler.async_anthropic_client.messages, 'create', side_effect=hang):
+        probe = asyncio.create_task(handler.async_process(prompts=["Capital of Germany?"], model="claude-3-5-sonnet-20240620"))
+        await started.wait()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert breaker.state == CircuitBreaker.OPEN
+    with patch("retry_policy.time.monotonic", return_value=112.0), \
+         patch.object(handler.async_anthropic_client.messages, 'create', new_callable=AsyncMock) as mock_create:
+        mock_create.return_value = MagicMock(content=[MagicMock(text="Berlin")])
+        response = await handler.async_process(prompts=["Capital of Germany?"], model="claude-3-5-sonnet-20240620")
+    assert response == ["Berlin"]
+    assert breaker.state == CircuitBreaker.CLOSED
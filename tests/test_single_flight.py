@@ -0,0 +1,100 @@
+import pytest
+import asyncio
+import threading
+import time
+from single_flight import SingleFlight
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "value"
+
+    results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+    assert results == ["value"] * 5
+    assert calls == 1
+    assert flight.stats() == {"in_flight": 0, "coalesced": 4}
+
+    # Finished calls are not remembered
+    assert await flight.do("key", fetch) == "value"
+    assert calls == 2
+
+@pytest.mark.asyncio
+async def test_errors_are_shared_with_followers():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+
+@pytest.mark.asyncio
+async def test_follower_takes_over_when_leader_is_cancelled():
+    flight = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return calls
+
+    leader = asyncio.create_task(flight.do("key", fetch))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(flight.do("key", fetch))
+    await asyncio.sleep(0.01)
+    leader.cancel()
+    assert await follower == 2
+    assert flight.in_flight == 0
+
+@pytest.mark.asyncio
+async def test_cancelled_follower_does_not_cancel_the_call():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "value"
+
+    leader = asyncio.create_task(flight.do("key", fetch))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(flight.do("key", fetch))
+    await asyncio.sleep(0.005)
+    follower.cancel()
+    assert await leader == "value"
+
+def test_calls_coalesce_across_threads_and_event_loops():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = 0
+
+    def fetch():
+        nonlocal calls
+        calls += 1
+        started.set()
+        release.wait(5)
+        return "value"
+
+    async def fetch_async():
+        return flight.do_sync("key", lambda: "unused")
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do_sync("key", fetch)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(asyncio.run(flight.do("key", fetch_async))))
+    follower.start()
+    while flight.coalesced == 0:
+        time.sleep(0.001)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == ["value", "value"]
+    assert calls == 1
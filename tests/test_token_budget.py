@@ -0,0 +1,66 @@
+import pytest
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+from token_budget import TokenBucket, TokenBudgets, chunk_text, count_tokens, estimate_prompt_tokens, usage_tokens
+from llm_api_handler import LLMAPIHandler
+
+def test_estimate_prompt_tokens_grows_with_content():
+    short = estimate_prompt_tokens([{"role": "user", "content": "hi"}])
+    long = estimate_prompt_tokens([{"role": "user", "content": "hi " * 500}])
+    assert 0 < short < long
+
+def test_chunk_text_packs_paragraphs_and_splits_long_ones():
+    assert chunk_text("short text", max_tokens=100) == ["short text"]
+    paragraphs = ["alpha beta gamma delta " * 20] * 6 + ["x" * 4000]
+    chunks = chunk_text("\n\n".join(paragraphs), max_tokens=300, overlap_tokens=20)
+    assert len(chunks) > 3
+    assert all(count_tokens(chunk) <= 301 for chunk in chunks)
+    assert chunks[0].startswith("alpha") and "\n\n" in chunks[0]
+    with pytest.raises(ValueError):
+        chunk_text("text", max_tokens=10, overlap_tokens=10)
+
+def test_usage_tokens():
+    assert usage_tokens(MagicMock(usage=MagicMock(total_tokens=42))) == 42
+    assert usage_tokens(MagicMock(usage=MagicMock(total_tokens=None, input_tokens=10, output_tokens=5))) == 15
+    assert usage_tokens(MagicMock(usage=None)) is None
+
+@pytest.mark.asyncio
+async def test_bucket_reserve_and_reconcile():
+    bucket = TokenBucket(tokens_per_minute=6000)
+    reserved = await bucket.reserve(1000)
+    assert reserved == 1000
+    assert bucket.available == pytest.approx(5000, abs=5)
+    bucket.reconcile(reserved, 400)
+    assert bucket.available == pytest.approx(5600, abs=5)
+
+@pytest.mark.asyncio
+async def test_bucket_waits_for_refill():
+    bucket = TokenBucket(tokens_per_minute=6000)  # refills 100 tokens per second
+    await bucket.reserve(6000)
+    waiter = asyncio.create_task(bucket.reserve(10))
+    await asyncio.sleep(0.01)
+    assert not waiter.done()
+    assert bucket.queue_depth == 1
+    assert await asyncio.wait_for(waiter, timeout=1) == 10
+
+@pytest.mark.asyncio
+async def test_bucket_caps_oversized_requests():
+    bucket = TokenBucket(tokens_per_minute=100)
+    assert await bucket.reserve(10_000) == 100
+
+def test_budgets_unmetered_without_limit():
+    budgets = TokenBudgets({"openai:gpt-4o-mini": 1000})
+    assert budgets.get("openai", "gpt-4o-mini").capacity == 1000
+    assert budgets.get("anthropic", "claude-3-5-sonnet-20240620") is None
+
+@pytest.mark.asyncio
+async def test_handler_reconciles_with_reported_usage():
+    handler = LLMAPIHandler(tpm_limits={"anthropic": 100_000}, expected_completion_tokens=500)
+    with patch.object(handler.async_anthropic_client.messages, 'create', new_callable=AsyncMock) as mock_create:
+        mock_create.return_value = MagicMock(
+            content=[MagicMock(text="Berlin")],
+            usage=MagicMock(total_tokens=None, input_tokens=20, output_tokens=5)
+        )
+        await handler.async_process(prompts=["Capital of Germany?"], model="claude-3-5-sonnet-20240620")
+    bucket = handler.token_budgets.get("anthropic", "claude-3-5-sonnet-20240620")
+    assert bucket.available == pytest.approx(100_000 - 25, abs=50)
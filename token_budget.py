@@ -0,0 +1,216 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Per-message framing overhead used by OpenAI's chat format
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """Return a tiktoken encoding for `model`, or None if tiktoken or its data is unavailable."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception as e:
+        logger.warning(f"Could not load tiktoken encoding for {model}: {e}")
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning(f"Could not load tiktoken o200k_base encoding: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """Count tokens in `text`, falling back to ~4 characters per token without tiktoken."""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def chunk_text(text: str, max_tokens: int, overlap_tokens: int = 0, model: str = "gpt-4o-mini") -> List[str]:
+    """
+    Split `text` into chunks of at most ~`max_tokens` tokens. Chunks are packed from whole
+    paragraphs where possible; paragraphs longer than a chunk are cut into token windows that
+    overlap by `overlap_tokens`.
+    """
+    if max_tokens <= 0:
+        raise ValueError("max_tokens must be positive")
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens must be smaller than max_tokens")
+    if count_tokens(text, model) <= max_tokens:
+        return [text] if text else []
+
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for paragraph in (p for p in text.split("\n\n") if p.strip()):
+        tokens = count_tokens(paragraph, model)
+        if tokens > max_tokens:
+            if current:
+                chunks.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split_tokens(paragraph, max_tokens, overlap_tokens, model))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(paragraph)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def _split_tokens(text: str, max_tokens: int, overlap_tokens: int, model: str) -> List[str]:
+    """Cut `text` into overlapping windows of `max_tokens` tokens (or ~4 characters per token without tiktoken)."""
+    encoding = _get_encoding(model)
+    step = max_tokens - overlap_tokens
+    if encoding is None:
+        size, step = max_tokens * 4, step * 4
+        return [text[i:i + size] for i in range(0, max(len(text) - overlap_tokens * 4, 1), step)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, max(len(tokens) - overlap_tokens, 1), step)]
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, Any]], model: str = "gpt-4o-mini") -> int:
+    """Estimate the prompt tokens of a chat request."""
+    total = TOKENS_PER_REPLY
+    for message in messages:
+        total += TOKENS_PER_MESSAGE + count_tokens(str(message.get("content") or ""), model)
+    return total
+
+
+def usage_tokens(response: Any) -> Optional[int]:
+    """Total billed tokens reported by an OpenAI or Anthropic response, if available."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    total = getattr(usage, "total_tokens", None)
+    if isinstance(total, int):
+        return total
+    input_tokens = getattr(usage, "input_tokens", None)
+    output_tokens = getattr(usage, "output_tokens", None)
+    if isinstance(input_tokens, int) and isinstance(output_tokens, int):
+        return input_tokens + output_tokens
+    return None
+
+
+class TokenBucket:
+    """
+    Tokens-per-minute budget. Requests reserve their estimated prompt plus expected
+    completion tokens before dispatch and are served in FIFO order as the bucket refills.
+    Once the real usage is known, `reconcile` refunds or charges the difference.
+    """
+
+    def __init__(self, tokens_per_minute: int, name: str = "default"):
+        self.name = name
+        self.capacity = int(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tokens_per_minute": self.capacity,
+            "available": int(self.available),
+            "queue_depth": self.queue_depth,
+        }
+
+    async def reserve(self, tokens: int) -> int:
+        """Wait until `tokens` are available and take them. Returns the amount reserved."""
+        # A single request larger than the whole bucket is admitted once the bucket is full.
+        tokens = max(0, min(int(tokens), self.capacity))
+        if not self._waiters and self._try_take(tokens):
+            return tokens
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            while True:
+                if self._waiters[0] is waiter:
+                    if self._try_take(tokens):
+                        self._waiters.popleft()
+                        self._wake_head()
+                        return tokens
+                    await asyncio.sleep((tokens - self._tokens) / self.rate)
+                else:
+                    await waiter
+        except asyncio.CancelledError:
+            was_head = bool(self._waiters) and self._waiters[0] is waiter
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+            if was_head:
+                self._wake_head()
+            raise
+
+    def reconcile(self, reserved: int, actual: int) -> None:
+        """Settle a reservation against the tokens actually used."""
+        self._refill()
+        self._tokens = min(float(self.capacity), self._tokens + reserved - actual)
+
+    def _try_take(self, tokens: int) -> bool:
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(float(self.capacity), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wake_head(self) -> None:
+        if self._waiters and not self._waiters[0].done():
+            self._waiters[0].set_result(None)
+
+
+class TokenBudgets:
+    """One TokenBucket per (provider, model). Models without a configured limit are unmetered."""
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None):
+        # `limits` maps "provider:model" or "provider" to tokens per minute
+        self.limits = limits or {}
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+    def get(self, provider: str, model: str) -> Optional[TokenBucket]:
+        key = (provider, model)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            limit = self.limits.get(f"{provider}:{model}", self.limits.get(provider))
+            if not limit:
+                return None
+            bucket = TokenBucket(limit, name=f"{provider}:{model}")
+            self._buckets[key] = bucket
+        return bucket
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {bucket.name: bucket.stats() for bucket in self._buckets.values()}